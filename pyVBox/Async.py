@@ -0,0 +1,344 @@
+"""Asynchronous front end for long-running VirtualBox operations.
+
+Operations are started on a dedicated executor thread, which owns its
+XPCOM state, and return a Future immediately. Operations reported by a
+Progress return a ProgressFuture, which also passes on percent-complete
+updates. For example:
+
+    futures = [Async.powerOn(vm, type="vrdp") for vm in vms]
+    for future in futures:
+        future.addProgressCallback(lambda percent: ...)
+    Async.waitForAll(futures)
+
+Python 2 has no asyncio, so these are thread-based futures in the
+style of concurrent.futures rather than awaitables.
+"""
+
+from Progress import Progress
+import VirtualBoxException
+from VirtualBoxManager import getManager
+
+import Queue
+import sys
+import threading
+import time
+
+class Future(object):
+    """The eventual result of an operation started on an Executor."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._excInfo = None
+        self._callbacks = []
+
+    def done(self):
+        """Has the operation finished, successfully or not?"""
+        return self._done
+
+    def result(self, timeout=None):
+        """Return the result of the operation, waiting for it if needed.
+
+        Timeout is in milliseconds, specify None for an indefinite
+        wait. Raises VirtualBoxTimeoutException on timeout, or the
+        operation's exception if it failed."""
+        self._wait(timeout)
+        if self._excInfo is not None:
+            raise self._excInfo[0], self._excInfo[1], self._excInfo[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the operation, or None.
+
+        Timeout is as for result()."""
+        self._wait(timeout)
+        return self._excInfo[1] if self._excInfo is not None else None
+
+    def addDoneCallback(self, func):
+        """Call func with this Future once the operation has finished.
+
+        If it has already finished, func is called immediately."""
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _wait(self, timeout):
+        """Wait until the operation has finished."""
+        with self._condition:
+            if timeout is None:
+                while not self._done:
+                    # A timeout keeps the wait interruptible
+                    self._condition.wait(1.0)
+            else:
+                deadline = time.time() + timeout / 1000.0
+                while not self._done:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise VirtualBoxException.VirtualBoxTimeoutException(
+                            "Timed out waiting for operation")
+                    self._condition.wait(remaining)
+
+    def _setResult(self, result):
+        self._finish(result, None)
+
+    def _setException(self, excInfo):
+        self._finish(None, excInfo)
+
+    def _finish(self, result, excInfo):
+        with self._condition:
+            self._result = result
+            self._excInfo = excInfo
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for func in callbacks:
+            func(self)
+
+class ProgressFuture(Future):
+    """Future for an operation reported by a Progress.
+
+    The result is the Progress itself. percent is the last percentage
+    seen."""
+
+    def __init__(self, progress, onCompletion=None):
+        Future.__init__(self)
+        self.progress = progress
+        self.percent = 0
+        self._onCompletion = onCompletion
+        self._progressCallbacks = []
+
+    def addProgressCallback(self, func):
+        """Call func with the percent complete each time it changes.
+
+        func is called on the executor thread."""
+        self._progressCallbacks.append(func)
+
+    def _poll(self):
+        """Check on the progress. Return True once finished.
+
+        Called on the executor thread."""
+        try:
+            percent = self.progress.percent
+            if percent != self.percent:
+                self.percent = percent
+                for func in self._progressCallbacks:
+                    func(percent)
+            if not self.progress.completed:
+                return False
+            try:
+                self.progress.checkResult()
+            finally:
+                if self._onCompletion is not None:
+                    self._onCompletion()
+        except Exception:
+            self._setException(sys.exc_info())
+        else:
+            self._setResult(self.progress)
+        return True
+
+class Executor(object):
+    """Runs VirtualBox calls on a dedicated thread.
+
+    Progresses of submitted operations are polled every pollInterval
+    milliseconds, so many operations can be in flight at once."""
+
+    def __init__(self, pollInterval=100):
+        self.pollInterval = pollInterval
+        self._queue = Queue.Queue()
+        self._progresses = []
+        self._shutdown = False
+        # Exception info if the thread could not start
+        self._failure = None
+        # Guards _failure and _shutdown against calls queued as the
+        # thread fails
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        name="pyVBox-Executor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Call func on the executor thread. Returns a Future of its result."""
+        future = Future()
+        self._put(future, func, args, kwargs)
+        return future
+
+    def submitProgress(self, func, *args, **kwargs):
+        """Call func on the executor thread, returning a ProgressFuture.
+
+        func should start an operation and return its Progress, or a
+        tuple of the Progress and a function to call when it completes."""
+        future = ProgressFuture(None)
+        self._put(future, func, args, kwargs)
+        return future
+
+    def shutdown(self, wait=True):
+        """Stop the executor once queued calls have been made.
+
+        Operations still in progress are not waited for."""
+        self._shutdown = True
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+    def _put(self, future, func, args, kwargs):
+        with self._lock:
+            if self._failure is not None:
+                future._setException(self._failure)
+                return
+            if self._shutdown:
+                raise VirtualBoxException.VirtualBoxException(
+                    "Executor has been shut down")
+            self._queue.put((future, func, args, kwargs))
+
+    def _run(self):
+        """Body of the executor thread."""
+        try:
+            manager = getManager()
+            manager.initPerThread()
+        except Exception:
+            self._fail(sys.exc_info())
+            return
+        try:
+            while True:
+                timeout = self.pollInterval / 1000.0
+                if not self._progresses:
+                    timeout = None
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except Queue.Empty:
+                    pass
+                else:
+                    if item is None:
+                        break
+                    self._call(*item)
+                self._progresses = [f for f in self._progresses
+                                    if not f._poll()]
+        finally:
+            manager.deinitPerThread()
+
+    def _fail(self, excInfo):
+        """Fail every queued call with excInfo, the thread being unusable.
+
+        The executor is shut down, and if it is the process-wide one,
+        dropped so the next call starts a new one."""
+        global _executor
+        # Dropped first, so calls failed below are retried on a new one
+        with _executorLock:
+            if _executor is self:
+                _executor = None
+        with self._lock:
+            self._failure = excInfo
+            self._shutdown = True
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                item[0]._setException(excInfo)
+
+    def _call(self, future, func, args, kwargs):
+        """Make a submitted call and settle or track its future."""
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            future._setException(sys.exc_info())
+            return
+        if not isinstance(future, ProgressFuture):
+            future._setResult(result)
+            return
+        if isinstance(result, tuple):
+            future.progress, future._onCompletion = result
+        else:
+            future.progress = result
+        self._progresses.append(future)
+
+######################################################################
+#
+# Process-wide executor and operations using it
+#
+
+_executor = None
+_executorLock = threading.Lock()
+
+def getExecutor():
+    """Return the process-wide Executor, creating it if needed."""
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
+
+def shutdown(wait=True):
+    """Shut down the process-wide Executor, if any."""
+    global _executor
+    with _executorLock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait)
+
+def waitForAll(futures, timeout=None):
+    """Wait for all the futures, returning a list of their results.
+
+    Timeout is in milliseconds for the whole wait, specify None for an
+    indefinite wait."""
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout / 1000.0
+    results = []
+    for future in futures:
+        remaining = None
+        if deadline is not None:
+            remaining = max(0, int((deadline - time.time()) * 1000))
+        results.append(future.result(remaining))
+    return results
+
+def call(func, *args, **kwargs):
+    """Call func on the process-wide Executor, returning a Future."""
+    return getExecutor().submit(func, *args, **kwargs)
+
+def waitForProgress(progress):
+    """Return a ProgressFuture for an existing Progress."""
+    return getExecutor().submitProgress(lambda: progress)
+
+def powerOn(vm, type="gui", env=""):
+    """Start VirtualMachine.powerOn(), returning a ProgressFuture."""
+    def launch():
+        session, progress = vm._launch(type, env)
+        return progress, lambda: session.unlockMachine(wait=False)
+    return getExecutor().submitProgress(launch)
+
+def powerOff(vm):
+    """Start VirtualMachine.powerOff(), returning a ProgressFuture."""
+    return getExecutor().submitProgress(vm.powerOff, wait=False)
+
+def pause(vm):
+    """Start VirtualMachine.pause(), returning a Future."""
+    return call(vm.pause)
+
+def resume(vm):
+    """Start VirtualMachine.resume(), returning a Future."""
+    return call(vm.resume)
+
+def takeSnapshot(vm, name, description=None):
+    """Start VirtualMachine.takeSnapshot(), returning a ProgressFuture."""
+    return getExecutor().submitProgress(vm.takeSnapshot, name, description,
+                                        wait=False)
+
+def deleteSnapshot(vm, snapshot):
+    """Start VirtualMachine.deleteSnapshot(), returning a ProgressFuture."""
+    return getExecutor().submitProgress(vm.deleteSnapshot, snapshot,
+                                        wait=False)
+
+def delete(vm):
+    """Start VirtualMachine.delete(), returning a ProgressFuture."""
+    return getExecutor().submitProgress(vm.delete, wait=False)
+
+def clone(medium, path, newUUID=True):
+    """Start Medium.clone(), returning a ProgressFuture."""
+    return getExecutor().submitProgress(medium.clone, path,
+                                        newUUID=newUUID, wait=False)
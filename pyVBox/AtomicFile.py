@@ -0,0 +1,33 @@
+"""Functions for replacing files so readers never see them half written"""
+
+import VirtualBoxException
+
+import os
+import os.path
+import tempfile
+
+def replace(path, write, mode="w"):
+    """Write a file with write(f), replacing path only once complete.
+
+    The data is written to a temporary file of its own in the same
+    directory, so concurrent writers of path do not interfere."""
+    directory = os.path.dirname(path) or "."
+    tmpPath = None
+    try:
+        fd, tmpPath = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.rename(tmpPath, path)
+    except (IOError, OSError) as e:
+        _remove(tmpPath)
+        raise VirtualBoxException.VirtualBoxFileError(
+            "Error writing %s: %s" % (path, e))
+    except Exception:
+        # Such as data write() cannot serialize
+        _remove(tmpPath)
+        raise
+
+def _remove(tmpPath):
+    """Remove the temporary file at tmpPath, if created."""
+    if tmpPath is not None and os.path.exists(tmpPath):
+        os.remove(tmpPath)
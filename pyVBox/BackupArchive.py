@@ -0,0 +1,271 @@
+"""Compressed tar archives of virtual machines, written as a stream.
+
+    with open("vm1.tar.gz", "wb") as f:
+        archive = ArchiveWriter(f, codec="gzip", threads=4)
+        archive.addFile("/vms/vm1/vm1.vbox", "vm1/vm1.vbox")
+        archive.addFile("/vms/vm1/disk.vdi", "vm1/disk.vdi")
+        archive.close()
+
+The tar stream is cut into chunks which are compressed independently
+on a pool of threads and written out in order as concatenated
+compressed streams. gzip and bzip2 tools read these as a single
+stream; openArchive() reads them back with tarfile. Nothing is staged
+on disk, so the output may be a pipe.
+
+The gzip, bzip2 and none codecs are always available; zstd and lz4
+are available if the zstandard or lz4 packages are installed.
+"""
+
+import VirtualBoxException
+
+import bz2
+import Queue
+import tarfile
+import threading
+import zlib
+
+class Codec(object):
+    """A compression format.
+
+    compress(data, level) returns data as one complete compressed
+    stream. decompressor() returns an object with a decompress(data)
+    method and an unused_data attribute holding any data past the end
+    of the stream."""
+
+    def __init__(self, name, extension, compress, decompressor,
+                 defaultLevel):
+        self.name = name
+        self.extension = extension
+        self.compress = compress
+        self.decompressor = decompressor
+        self.defaultLevel = defaultLevel
+
+def _gzipCompress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+class _NullDecompressor(object):
+    unused_data = ""
+
+    def decompress(self, data):
+        return data
+
+CODECS = {
+    "gzip" : Codec("gzip", ".gz", _gzipCompress,
+                   lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), 6),
+    "bzip2" : Codec("bzip2", ".bz2", lambda data, level: bz2.compress(data,
+                                                                      level),
+                    bz2.BZ2Decompressor, 9),
+    "none" : Codec("none", "", lambda data, level: data, _NullDecompressor,
+                   0),
+    }
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    CODECS["zstd"] = Codec(
+        "zstd", ".zst",
+        lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+        lambda: zstandard.ZstdDecompressor().decompressobj(), 3)
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    CODECS["lz4"] = Codec(
+        "lz4", ".lz4",
+        lambda data, level: lz4.frame.compress(data, compression_level=level),
+        lz4.frame.LZ4FrameDecompressor, 0)
+
+def getCodec(name):
+    """Return the named Codec, raising VirtualBoxNotSupportException if unavailable."""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise VirtualBoxException.VirtualBoxNotSupportException(
+            "Compression codec \"%s\" not available (have %s)" %
+            (name, ", ".join(sorted(CODECS))))
+
+class _ParallelCompressor(object):
+    """File-like object compressing what is written to it onto fileobj.
+
+    Data is cut into chunkSize pieces and compressed on threads worker
+    threads. At most twice as many pieces are held in memory at once."""
+
+    def __init__(self, fileobj, codec, level, threads, chunkSize):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = level
+        self.chunkSize = chunkSize
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self._buffer = []
+        self._buffered = 0
+        self._tasks = Queue.Queue()
+        # Results in the order written, each a Queue of one compressed piece
+        self._pending = Queue.Queue(maxsize=2 * threads)
+        self._error = None
+        self._workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self._compress,
+                                      name="pyVBox-Compressor-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self._writer = threading.Thread(target=self._write,
+                                        name="pyVBox-Compressor-writer")
+        self._writer.daemon = True
+        self._writer.start()
+
+    def write(self, data):
+        self._checkError()
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self.bytesIn += len(data)
+        if self._buffered >= self.chunkSize:
+            data = "".join(self._buffer)
+            while len(data) >= self.chunkSize:
+                self._submit(data[:self.chunkSize])
+                data = data[self.chunkSize:]
+            self._buffer = [data]
+            self._buffered = len(data)
+
+    def close(self):
+        """Compress remaining data and wait for all of it to be written."""
+        if self._buffered:
+            self._submit("".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        for worker in self._workers:
+            self._tasks.put(None)
+        self._pending.put(None)
+        self._writer.join()
+        self._checkError()
+
+    def _submit(self, data):
+        result = Queue.Queue(maxsize=1)
+        # Blocks while too many pieces are outstanding
+        self._pending.put(result)
+        self._tasks.put((data, result))
+
+    def _compress(self):
+        """Body of a compression thread."""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            data, result = task
+            try:
+                result.put(self.codec.compress(data, self.level))
+            except Exception as e:
+                self._error = e
+                result.put("")
+
+    def _write(self):
+        """Body of the thread writing compressed pieces in order."""
+        while True:
+            result = self._pending.get()
+            if result is None:
+                return
+            data = result.get()
+            if self._error is not None:
+                continue
+            try:
+                self.fileobj.write(data)
+            except (IOError, OSError) as e:
+                self._error = e
+            self.bytesOut += len(data)
+
+    def _checkError(self):
+        if self._error is not None:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error writing archive: %s" % self._error)
+
+class ArchiveWriter(object):
+    """Writes files into a compressed tar stream on fileobj.
+
+    codec is the name of one of CODECS, level the compression level,
+    defaulting to the codec's default. threads is the number of
+    compression threads."""
+
+    def __init__(self, fileobj, codec="gzip", level=None, threads=4,
+                 chunkSize=4 * 1024 * 1024):
+        self.codec = getCodec(codec)
+        if level is None:
+            level = self.codec.defaultLevel
+        self._compressor = _ParallelCompressor(fileobj, self.codec, level,
+                                               threads, chunkSize)
+        # tarfile's own buffering is left small, as it copies its whole
+        # buffer on each write; the compressor gathers chunks instead.
+        self._tar = tarfile.open(fileobj=self._compressor, mode="w|")
+
+    @property
+    def bytesIn(self):
+        """Bytes of tar stream written so far."""
+        return self._compressor.bytesIn
+
+    @property
+    def bytesOut(self):
+        """Bytes of compressed output written so far."""
+        return self._compressor.bytesOut
+
+    def addFile(self, path, arcname=None):
+        """Add the file at path to the archive as arcname."""
+        try:
+            self._tar.add(path, arcname=arcname, recursive=False)
+        except (IOError, OSError) as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error archiving %s: %s" % (path, e))
+
+    def close(self):
+        """Finish the archive. Does not close fileobj."""
+        self._tar.close()
+        self._compressor.close()
+
+class _Decompressor(object):
+    """File-like object reading concatenated compressed streams from fileobj."""
+
+    def __init__(self, fileobj, codec, bufferSize=1024 * 1024):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.bufferSize = bufferSize
+        self._decompressor = codec.decompressor()
+        self._data = ""
+        self._offset = 0
+
+    def read(self, size=-1):
+        while (size < 0) or (len(self._data) - self._offset < size):
+            compressed = self.fileobj.read(self.bufferSize)
+            if not compressed:
+                break
+            self._data = (self._data[self._offset:] +
+                          self._decompress(compressed))
+            self._offset = 0
+        if size < 0:
+            size = len(self._data) - self._offset
+        data = self._data[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def _decompress(self, compressed):
+        pieces = []
+        while compressed:
+            try:
+                pieces.append(self._decompressor.decompress(compressed))
+            except EOFError:
+                # bz2 will not take data past the end of a stream
+                self._decompressor = self.codec.decompressor()
+                continue
+            # Data past the end of a stream starts the next one
+            compressed = getattr(self._decompressor, "unused_data", "")
+            if compressed:
+                self._decompressor = self.codec.decompressor()
+        return "".join(pieces)
+
+def openArchive(fileobj, codec="gzip"):
+    """Return a streaming tarfile reading an archive from fileobj."""
+    return tarfile.open(fileobj=_Decompressor(fileobj, getCodec(codec)),
+                        mode="r|")
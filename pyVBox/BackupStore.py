@@ -0,0 +1,292 @@
+"""Content-addressed, deduplicating store for VDI image backups.
+
+Disk images are split into chunks, one per VDI block, and each chunk
+is stored once under its hash however many backups contain it. Disks
+cloned from the same base image therefore share most of their storage.
+
+    store = BackupStore("/backups/store")
+    info = store.backup("/vms/vm1/disk.vdi", name="vm1.disk")
+    store.restore(info["id"], "disk.vdi")
+    store.gc()
+
+The store directory holds:
+
+    chunks/XX/HASH      chunk data, XX being the first two digits of HASH
+    manifests/ID.json   the chunk of each block of backup ID
+    index.json          summary of all backups, oldest first
+    lock, index.lock    files locked while using the store and the index
+
+Any number of processes may back up into a store at once: each holds
+a shared lock on "lock", and an exclusive lock on "index.lock" while
+recording its backup. gc() holds an exclusive lock on "lock", so it
+waits for backups in progress and never removes their chunks.
+"""
+
+import AtomicFile
+from VDI import VDI, _writeBlocks
+import VirtualBoxException
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import os.path
+import time
+
+class BackupStore(object):
+    """A content-addressed backup store in a directory."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def chunkPath(self, digest):
+        return os.path.join(self.path, "chunks", digest[:2], digest)
+
+    def manifestPath(self, backupId):
+        return os.path.join(self.path, "manifests", backupId + ".json")
+
+    #
+    # Index
+    #
+
+    def backups(self, name=None):
+        """Return list of dictionaries describing backups, oldest first.
+
+        If name is given, only backups with that name are returned."""
+        indexPath = os.path.join(self.path, "index.json")
+        if not os.path.exists(indexPath):
+            return []
+        try:
+            with open(indexPath) as f:
+                backups = json.load(f)
+        except (IOError, ValueError) as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error reading index %s: %s" % (indexPath, e))
+        if name is not None:
+            backups = [b for b in backups if b["name"] == name]
+        return backups
+
+    def _saveIndex(self, backups):
+        AtomicFile.replace(os.path.join(self.path, "index.json"),
+                           lambda f: json.dump(backups, f, indent=1))
+
+    @contextmanager
+    def _lock(self, name, operation):
+        """Hold the flock() operation on lock file name of the store."""
+        _makedirs(self.path)
+        path = os.path.join(self.path, name)
+        try:
+            f = open(path, "a")
+        except IOError as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error opening %s: %s" % (path, e))
+        try:
+            fcntl.flock(f.fileno(), operation)
+            yield
+        finally:
+            # Closing releases the lock
+            f.close()
+
+    def _newId(self, name, when):
+        """Return an unused backup id for name."""
+        stem = "%s-%s" % (name.replace(os.sep, "_"),
+                          time.strftime("%Y%m%d%H%M%S", time.gmtime(when)))
+        backupId = stem
+        count = 1
+        while os.path.exists(self.manifestPath(backupId)):
+            backupId = "%s-%d" % (stem, count)
+            count += 1
+        return backupId
+
+    #
+    # Backup and restore
+    #
+
+    def backup(self, path, name=None, callback=None):
+        """Back up the VDI image at path into the store.
+
+        name identifies the disk across backups, defaulting to the
+        basename of path without extension. callback, if given, is
+        called with the fraction of blocks stored so far. Returns the
+        dictionary describing the new backup, as in backups()."""
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        with self._lock("lock", fcntl.LOCK_SH):
+            return self._backup(path, name, callback)
+
+    def _backup(self, path, name, callback):
+        when = time.time()
+        chunks = {}
+        newChunks = 0
+        newBytes = 0
+        with VDI(path) as image:
+            if image.parentId is not None:
+                raise VirtualBoxException.VirtualBoxNotSupportException(
+                    "%s is a differencing image" % path)
+            header, size = self._putChunk(buffer(image._map, 0,
+                                                 image.dataOffset))
+            zeros = buffer("\0" * image.blockSize)
+            blocks = image.allocatedBlocks()
+            for count, index in enumerate(blocks):
+                data = image.block(index)
+                if data != zeros:
+                    digest, size = self._putChunk(data)
+                    chunks[str(index)] = digest
+                    if size:
+                        newChunks += 1
+                        newBytes += size
+                if callback is not None:
+                    callback(float(count + 1) / len(blocks))
+            manifest = {
+                "name" : name,
+                "source" : os.path.abspath(path),
+                "time" : when,
+                "diskId" : image.id,
+                "logicalSize" : image.logicalSize,
+                "blockSize" : image.blockSize,
+                "header" : header,
+                "chunks" : chunks,
+                }
+        with self._lock("index.lock", fcntl.LOCK_EX):
+            backups = self.backups()
+            backupId = self._newId(name, when)
+            _makedirs(os.path.dirname(self.manifestPath(backupId)))
+            AtomicFile.replace(self.manifestPath(backupId),
+                               lambda f: json.dump(manifest, f))
+            info = {
+                "id" : backupId,
+                "name" : name,
+                "time" : when,
+                "chunks" : len(chunks),
+                "newChunks" : newChunks,
+                "newBytes" : newBytes,
+                }
+            backups.append(info)
+            self._saveIndex(backups)
+        return info
+
+    def _putChunk(self, data):
+        """Store data as a chunk if not already present.
+
+        Returns its digest and the number of bytes newly stored."""
+        digest = hashlib.sha1(data).hexdigest()
+        chunkPath = self.chunkPath(digest)
+        if os.path.exists(chunkPath):
+            return digest, 0
+        _makedirs(os.path.dirname(chunkPath))
+        AtomicFile.replace(chunkPath, lambda f: f.write(data), "wb")
+        return digest, len(data)
+
+    def _readChunk(self, digest):
+        try:
+            with open(self.chunkPath(digest), "rb") as f:
+                return f.read()
+        except IOError as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Missing chunk %s: %s" % (digest, e))
+
+    def loadManifest(self, backupId):
+        """Return the manifest of the given backup."""
+        try:
+            with open(self.manifestPath(backupId)) as f:
+                return json.load(f)
+        except IOError:
+            raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                "No backup \"%s\" in %s" % (backupId, self.path))
+        except ValueError as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error reading manifest of %s: %s" % (backupId, e))
+
+    def restore(self, backupId, target, raw=False):
+        """Restore the given backup to target.
+
+        Writes a VDI image, or a sparse raw image if raw is True.
+        Returns the number of blocks written."""
+        manifest = self.loadManifest(backupId)
+        chunks = dict((int(index), digest)
+                      for index, digest in manifest["chunks"].items())
+        indexes = sorted(chunks)
+        read = lambda index: self._readChunk(chunks[index])
+        blockSize = manifest["blockSize"]
+        with open(target, "wb") as f:
+            if raw:
+                f.truncate(manifest["logicalSize"])
+                for index in indexes:
+                    f.seek(index * blockSize)
+                    f.write(read(index))
+                return len(indexes)
+            f.write(self._readChunk(manifest["header"]))
+        # Header is in place, so the target can describe its own layout
+        with VDI(target) as layout:
+            with open(target, "r+b") as f:
+                _writeBlocks(f, layout, indexes, read)
+        return len(indexes)
+
+    #
+    # Maintenance
+    #
+
+    def forget(self, backupId):
+        """Remove a backup. Its chunks are freed by the next gc()."""
+        with self._lock("index.lock", fcntl.LOCK_EX):
+            backups = self.backups()
+            remaining = [b for b in backups if b["id"] != backupId]
+            if len(remaining) == len(backups):
+                raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                    "No backup \"%s\" in %s" % (backupId, self.path))
+            self._saveIndex(remaining)
+            os.remove(self.manifestPath(backupId))
+
+    def gc(self, keep=None):
+        """Remove chunks no longer used by any backup.
+
+        If keep is given, first forget all but the newest keep backups
+        of each name. Returns number of chunks and bytes removed.
+
+        Waits for backups in progress to finish, and holds off new ones
+        until done. The chunks in use are those of every manifest in
+        the store, whether or not the index lists it."""
+        with self._lock("lock", fcntl.LOCK_EX):
+            return self._gc(keep)
+
+    def _gc(self, keep):
+        if keep is not None:
+            byName = {}
+            for b in self.backups():
+                byName.setdefault(b["name"], []).append(b)
+            for backups in byName.values():
+                for b in backups[:max(0, len(backups) - keep)]:
+                    self.forget(b["id"])
+        used = set()
+        manifestsDir = os.path.join(self.path, "manifests")
+        if os.path.isdir(manifestsDir):
+            for filename in os.listdir(manifestsDir):
+                if not filename.endswith(".json"):
+                    continue
+                manifest = self.loadManifest(filename[:-len(".json")])
+                used.add(manifest["header"])
+                used.update(manifest["chunks"].values())
+        removed = 0
+        freed = 0
+        chunksDir = os.path.join(self.path, "chunks")
+        for dirpath, dirnames, filenames in os.walk(chunksDir):
+            for filename in filenames:
+                if filename in used:
+                    continue
+                # Anything else is unused, or left by an interrupted write
+                chunkPath = os.path.join(dirpath, filename)
+                freed += os.path.getsize(chunkPath)
+                os.remove(chunkPath)
+                removed += 1
+        return removed, freed
+
+def _makedirs(path):
+    """Create directory path if it does not already exist."""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error creating %s: %s" % (path, e))
@@ -0,0 +1,168 @@
+"""Clone several mediums concurrently.
+
+VirtualBox runs each clone as its own task, so disks on separate
+spindles can be copied in parallel. CloneEngine starts the clones,
+keeping within a limit on the total number running and on the number
+writing to any one target device, and tracks their progress."""
+
+import VirtualBoxException
+
+import os
+import os.path
+import time
+
+class CloneJob(object):
+    """One medium being cloned by a CloneEngine."""
+
+    def __init__(self, medium, path, newUUID=True):
+        self.medium = medium
+        self.path = os.path.abspath(path)
+        self.newUUID = newUUID
+        # Bytes to copy, for weighting progress and throughput
+        self.size = medium.size
+        self.device = _targetDevice(self.path)
+        self.progress = None
+        self.startTime = None
+        self.endTime = None
+        self.error = None
+
+    def isStarted(self):
+        return self.startTime is not None
+
+    def isDone(self):
+        return self.endTime is not None
+
+    @property
+    def percent(self):
+        """Percent complete."""
+        if self.isDone():
+            return 100
+        if self.progress is None:
+            return 0
+        return self.progress.percent
+
+    def elapsed(self):
+        """Seconds spent cloning so far, or in total once done."""
+        if self.startTime is None:
+            return 0.0
+        end = self.endTime if self.endTime is not None else time.time()
+        return end - self.startTime
+
+    def throughput(self):
+        """Bytes per second copied, estimated from percent complete."""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.size * self.percent / 100.0 / elapsed
+
+    def __str__(self):
+        return "%s -> %s" % (self.medium, self.path)
+
+class CloneEngine(object):
+    """Runs CloneJobs concurrently.
+
+    maxConcurrent is the most clones running at once. maxPerDevice is
+    the most clones writing to the same device (filesystem) at once,
+    None (the default) for no limit.
+
+    If stopOnError is True, no further clones are started after one
+    fails; those already running are allowed to finish."""
+
+    def __init__(self, maxConcurrent=4, maxPerDevice=None, pollInterval=1000,
+                 stopOnError=True):
+        self.maxConcurrent = maxConcurrent
+        self.maxPerDevice = maxPerDevice
+        self.pollInterval = pollInterval
+        self.stopOnError = stopOnError
+        self.jobs = []
+
+    def add(self, medium, path, newUUID=True):
+        """Queue a clone of medium to path. Returns the CloneJob."""
+        job = CloneJob(medium, path, newUUID)
+        self.jobs.append(job)
+        return job
+
+    def percent(self):
+        """Overall percent complete, weighted by medium size."""
+        total = sum(job.size for job in self.jobs)
+        if total == 0:
+            if self.jobs and all(job.isDone() for job in self.jobs):
+                return 100
+            return 0
+        return sum(job.size * job.percent for job in self.jobs) / total
+
+    def failed(self):
+        """Return list of jobs that failed."""
+        return [job for job in self.jobs if job.error is not None]
+
+    def run(self, callback=None):
+        """Run all queued jobs, returning when none is running.
+
+        callback, if given, is called with this engine each time
+        progress is checked. Jobs that fail have their error set;
+        check failed() afterwards."""
+        pending = [job for job in self.jobs if not job.isStarted()]
+        running = []
+        while pending or running:
+            if not (self.stopOnError and self.failed()):
+                self._start(pending, running)
+            elif not running:
+                break
+            if callback is not None:
+                callback(self)
+            if running:
+                self._wait(running)
+            running = [job for job in running if not self._check(job)]
+        if callback is not None:
+            callback(self)
+        return self.jobs
+
+    def _start(self, pending, running):
+        """Start as many pending jobs as the limits allow."""
+        for job in list(pending):
+            if len(running) >= self.maxConcurrent:
+                break
+            if self.maxPerDevice is not None:
+                onDevice = len([j for j in running if j.device == job.device])
+                if onDevice >= self.maxPerDevice:
+                    continue
+            pending.remove(job)
+            job.startTime = time.time()
+            try:
+                job.progress = job.medium.clone(job.path,
+                                                newUUID=job.newUUID,
+                                                wait=False)
+            except VirtualBoxException.VirtualBoxException as e:
+                job.error = e
+                job.endTime = time.time()
+            else:
+                running.append(job)
+
+    def _wait(self, running):
+        """Wait up to pollInterval for a running job to progress."""
+        try:
+            running[0].progress.waitForCompletion(timeout=self.pollInterval)
+        except VirtualBoxException.VirtualBoxException:
+            # Failure is picked up by _check()
+            pass
+
+    def _check(self, job):
+        """Return True if the job has finished, recording any error."""
+        try:
+            if not job.progress.completed:
+                return False
+            job.progress.checkResult()
+        except VirtualBoxException.VirtualBoxException as e:
+            job.error = e
+        job.endTime = time.time()
+        return True
+
+def _targetDevice(path):
+    """Return the id of the device the file at path would be written to."""
+    directory = os.path.dirname(path)
+    while directory and not os.path.exists(directory):
+        directory = os.path.dirname(directory)
+    try:
+        return os.stat(directory or os.curdir).st_dev
+    except OSError:
+        return None
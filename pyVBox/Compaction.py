@@ -0,0 +1,155 @@
+"""Finding space wasted on zeros in dynamic disks, and reclaiming it.
+
+    planner = CompactionPlanner(minReclaimable=100 * 1024 * 1024)
+    for vm in VirtualMachine.getAll():
+        planner.addMachine(vm)
+    for report in planner.plan():
+        print report
+    planner.compact()
+
+Disks are scanned directly from their VDI images, so scanning does not
+need the machines to be stopped. Compacting does, as VirtualBox must
+be able to lock the disks for writing.
+"""
+
+from VDI import VDI
+from VDIChain import VDIChain
+import VirtualBoxException
+
+import os
+import os.path
+
+class DiskReport(object):
+    """How much of a VDI image could be reclaimed by compacting it.
+
+    fileSize is the size of the image file. dataSize is the bytes of
+    allocated blocks that hold data, zeroSize those that hold only
+    zeros. reclaimable is how much smaller compacting would make the
+    file, including any space the file holds beyond its blocks.
+
+    In a differencing image a zero block hides its parent's data, so
+    it only counts as reclaimable where the parents read zeros too.
+    searchPaths is passed to VDIChain to find the parents."""
+
+    def __init__(self, path, machine=None, medium=None, searchPaths=None):
+        self.path = path
+        self.machine = machine
+        self.medium = medium
+        self.fileSize = os.path.getsize(path)
+        with VDI(path) as image:
+            self.logicalSize = image.logicalSize
+            stride = image.blockSize + image.blockExtraSize
+            allocated = len(image.allocatedBlocks())
+            zeroBlocks = image.zeroBlocks()
+            self.dataSize = (allocated - len(zeroBlocks)) * image.blockSize
+            self.zeroSize = len(zeroBlocks) * image.blockSize
+            if image.parentId is not None:
+                zeroBlocks = _parentZeroBlocks(path, zeroBlocks, searchPaths)
+            needed = image.dataOffset + (allocated - len(zeroBlocks)) * stride
+        self.reclaimable = max(0, self.fileSize - needed)
+
+    @property
+    def ratio(self):
+        """Fraction of the file that could be reclaimed."""
+        if self.fileSize == 0:
+            return 0.0
+        return float(self.reclaimable) / self.fileSize
+
+    def __str__(self):
+        return "%s: %d MB reclaimable of %d MB (%d%%)" % (
+            self.path, self.reclaimable / 1048576, self.fileSize / 1048576,
+            self.ratio * 100)
+
+def _parentZeroBlocks(path, indexes, searchPaths):
+    """Return those of indexes where the parents of the image at path read zeros."""
+    with VDIChain(path, searchPaths) as chain:
+        zeros = buffer("\0" * chain.blockSize)
+        result = []
+        for index in indexes:
+            for parent in chain.images[1:]:
+                if parent.blockMap()[index] == VDI.BLOCK_FREE:
+                    continue
+                data = parent.block(index)
+                if (data is None) or (data == zeros):
+                    result.append(index)
+                break
+            else:
+                result.append(index)
+        return result
+
+class CompactionPlanner(object):
+    """Scans disks and chooses those worth compacting.
+
+    A disk is worth compacting if at least minReclaimable bytes and
+    minRatio of its file could be reclaimed."""
+
+    def __init__(self, minReclaimable=0, minRatio=0.0):
+        self.minReclaimable = minReclaimable
+        self.minRatio = minRatio
+        self.reports = []
+        # Disks that could not be scanned, as (path, reason)
+        self.skipped = []
+
+    def addDisk(self, path, machine=None, medium=None):
+        """Scan the VDI image at path. Returns its DiskReport, or None."""
+        try:
+            report = DiskReport(path, machine, medium)
+        except (VirtualBoxException.VirtualBoxException, OSError) as e:
+            self.skipped.append((path, e))
+            return None
+        self.reports.append(report)
+        return report
+
+    def addMachine(self, vm):
+        """Scan the hard drives of a VirtualMachine."""
+        for disk in vm.getHardDrives():
+            if disk.format != "VDI":
+                self.skipped.append((disk.location, "not a VDI image"))
+                continue
+            self.addDisk(disk.location, vm, disk)
+
+    def plan(self):
+        """Return DiskReports worth compacting, most reclaimable first."""
+        return sorted([r for r in self.reports
+                       if (r.reclaimable > 0) and
+                       (r.reclaimable >= self.minReclaimable) and
+                       (r.ratio >= self.minRatio)],
+                      key=lambda r: r.reclaimable, reverse=True)
+
+    def byMachine(self):
+        """Return dictionary of machine name to total reclaimable bytes."""
+        totals = {}
+        for report in self.reports:
+            if report.machine is not None:
+                name = report.machine.name
+                totals[name] = totals.get(name, 0) + report.reclaimable
+        return totals
+
+    def totalReclaimable(self):
+        return sum(r.reclaimable for r in self.reports)
+
+    def compact(self, callback=None):
+        """Compact the planned disks through VirtualBox.
+
+        Disks attached to machines that are not powered off are left
+        alone. callback, if given, is called with each DiskReport and
+        the exception raised compacting it, or None on success. Returns
+        list of DiskReports compacted."""
+        compacted = []
+        for report in self.plan():
+            if report.medium is None:
+                continue
+            if (report.machine is not None) and not report.machine.isDown():
+                error = VirtualBoxException.VirtualBoxInvalidVMStateException(
+                    "%s is not powered off" % report.machine)
+            else:
+                try:
+                    report.medium.compact()
+                except VirtualBoxException.VirtualBoxException as e:
+                    error = e
+                else:
+                    error = None
+                    compacted.append(report)
+            if callback is not None:
+                callback(report, error)
+        return compacted
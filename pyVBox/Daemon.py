@@ -0,0 +1,226 @@
+"""Running commands in a long-lived process over a Unix socket.
+
+A daemon keeps its VirtualBox connection, caches and session pool
+between commands, so commands forwarded to it skip starting XPCOM:
+
+    server = Server(handler)       # handler(argv, stdout, stderr)
+    server.serveForever()
+
+    status = forward(["list"])     # None if no daemon is running
+
+Messages are frames of a one byte type, a four byte big-endian length
+and that many bytes of payload:
+
+    A   client to daemon: the request, a JSON object with the command
+        line ("argv") and working directory ("cwd")
+    O   daemon to client: data written to standard output
+    E   daemon to client: data written to standard error
+    X   daemon to client: exit status, as decimal digits, ending the
+        conversation
+"""
+
+import VirtualBoxException
+
+import errno
+import json
+import os
+import os.path
+import socket
+import struct
+import sys
+
+_FRAME = struct.Struct(">cI")
+
+FRAME_REQUEST = "A"
+FRAME_STDOUT = "O"
+FRAME_STDERR = "E"
+FRAME_EXIT = "X"
+
+# Socket used if none is given
+DEFAULT_PATH = "~/.pyVBox/daemon.sock"
+
+def socketPath(path=None):
+    """Return path of the daemon socket: path, $PYVBOX_SOCKET or the default."""
+    if path is None:
+        path = os.environ.get("PYVBOX_SOCKET", DEFAULT_PATH)
+    return os.path.expanduser(path)
+
+def sendFrame(sock, frameType, payload):
+    sock.sendall(_FRAME.pack(frameType, len(payload)) + payload)
+
+def _receive(sock, size):
+    pieces = []
+    while size > 0:
+        data = sock.recv(min(size, 65536))
+        if not data:
+            raise EOFError("Connection closed")
+        pieces.append(data)
+        size -= len(data)
+    return "".join(pieces)
+
+def receiveFrame(sock):
+    """Return (type, payload) of the next frame from sock."""
+    frameType, size = _FRAME.unpack(_receive(sock, _FRAME.size))
+    return frameType, _receive(sock, size)
+
+class FrameWriter(object):
+    """File-like object sending what is written to it as frames."""
+
+    def __init__(self, sock, frameType):
+        self.sock = sock
+        self.frameType = frameType
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        if data:
+            sendFrame(self.sock, self.frameType, data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+class Server(object):
+    """Serves commands on a Unix socket, one at a time.
+
+    handler(argv, stdout, stderr) runs a command, writing its output to
+    the given file-like objects, and returns its exit status. Commands
+    run with the client's working directory and with sys.stdout and
+    sys.stderr redirected to the client."""
+
+    def __init__(self, handler, path=None, backlog=16):
+        self.handler = handler
+        self.path = socketPath(path)
+        self._sock = None
+        self._backlog = backlog
+
+    def listen(self):
+        """Create the socket, replacing a stale one left behind."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.path):
+            if _connect(self.path) is not None:
+                raise VirtualBoxException.VirtualBoxException(
+                    "A daemon is already listening on %s" % self.path)
+            os.remove(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the user running the daemon may connect
+        oldMask = os.umask(0077)
+        try:
+            self._sock.bind(self.path)
+        finally:
+            os.umask(oldMask)
+        self._sock.listen(self._backlog)
+
+    def serveForever(self):
+        """Serve commands until interrupted."""
+        if self._sock is None:
+            self.listen()
+        try:
+            while True:
+                conn, address = self._sock.accept()
+                try:
+                    self.serve(conn)
+                finally:
+                    conn.close()
+        finally:
+            self.close()
+
+    def serve(self, conn):
+        """Run the command requested on connection conn."""
+        try:
+            frameType, payload = receiveFrame(conn)
+        except (EOFError, socket.error, struct.error):
+            return
+        if frameType != FRAME_REQUEST:
+            return
+        stdout = FrameWriter(conn, FRAME_STDOUT)
+        stderr = FrameWriter(conn, FRAME_STDERR)
+        savedStdout, savedStderr = sys.stdout, sys.stderr
+        savedCwd = os.getcwd()
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            try:
+                request = json.loads(payload)
+                argv = [arg.encode("utf-8") for arg in request["argv"]]
+                os.chdir(request.get("cwd", savedCwd))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # A bad request fails alone, the daemon keeps serving
+                stderr.write("Error: Invalid request: %s\n" % e)
+                status = 1
+            except OSError as e:
+                stderr.write("Error: %s\n" % e)
+                status = 1
+            else:
+                try:
+                    status = self.handler(argv, stdout, stderr)
+                except SystemExit as e:
+                    status = e.code
+                except Exception as e:
+                    stderr.write("Error: %s\n" % e)
+                    status = 1
+            if not isinstance(status, int):
+                status = 0 if status is None else 1
+            sendFrame(conn, FRAME_EXIT, str(status))
+        except socket.error:
+            # Client went away
+            pass
+        finally:
+            sys.stdout, sys.stderr = savedStdout, savedStderr
+            os.chdir(savedCwd)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+def _connect(path):
+    """Return socket connected to the daemon at path, or None."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        sock.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED, errno.ENOTSOCK):
+            return None
+        raise
+    return sock
+
+def forward(argv, path=None, stdout=None, stderr=None):
+    """Run a command in the daemon, returning its exit status.
+
+    Returns None, having done nothing, if no daemon is running."""
+    if stdout is None:
+        stdout = sys.stdout
+    if stderr is None:
+        stderr = sys.stderr
+    sock = _connect(socketPath(path))
+    if sock is None:
+        return None
+    try:
+        request = {"argv" : list(argv), "cwd" : os.getcwd()}
+        sendFrame(sock, FRAME_REQUEST, json.dumps(request))
+        while True:
+            frameType, payload = receiveFrame(sock)
+            if frameType == FRAME_STDOUT:
+                stdout.write(payload)
+            elif frameType == FRAME_STDERR:
+                stderr.write(payload)
+            elif frameType == FRAME_EXIT:
+                return int(payload)
+    except (EOFError, socket.error) as e:
+        raise VirtualBoxException.VirtualBoxException(
+            "Lost connection to daemon: %s" % e)
+    finally:
+        sock.close()
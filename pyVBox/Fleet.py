@@ -0,0 +1,201 @@
+"""Apply an operation to many virtual machines at once.
+
+    fleet = Fleet(Fleet.select(["lab-*"]), maxWorkers=16, timeout=300000)
+    for result in fleet.apply("powerOn", type="vrdp"):
+        print result
+
+Operations run on a pool of worker threads, each with its own XPCOM
+state. Machines are looked up by id on the worker that operates on
+them.
+"""
+
+import VirtualBoxException
+from VirtualBoxManager import getManager
+
+import fnmatch
+import Queue
+import threading
+import time
+
+# Guards settling of FleetResults by workers and by timeouts
+_resultLock = threading.Lock()
+
+#
+# Operations, called as operation(vm, *args, **kwargs)
+#
+
+def _powerOn(vm, type="gui", env=""):
+    if not vm.isRunning():
+        vm.powerOn(type=type, env=env)
+        vm.waitUntilRunning()
+
+def _powerOff(vm):
+    if not vm.isDown():
+        vm.powerOff(wait=True)
+
+def _pause(vm):
+    vm.pause(wait=True)
+
+def _resume(vm):
+    vm.resume()
+
+def _snapshot(vm, name, description=None):
+    vm.takeSnapshot(name, description)
+
+def _eject(vm):
+    vm.eject()
+
+OPERATIONS = {
+    "powerOn" : _powerOn,
+    "powerOff" : _powerOff,
+    "pause" : _pause,
+    "resume" : _resume,
+    "snapshot" : _snapshot,
+    "eject" : _eject,
+    }
+
+class FleetResult(object):
+    """Outcome of an operation on one machine."""
+
+    def __init__(self, name, id):
+        self.name = name
+        self.id = id
+        self.value = None
+        self.error = None
+        self.startTime = None
+        self.endTime = None
+
+    @property
+    def ok(self):
+        return self.isDone() and (self.error is None)
+
+    def isDone(self):
+        return self.endTime is not None
+
+    def elapsed(self):
+        """Seconds the operation took, or has taken so far."""
+        if self.startTime is None:
+            return 0.0
+        end = self.endTime if self.endTime is not None else time.time()
+        return end - self.startTime
+
+    def __str__(self):
+        if self.ok:
+            return "%s: ok (%.1fs)" % (self.name, self.elapsed())
+        return "%s: FAILED: %s (%.1fs)" % (self.name, self.error,
+                                          self.elapsed())
+
+class Fleet(object):
+    """A set of virtual machines to operate on together.
+
+    machines is a list of VirtualMachines. maxWorkers is the most
+    operations running at once. timeout is the longest, in
+    milliseconds, to wait for the operation on any one machine, None
+    for no limit. A timed-out operation is reported as failed, but
+    cannot be interrupted and keeps its worker until it finishes."""
+
+    def __init__(self, machines, maxWorkers=8, timeout=None):
+        # Keep (name, id) so workers can look machines up themselves
+        self.machines = [(vm.name, vm.id) for vm in machines]
+        self.maxWorkers = maxWorkers
+        self.timeout = timeout
+
+    @classmethod
+    def select(cls, patterns):
+        """Return VirtualMachines matching any of the given names, ids or globs.
+
+        Machines are returned once each, in order of first match.
+        Raises VirtualBoxObjectNotFoundException if a pattern that is
+        not a glob matches nothing."""
+        from VirtualMachine import VirtualMachine
+        selected = []
+        seen = set()
+        allMachines = None
+        for pattern in patterns:
+            if _isGlob(pattern):
+                if allMachines is None:
+                    allMachines = [vm for vm in VirtualMachine.getAll()
+                                   if vm.accessible]
+                matches = [vm for vm in allMachines
+                           if fnmatch.fnmatchcase(vm.name, pattern)]
+            else:
+                matches = [VirtualMachine.find(pattern)]
+            for vm in matches:
+                if vm.id not in seen:
+                    seen.add(vm.id)
+                    selected.append(vm)
+        return selected
+
+    def apply(self, operation, *args, **kwargs):
+        """Apply operation to every machine. Returns list of FleetResults.
+
+        operation is the name of one of OPERATIONS, or a function
+        called as operation(vm, *args, **kwargs)."""
+        if not callable(operation):
+            if operation not in OPERATIONS:
+                raise ValueError("Unknown operation \"%s\"" % operation)
+            operation = OPERATIONS[operation]
+        results = [FleetResult(name, id) for name, id in self.machines]
+        tasks = Queue.Queue()
+        for result in results:
+            tasks.put(result)
+        workers = []
+        for i in range(min(self.maxWorkers, len(results))):
+            worker = threading.Thread(target=_work,
+                                      args=(tasks, operation, args, kwargs),
+                                      name="pyVBox-Fleet-%d" % i)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        self._collect(results)
+        return results
+
+    def _collect(self, results):
+        """Wait for the results, failing those that time out."""
+        while True:
+            pending = [r for r in results if not r.isDone()]
+            if not pending:
+                return
+            now = time.time()
+            for result in pending:
+                if ((self.timeout is not None) and
+                    (result.startTime is not None) and
+                    (now - result.startTime) * 1000 >= self.timeout):
+                    with _resultLock:
+                        if result.endTime is None:
+                            result.error = VirtualBoxException.VirtualBoxTimeoutException(
+                                "Timed out after %d ms" % self.timeout)
+                            result.endTime = now
+            time.sleep(0.1)
+
+def _work(tasks, operation, args, kwargs):
+    """Body of a Fleet worker thread."""
+    from VirtualMachine import VirtualMachine
+    manager = getManager()
+    manager.initPerThread()
+    try:
+        while True:
+            try:
+                result = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            result.startTime = time.time()
+            try:
+                vm = VirtualMachine.get(result.id)
+                value = operation(vm, *args, **kwargs)
+            except Exception as e:
+                value, error = None, e
+            else:
+                error = None
+            with _resultLock:
+                # Result may have been failed by a timeout meanwhile
+                if result.endTime is None:
+                    result.value = value
+                    result.error = error
+                    result.endTime = time.time()
+    finally:
+        manager.deinitPerThread()
+
+def _isGlob(pattern):
+    """Does pattern contain fnmatch wildcards?"""
+    return any(c in pattern for c in "*?[")
@@ -1,7 +1,14 @@
-"""Wrapper around IGuestOSType"""
+"""Wrapper around IGuestOSType, and a catalog of all guest OS types"""
 
+import AtomicFile
+import VirtualBoxException
 from Wrapper import Wrapper
 
+import json
+import os
+import os.path
+import threading
+
 class GuestOSType(Wrapper):
    # Properties directly inherited from IMachine
     _passthruProperties = [
@@ -21,3 +28,144 @@ class GuestOSType(Wrapper):
     def __init__(self, iguestOSType):
         assert(iguestOSType is not None)
         self._wrappedInstance = iguestOSType
+
+class GuestOSTypeCatalog(object):
+    """All guest OS types known to a version of VirtualBox.
+
+    Holds a GuestOSType record for each type, indexed by id and by
+    family. The types only change with VirtualBox itself, so catalogs
+    are saved to disk under the VirtualBox version and revision and
+    read back by later processes, see getCatalog()."""
+
+    def __init__(self, records, version=None, revision=None):
+        self.version = version
+        self.revision = revision
+        self._records = list(records)
+        self._byId = {}
+        self._byFamily = {}
+        for record in self._records:
+            self._byId[record.id.lower()] = record
+            self._byFamily.setdefault(record.familyId, []).append(record)
+
+    @classmethod
+    def fromVirtualBox(cls, vbox):
+        """Read the catalog from the given VirtualBox instance."""
+        with VirtualBoxException.ExceptionHandler():
+            records = [osType.snapshot() for osType in vbox.guestOSTypes]
+            return cls(records, vbox.version, vbox.revision)
+
+    @classmethod
+    def fromFile(cls, path):
+        """Read a catalog written by save()."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error reading guest OS types from %s: %s" % (path, e))
+        records = [GuestOSType._recordType(**dict((str(name), value)
+                                                  for name, value
+                                                  in fields.items()))
+                   for fields in data["types"]]
+        return cls(records, data["version"], data["revision"])
+
+    def save(self, path):
+        """Write the catalog to path, replacing any file there."""
+        data = {
+            "version" : self.version,
+            "revision" : self.revision,
+            "types" : [record.asDict() for record in self._records],
+            }
+        AtomicFile.replace(path, lambda f: json.dump(data, f))
+
+    def get(self, osTypeId):
+        """Return the record of the type with the given id.
+
+        Ids are matched ignoring case, as VirtualBox does. Raises
+        VirtualBoxObjectNotFoundException if there is no such type."""
+        try:
+            return self._byId[osTypeId.lower()]
+        except KeyError:
+            raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                "Unknown guest OS type \"%s\"" % osTypeId)
+
+    def family(self, familyId):
+        """Return records of the types in the given family."""
+        return list(self._byFamily.get(familyId, []))
+
+    def families(self):
+        """Return list of (familyId, familyDescription), in catalog order."""
+        families = []
+        seen = set()
+        for record in self._records:
+            if record.familyId not in seen:
+                seen.add(record.familyId)
+                families.append((record.familyId, record.familyDescription))
+        return families
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, osTypeId):
+        return osTypeId.lower() in self._byId
+
+######################################################################
+#
+# Process-wide catalog
+#
+
+# Directory catalogs are saved in, one file per VirtualBox revision
+CATALOG_DIRECTORY = "~/.pyVBox"
+
+_catalog = None
+_catalogLock = threading.Lock()
+
+def catalogPath(version, revision, directory=None):
+    """Return path of the saved catalog for a VirtualBox version."""
+    if directory is None:
+        directory = os.path.expanduser(CATALOG_DIRECTORY)
+    return os.path.join(directory,
+                        "guestOSTypes-%s-r%s.json" % (version, revision))
+
+def getCatalog(vbox=None, directory=None):
+    """Return the GuestOSTypeCatalog of the running VirtualBox.
+
+    The catalog is read once per process, from the file saved under
+    directory for this VirtualBox version if there is one, otherwise
+    from VirtualBox, in which case the file is written for next time.
+    Failure to write the file is not an error."""
+    global _catalog
+    with _catalogLock:
+        if _catalog is not None:
+            return _catalog
+        if vbox is None:
+            from VirtualBox import VirtualBox
+            vbox = VirtualBox()
+        with VirtualBoxException.ExceptionHandler():
+            version, revision = vbox.version, vbox.revision
+        path = catalogPath(version, revision, directory)
+        catalog = None
+        if os.path.exists(path):
+            try:
+                catalog = GuestOSTypeCatalog.fromFile(path)
+            except VirtualBoxException.VirtualBoxFileError:
+                pass
+        if catalog is None:
+            catalog = GuestOSTypeCatalog.fromVirtualBox(vbox)
+            try:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                catalog.save(path)
+            except (OSError, VirtualBoxException.VirtualBoxFileError):
+                pass
+        _catalog = catalog
+        return catalog
+
+def resetCatalog():
+    """Forget the process-wide catalog, so getCatalog() reads it again."""
+    global _catalog
+    with _catalogLock:
+        _catalog = None
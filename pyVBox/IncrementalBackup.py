@@ -0,0 +1,272 @@
+"""Block-level incremental backups of VDI images.
+
+Each disk backed up to a directory gets a manifest recording a hash of
+every block of the disk as of the last backup, and a chain of delta
+files. The first backup writes every block holding data; later backups
+write only blocks whose hash has changed.
+
+    backup = IncrementalBackup("/backups/vm1")
+    backup.backup("/vms/vm1/disk.vdi")
+    ...
+    IncrementalBackup.restore("/backups/vm1/disk.manifest", "disk.vdi")
+
+For a disk named NAME, the directory holds NAME.manifest, NAME.header
+(the header of the source image) and NAME.NNNN.delta for each backup.
+
+A delta file is the magic string below, then block size, disk size
+and counts of data and zeroed blocks as "<IQII", then the indexes of
+the data blocks and of the zeroed blocks as "<I" each, then the data
+of each data block in order.
+"""
+
+import AtomicFile
+from VDI import VDI, _writeBlocks
+import VirtualBoxException
+
+import array
+import hashlib
+import json
+import mmap
+import os
+import os.path
+import struct
+import sys
+import time
+
+DELTA_MAGIC = "PYVBOXDELTA\x01"
+_DELTA_HEADER = struct.Struct("<IQII")
+
+class BlockManifest(object):
+    """The state of a disk as of its last incremental backup."""
+
+    def __init__(self, name, diskId, logicalSize, blockSize):
+        self.name = name
+        self.diskId = diskId
+        self.logicalSize = logicalSize
+        self.blockSize = blockSize
+        # Block index to hex digest, for blocks that are not all zeros
+        self.hashes = {}
+        # File names of deltas, oldest first
+        self.deltas = []
+        self.times = []
+
+    @classmethod
+    def load(cls, path):
+        """Read a manifest from path."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error reading manifest %s: %s" % (path, e))
+        manifest = cls(data["name"], data["diskId"], data["logicalSize"],
+                       data["blockSize"])
+        manifest.hashes = dict((int(index), digest)
+                               for index, digest in data["hashes"].items())
+        manifest.deltas = data["deltas"]
+        manifest.times = data["times"]
+        return manifest
+
+    def save(self, path):
+        """Write the manifest to path, replacing any existing one atomically."""
+        data = {
+            "name" : self.name,
+            "diskId" : self.diskId,
+            "logicalSize" : self.logicalSize,
+            "blockSize" : self.blockSize,
+            "hashes" : dict((str(index), digest)
+                            for index, digest in self.hashes.items()),
+            "deltas" : self.deltas,
+            "times" : self.times,
+            }
+        AtomicFile.replace(path, lambda f: json.dump(data, f))
+
+class IncrementalBackup(object):
+    """Incremental backups of VDI images into a directory."""
+
+    def __init__(self, targetDir):
+        self.targetDir = targetDir
+
+    def manifestPath(self, name):
+        return os.path.join(self.targetDir, name + ".manifest")
+
+    def backup(self, path, name=None, callback=None):
+        """Back up the VDI image at path, writing a new delta.
+
+        name defaults to the basename of path without extension.
+        callback, if given, is called with the fraction of blocks
+        checked so far. Returns the path of the delta written, or
+        None if nothing changed since the last backup."""
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        manifestPath = self.manifestPath(name)
+        with VDI(path) as image:
+            if image.parentId is not None:
+                raise VirtualBoxException.VirtualBoxNotSupportException(
+                    "%s is a differencing image" % path)
+            if os.path.exists(manifestPath):
+                manifest = BlockManifest.load(manifestPath)
+                if manifest.diskId != image.id:
+                    raise VirtualBoxException.VirtualBoxFileError(
+                        "%s is not disk %s backed up as %s" %
+                        (path, manifest.diskId, name))
+                if ((manifest.logicalSize != image.logicalSize) or
+                    (manifest.blockSize != image.blockSize)):
+                    raise VirtualBoxException.VirtualBoxFileError(
+                        "%s has changed geometry since the last backup" % path)
+            else:
+                manifest = BlockManifest(name, image.id, image.logicalSize,
+                                         image.blockSize)
+            changed, zeroed, hashes = self._compare(image, manifest, callback)
+            if not (changed or zeroed or not manifest.deltas):
+                return None
+            if not os.path.exists(self.targetDir):
+                os.makedirs(self.targetDir)
+            deltaName = "%s.%04d.delta" % (name, len(manifest.deltas))
+            deltaPath = os.path.join(self.targetDir, deltaName)
+            AtomicFile.replace(deltaPath,
+                               lambda f: self._writeDelta(f, image, changed,
+                                                          zeroed),
+                               "wb")
+            AtomicFile.replace(os.path.join(self.targetDir, name + ".header"),
+                               lambda f: f.write(buffer(image._map, 0,
+                                                        image.dataOffset)),
+                               "wb")
+        manifest.hashes = hashes
+        manifest.deltas.append(deltaName)
+        manifest.times.append(time.time())
+        # Manifest last, so an interrupted backup leaves the old one valid
+        manifest.save(manifestPath)
+        return deltaPath
+
+    def _compare(self, image, manifest, callback):
+        """Hash image blocks, comparing against manifest.
+
+        Returns lists of changed and zeroed block indexes and the new
+        hashes."""
+        zeros = buffer("\0" * image.blockSize)
+        hashes = {}
+        changed = []
+        blockMap = image.blockMap()
+        for index, entry in enumerate(blockMap):
+            digest = None
+            if entry < VDI.BLOCK_ZERO:
+                data = buffer(image._map, image._blockOffset(entry),
+                              image.blockSize)
+                if data != zeros:
+                    digest = hashlib.sha1(data).hexdigest()
+                    hashes[index] = digest
+            if (digest is not None) and (digest != manifest.hashes.get(index)):
+                changed.append(index)
+            if (callback is not None) and (index % 1024 == 0):
+                callback(float(index) / len(blockMap))
+        zeroed = sorted(index for index in manifest.hashes
+                        if index not in hashes)
+        return changed, zeroed, hashes
+
+    def _writeDelta(self, f, image, changed, zeroed):
+        f.write(DELTA_MAGIC)
+        f.write(_DELTA_HEADER.pack(image.blockSize, image.logicalSize,
+                                   len(changed), len(zeroed)))
+        f.write(_packIndexes(changed))
+        f.write(_packIndexes(zeroed))
+        for index in changed:
+            f.write(image.block(index))
+
+    @classmethod
+    def restore(cls, manifestPath, target, raw=False, upTo=None):
+        """Reassemble a disk image from its backup.
+
+        Writes a VDI image to target, or a sparse raw image if raw is
+        True. If upTo is given, the disk is restored as of the backup
+        with that index (0 being the first) rather than the latest.
+        Returns the number of blocks written."""
+        manifest = BlockManifest.load(manifestPath)
+        directory = os.path.dirname(manifestPath)
+        deltas = manifest.deltas
+        if upTo is not None:
+            if not 0 <= upTo < len(deltas):
+                raise ValueError("No backup %d of %s" % (upTo, manifest.name))
+            deltas = deltas[:upTo + 1]
+        # Block index to (delta, offset of its data in delta)
+        sources = {}
+        maps = []
+        try:
+            for deltaName in deltas:
+                delta = _Delta(os.path.join(directory, deltaName))
+                maps.append(delta)
+                for index, offset in delta.blocks():
+                    sources[index] = (delta, offset)
+                for index in delta.zeroed:
+                    sources.pop(index, None)
+            blockSize = manifest.blockSize
+            with open(target, "wb") as f:
+                if raw:
+                    f.truncate(manifest.logicalSize)
+                    for index in sorted(sources):
+                        delta, offset = sources[index]
+                        f.seek(index * blockSize)
+                        f.write(buffer(delta.map, offset, blockSize))
+                else:
+                    headerPath = os.path.join(directory,
+                                              manifest.name + ".header")
+                    _writeVDI(f, headerPath, sources)
+        finally:
+            for delta in maps:
+                delta.close()
+        return len(sources)
+
+class _Delta(object):
+    """A delta file opened for reading."""
+
+    def __init__(self, path):
+        try:
+            self.file = open(path, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError) as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error reading delta %s: %s" % (path, e))
+        if self.map[:len(DELTA_MAGIC)] != DELTA_MAGIC:
+            self.close()
+            raise VirtualBoxException.VirtualBoxFileError(
+                "%s is not a delta file" % path)
+        offset = len(DELTA_MAGIC)
+        (self.blockSize, self.logicalSize,
+         dataCount, zeroCount) = _DELTA_HEADER.unpack_from(self.map, offset)
+        offset += _DELTA_HEADER.size
+        self.changed = _unpackIndexes(self.map[offset:offset + 4 * dataCount])
+        offset += 4 * dataCount
+        self.zeroed = _unpackIndexes(self.map[offset:offset + 4 * zeroCount])
+        self.dataOffset = offset + 4 * zeroCount
+
+    def blocks(self):
+        """Return list of (block index, offset of its data)."""
+        return [(index, self.dataOffset + i * self.blockSize)
+                for i, index in enumerate(self.changed)]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+def _writeVDI(f, headerPath, sources):
+    """Write a VDI image with the given blocks, using the header at headerPath."""
+    with VDI(headerPath) as header:
+        f.write(buffer(header._map, 0, header.dataOffset))
+        def read(index):
+            delta, offset = sources[index]
+            return buffer(delta.map, offset, header.blockSize)
+        _writeBlocks(f, header, sorted(sources), read)
+
+def _packIndexes(indexes):
+    data = array.array("I", indexes)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tostring()
+
+def _unpackIndexes(string):
+    data = array.array("I")
+    data.fromstring(string)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tolist()
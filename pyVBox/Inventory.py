@@ -0,0 +1,295 @@
+"""Persistent cache of machines and media, kept in an SQLite database.
+
+    with Inventory() as inventory:
+        inventory.refresh()
+        for machine in inventory.machines():
+            print machine.name, machine.memorySize
+
+The inventory is read from the settings files of the registered
+machines with VBoxSettings, not from VirtualBox. Each file's
+modification time and size are kept alongside what was read from it,
+so refresh() only parses files that have changed and keeping the
+inventory current costs little more than a stat() of each file.
+"""
+
+import VBoxSettings
+import VirtualBoxException
+from Snapshot import Snapshot
+from StorageController import StorageController
+from VirtualMachine import VirtualMachine
+
+import json
+import os
+import os.path
+import sqlite3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, mtime REAL, size INTEGER, machineId TEXT);
+CREATE TABLE IF NOT EXISTS registered (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS machines (
+    id TEXT PRIMARY KEY, name TEXT, path TEXT, currentSnapshotId TEXT,
+    fields TEXT);
+CREATE INDEX IF NOT EXISTS machineNames ON machines (name);
+CREATE TABLE IF NOT EXISTS controllers (
+    machineId TEXT, position INTEGER, fields TEXT);
+CREATE TABLE IF NOT EXISTS attachments (
+    machineId TEXT, position INTEGER, controller TEXT, port INTEGER,
+    device INTEGER, type INTEGER, passthrough INTEGER, mediumId TEXT,
+    location TEXT);
+CREATE TABLE IF NOT EXISTS media (
+    id TEXT, machineId TEXT, location TEXT, format TEXT, type TEXT,
+    parentId TEXT, PRIMARY KEY (id, machineId));
+CREATE INDEX IF NOT EXISTS mediaLocations ON media (location);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id TEXT PRIMARY KEY, machineId TEXT, position INTEGER, parentId TEXT,
+    fields TEXT);
+"""
+
+# Machine id of globally registered media
+_GLOBAL = ""
+
+class Inventory(object):
+    """Machines and media read from settings files, cached in a database.
+
+    path is the database file, created if needed. globalSettingsPath is
+    the global settings file listing the registered machines, by
+    default VBoxSettings.globalSettingsPath()."""
+
+    DEFAULT_PATH = "~/.pyVBox/inventory.db"
+
+    def __init__(self, path=None, globalSettingsPath=None):
+        if path is None:
+            path = os.path.expanduser(self.DEFAULT_PATH)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+        self.path = path
+        self.globalSettingsPath = globalSettingsPath
+        # Files that could not be read by the last refresh(),
+        # as (path, exception)
+        self.errors = []
+        try:
+            self._db = sqlite3.connect(path)
+            # Paths are compared with those from the file system
+            self._db.text_factory = str
+            self._db.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error opening inventory %s: %s" % (path, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    #
+    # Refreshing
+    #
+
+    def refresh(self, paths=None):
+        """Bring the inventory up to date with the settings files.
+
+        paths lists the machine settings files the inventory should
+        hold. By default they are the machines registered in the global
+        settings file, whose globally registered media are then held
+        too. Only files that changed since they were last read are
+        parsed; machines whose files are no longer listed are dropped.
+        Returns the number of files parsed."""
+        self.errors = []
+        known = dict((row[0], row[1:]) for row in
+                     self._db.execute("SELECT path, mtime, size FROM files"))
+        parsed = 0
+        with self._db:
+            if paths is None:
+                paths, parsedGlobal = self._refreshGlobal(known)
+                parsed += parsedGlobal
+            else:
+                paths = [os.path.abspath(path) for path in paths]
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    self._forget(path)
+                    self.errors.append((path, e))
+                    continue
+                if known.get(path) == (stat.st_mtime, stat.st_size):
+                    continue
+                try:
+                    settings = VBoxSettings.parse(path)
+                except VirtualBoxException.VirtualBoxException as e:
+                    self._forget(path)
+                    self.errors.append((path, e))
+                    continue
+                self._store(settings, stat)
+                parsed += 1
+            keep = set(paths)
+            if self.globalSettingsPath is not None:
+                keep.add(os.path.abspath(self.globalSettingsPath))
+            for path in known:
+                if path not in keep:
+                    self._forget(path)
+        return parsed
+
+    def _refreshGlobal(self, known):
+        """Refresh from the global settings file.
+
+        Returns the registered machine settings files and the number of
+        files parsed."""
+        if self.globalSettingsPath is None:
+            self.globalSettingsPath = VBoxSettings.globalSettingsPath()
+            if self.globalSettingsPath is None:
+                raise VirtualBoxException.VirtualBoxFileNotFoundException(
+                    "No VirtualBox.xml found")
+        path = os.path.abspath(self.globalSettingsPath)
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise VirtualBoxException.VirtualBoxFileNotFoundException(
+                "%s: %s" % (path, e.strerror))
+        parsed = 0
+        if known.get(path) != (stat.st_mtime, stat.st_size):
+            settings = VBoxSettings.parseGlobal(path)
+            self._db.execute("DELETE FROM registered")
+            self._db.executemany("INSERT OR REPLACE INTO registered VALUES (?)",
+                                 [(p,) for p in settings.machinePaths])
+            self._db.execute("DELETE FROM media WHERE machineId = ?",
+                             (_GLOBAL,))
+            self._storeMedia(_GLOBAL, settings.media)
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                             (path, stat.st_mtime, stat.st_size, None))
+            parsed += 1
+        paths = [row[0] for row in
+                 self._db.execute("SELECT path FROM registered ORDER BY path")]
+        return paths, parsed
+
+    def _forget(self, path):
+        """Drop everything read from the settings file at path."""
+        for row in self._db.execute(
+            "SELECT machineId FROM files WHERE path = ?", (path,)).fetchall():
+            if row[0] is not None:
+                self._forgetMachine(row[0])
+        self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _forgetMachine(self, machineId):
+        for table in ("controllers", "attachments", "media", "snapshots"):
+            self._db.execute("DELETE FROM %s WHERE machineId = ?" % table,
+                             (machineId,))
+        self._db.execute("DELETE FROM machines WHERE id = ?", (machineId,))
+        self._db.execute("DELETE FROM files WHERE machineId = ?", (machineId,))
+
+    def _store(self, settings, stat):
+        machine = settings.machine
+        self._forget(settings.path)
+        self._forgetMachine(machine.id)
+        self._db.execute(
+            "INSERT INTO machines VALUES (?, ?, ?, ?, ?)",
+            (machine.id, machine.name, settings.path,
+             settings.currentSnapshotId, json.dumps(machine.asDict())))
+        self._db.executemany(
+            "INSERT INTO controllers VALUES (?, ?, ?)",
+            [(machine.id, position, json.dumps(controller.asDict()))
+             for position, controller in enumerate(settings.controllers)])
+        self._db.executemany(
+            "INSERT INTO attachments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(machine.id, position, a.controller, a.port, a.device, a.type,
+              a.passthrough, a.mediumId, a.location)
+             for position, a in enumerate(settings.attachments)])
+        self._storeMedia(machine.id, settings.media)
+        self._db.executemany(
+            "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+            [(snapshot.id, machine.id, position,
+              settings.snapshotParents.get(snapshot.id),
+              json.dumps(snapshot.asDict()))
+             for position, snapshot in enumerate(settings.snapshots)])
+        self._db.execute("INSERT INTO files VALUES (?, ?, ?, ?)",
+                         (settings.path, stat.st_mtime, stat.st_size,
+                          machine.id))
+
+    def _storeMedia(self, machineId, media):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)",
+            [(m.id, machineId, m.location, m.format, m.type, m.parentId)
+             for m in media.values()])
+
+    #
+    # Queries
+    #
+
+    def machines(self):
+        """Return VirtualMachine records of all machines, sorted by name."""
+        return [_record(VirtualMachine, row[0]) for row in
+                self._db.execute("SELECT fields FROM machines ORDER BY name")]
+
+    def getMachine(self, nameOrId):
+        """Return MachineSettings of the machine with the given name or id.
+
+        Raises VirtualBoxObjectNotFoundException if there is none."""
+        row = self._db.execute(
+            "SELECT id, path, currentSnapshotId, fields FROM machines"
+            " WHERE id = ? OR name = ? ORDER BY id = ? DESC LIMIT 1",
+            (nameOrId.strip("{}"), nameOrId,
+             nameOrId.strip("{}"))).fetchone()
+        if row is None:
+            raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                "Could not find VM \"%s\" in inventory" % nameOrId)
+        machineId, path, currentSnapshotId, fields = row
+        controllers = [_record(StorageController, r[0]) for r in
+                       self._db.execute(
+                           "SELECT fields FROM controllers WHERE machineId = ?"
+                           " ORDER BY position", (machineId,))]
+        attachments = [VBoxSettings.AttachedDevice(
+                controller=r[0], port=r[1], device=r[2], type=r[3],
+                passthrough=bool(r[4]), mediumId=r[5], location=r[6])
+                       for r in self._db.execute(
+                "SELECT controller, port, device, type, passthrough,"
+                " mediumId, location FROM attachments WHERE machineId = ?"
+                " ORDER BY position", (machineId,))]
+        media = dict((m.id, m) for m in self._media(
+                "WHERE machineId = ?", (machineId,)))
+        snapshots = []
+        snapshotParents = {}
+        for snapshotId, parentId, snapshotFields in self._db.execute(
+            "SELECT id, parentId, fields FROM snapshots WHERE machineId = ?"
+            " ORDER BY position", (machineId,)):
+            snapshots.append(_record(Snapshot, snapshotFields))
+            if parentId is not None:
+                snapshotParents[snapshotId] = parentId
+        return VBoxSettings.MachineSettings(
+            path, _record(VirtualMachine, fields), controllers, attachments,
+            media, snapshots, snapshotParents, currentSnapshotId)
+
+    def media(self):
+        """Return MediumSettings records of all media."""
+        return self._media("GROUP BY id", ())
+
+    def findMedium(self, location):
+        """Return MediumSettings of the medium at location, or None."""
+        media = self._media("WHERE location = ? LIMIT 1",
+                            (os.path.abspath(location),))
+        if not media:
+            return None
+        return media[0]
+
+    def isMediumRegistered(self, location):
+        """Is the medium at location registered?"""
+        return self.findMedium(location) is not None
+
+    def _media(self, clause, args):
+        return [VBoxSettings.MediumSettings(id=r[0], location=r[1],
+                                            format=r[2], type=r[3],
+                                            parentId=r[4])
+                for r in self._db.execute(
+                "SELECT id, location, format, type, parentId FROM media " +
+                clause, args)]
+
+    def __str__(self):
+        return self.path
+
+def _record(cls, fields):
+    """Return a record of the Wrapper class cls from JSON fields."""
+    return cls._recordType(**dict((str(name), value) for name, value
+                                  in json.loads(fields).items()))
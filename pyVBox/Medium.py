@@ -1,9 +1,10 @@
 """Wrapper around IMedium object"""
 
+import ObjectIndex
 from Progress import Progress
 import UUID
 import VirtualBoxException
-from VirtualBoxManager import Constants, VirtualBoxManager
+from VirtualBoxManager import Constants, getManager
 from Wrapper import Wrapper
 
 import os.path
@@ -95,8 +96,6 @@ class Medium(Wrapper):
         ("deviceType", Device.class_from_type),
         ]
 
-    _manager = VirtualBoxManager()
-
     def __init__(self, imedium):
         """Return a Medium wrapper around given IMedium instance"""
         assert(imedium is not None)
@@ -119,11 +118,21 @@ class Medium(Wrapper):
                                                deviceType,
                                                accessMode,
                                                forceNewUuid)
+        ObjectIndex.mediaChanged()
         return Medium(medium)
 
     @classmethod
     def find(cls, path, deviceType):
-        """Returns a medium that uses the given path or UUID to store medium data."""
+        """Returns a medium that uses the given path or UUID to store medium data.
+
+        Uses the ObjectIndex if it is enabled."""
+        index = ObjectIndex.getIndex()
+        if index is not None:
+            medium = index.findMedium(path, deviceType)
+            if medium is None:
+                raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                    "Could not find a registered medium '%s'" % path)
+            return Medium(medium)
         with VirtualBoxException.ExceptionHandler():
             if not UUID.isUUID(path):
                 path = cls._canonicalizeMediumPath(path)
@@ -162,6 +171,7 @@ class Medium(Wrapper):
             # Despire the name of this method it returns an IMedium
             # instance
             imedium = cls._getVBox().createHardDisk(format, path)
+        ObjectIndex.mediaChanged()
         return cls(imedium)
     
     @classmethod
@@ -174,6 +184,33 @@ class Medium(Wrapper):
         disk.createBaseStorage(size, variant, wait)
         return disk
 
+    @property
+    def parent(self):
+        """Return the Medium this differencing medium is based on, or None."""
+        parent = self.getIMedium().parent
+        if parent is None:
+            return None
+        return Medium(parent)
+
+    @property
+    def children(self):
+        """Return differencing Mediums based on this one."""
+        return [Medium(child) for child in self.getIMedium().children]
+
+    @property
+    def base(self):
+        """Return the base Medium of this medium's differencing chain."""
+        return Medium(self.getIMedium().base)
+
+    def getChain(self):
+        """Return list of this Medium and its ancestors, base last."""
+        chain = [self]
+        parent = self.parent
+        while parent is not None:
+            chain.append(parent)
+            parent = parent.parent
+        return chain
+
     def getIMedium(self):
         """Return IMedium object."""
         return self._wrappedInstance
@@ -181,6 +218,7 @@ class Medium(Wrapper):
     def close(self):
         """Closes this medium."""
         self._wrappedInstance.close()
+        ObjectIndex.mediaChanged()
 
     def basename(self):
         """Return the basename of the location of the storage unit holding medium data."""
@@ -219,6 +257,17 @@ class Medium(Wrapper):
             progress.waitForCompletion()
         return progress
 
+    def compact(self, wait=True):
+        """Free the space used by blocks of the medium holding only zeros.
+
+        Returns Progress instance. If wait is True, does not return until process completes."""
+        with VirtualBoxException.ExceptionHandler():
+            progress = self.getIMedium().compact()
+        progress = Progress(progress)
+        if wait:
+            progress.waitForCompletion()
+        return progress
+
     def createBaseStorage(self, size, variant=None, wait=True):
         """Create storage for the drive of the given size (in MB).
 
@@ -244,7 +293,7 @@ class Medium(Wrapper):
     @classmethod
     def _getVBox(cls):
         """Return the VirtualBox object associated with this VirtualMachine."""
-        return cls._manager.getIVirtualBox()
+        return getManager().getIVirtualBox()
 
 
 
@@ -0,0 +1,228 @@
+"""In-process index resolving machine and medium names to objects.
+
+Once enabled, VirtualMachine.find() and Medium.find() (and so
+isRegistered() and HardDisk.isRegistered()) are answered from an index
+built in bulk from the machine and media arrays of VirtualBox, rather
+than by a findMachine() or findMedium() call each:
+
+    ObjectIndex.enableIndex()
+    vm = VirtualMachine.find("vm1")
+
+A name or id that is not in the index causes it to be rebuilt once, in
+case the object was registered since, and is then remembered as not
+found for negativeTtl seconds. The index is also rebuilt after
+registration events (see VirtualBoxMonitor) and after pyVBox itself
+registers, unregisters, opens or closes objects.
+"""
+
+from VirtualBoxManager import getManager
+import PropertyCache
+import UUID
+import VirtualBoxException
+
+import os.path
+import threading
+import time
+
+def _normalizeId(value):
+    """Return UUID in the form used as index key."""
+    return value.strip("{}").lower()
+
+class ObjectIndex(object):
+    """Index of registered machines and media by name, id and path.
+
+    Machines are indexed by name, id and settings file path, media by
+    id and location, for each device type. Lookups return the wrapped
+    IMachine or IMedium instances. ttl, if not None, is how long in
+    seconds the index is used before being rebuilt regardless of
+    events. If events is True and ttl is None, the index is kept
+    current by events, so is rebuilt on every use while those are not
+    being watched."""
+
+    def __init__(self, negativeTtl=5.0, ttl=None, events=False):
+        self.negativeTtl = negativeTtl
+        self.ttl = ttl
+        self.events = events
+        self._lock = threading.Lock()
+        # (key to IMachine, time built), the index None until built
+        self._machines = (None, 0)
+        # ((deviceType, key) to IMedium, time built)
+        self._media = (None, 0)
+        # Keys not found, to the time they may be looked up again
+        self._misses = {}
+
+    def findMachine(self, nameOrId):
+        """Return IMachine with the given name, UUID or settings file, or None."""
+        if UUID.isUUID(nameOrId):
+            keys = [_normalizeId(nameOrId)]
+        else:
+            keys = [nameOrId, os.path.abspath(nameOrId)]
+        return self._find("_machines", self._buildMachines,
+                          ("machine", nameOrId), keys)
+
+    def findMedium(self, pathOrId, deviceType):
+        """Return IMedium of deviceType with the given location or UUID, or None."""
+        if UUID.isUUID(pathOrId):
+            key = _normalizeId(pathOrId)
+        else:
+            key = os.path.abspath(pathOrId)
+        return self._find("_media", self._buildMedia, (deviceType, pathOrId),
+                          [(deviceType, key)])
+
+    def machinesChanged(self):
+        """Have the machine index rebuilt on next use."""
+        with self._lock:
+            self._machines = (None, 0)
+            self._misses.clear()
+
+    def machineChanged(self, machineId):
+        """Re-read the keys of one machine, which may have been renamed."""
+        with self._lock:
+            index = self._machines[0]
+            if index is None:
+                return
+            machine = index.get(_normalizeId(machineId))
+            if machine is None:
+                return
+            for key in [k for k, v in index.items() if v is machine]:
+                del index[key]
+            self._addMachine(index, machine)
+
+    def mediaChanged(self):
+        """Have the media index rebuilt on next use."""
+        with self._lock:
+            self._media = (None, 0)
+            self._misses.clear()
+
+    def _find(self, attr, build, missKey, keys):
+        """Look keys up in the index held in attr, building it if needed.
+
+        A key not in an index that was not just built may belong to an
+        object registered since, so the index is rebuilt once before
+        the key is remembered as missing."""
+        with self._lock:
+            now = time.time()
+            index, built = getattr(self, attr)
+            fresh = False
+            if self.ttl is None:
+                stale = (self.events and
+                         not PropertyCache.isEventInvalidationActive())
+            else:
+                stale = now - built > self.ttl
+            if (index is None) or stale:
+                index, fresh = build(), True
+                setattr(self, attr, (index, now))
+            result = self._lookup(index, keys)
+            if result is not None:
+                return result
+            if self._misses.get(missKey, 0) > now:
+                return None
+            if not fresh:
+                index = build()
+                setattr(self, attr, (index, now))
+                result = self._lookup(index, keys)
+                if result is not None:
+                    return result
+            self._misses[missKey] = now + self.negativeTtl
+            return None
+
+    def _lookup(self, index, keys):
+        for key in keys:
+            if key in index:
+                return index[key]
+        return None
+
+    def _buildMachines(self):
+        manager = getManager()
+        index = {}
+        with VirtualBoxException.ExceptionHandler():
+            machines = manager.getArray(manager.getIVirtualBox(), "machines")
+        for machine in machines:
+            self._addMachine(index, machine)
+        return index
+
+    def _addMachine(self, index, machine):
+        try:
+            with VirtualBoxException.ExceptionHandler():
+                index[_normalizeId(machine.id)] = machine
+                if machine.accessible:
+                    index[machine.name] = machine
+                index[os.path.abspath(machine.settingsFilePath)] = machine
+        except VirtualBoxException.VirtualBoxException:
+            # Machine went away while the index was being built
+            pass
+
+    def _buildMedia(self):
+        manager = getManager()
+        vbox = manager.getIVirtualBox()
+        index = {}
+        for arrayName in ("hardDisks", "DVDImages", "floppyImages"):
+            with VirtualBoxException.ExceptionHandler():
+                media = list(manager.getArray(vbox, arrayName))
+            while media:
+                medium = media.pop()
+                try:
+                    with VirtualBoxException.ExceptionHandler():
+                        deviceType = medium.deviceType
+                        index[(deviceType, _normalizeId(medium.id))] = medium
+                        index[(deviceType,
+                               os.path.abspath(medium.location))] = medium
+                        # Only base hard disks are in the array
+                        media.extend(medium.children)
+                except VirtualBoxException.VirtualBoxException:
+                    continue
+        return index
+
+######################################################################
+#
+# Process-wide index
+#
+
+_index = None
+_indexLock = threading.Lock()
+
+def enableIndex(negativeTtl=5.0, ttl=None, events=True):
+    """Resolve finds through a process-wide ObjectIndex, returning it.
+
+    If events is True, VirtualBox events are watched to keep it
+    current, see PropertyCache.startEventInvalidation()."""
+    global _index
+    with _indexLock:
+        if _index is None:
+            _index = ObjectIndex(negativeTtl, ttl, events)
+        else:
+            _index.negativeTtl = negativeTtl
+            _index.ttl = ttl
+            _index.events = events
+        index = _index
+    if events:
+        PropertyCache.startEventInvalidation()
+    return index
+
+def disableIndex():
+    """Stop resolving finds through the index."""
+    global _index
+    with _indexLock:
+        _index = None
+
+def getIndex():
+    """Return the process-wide ObjectIndex, or None if not enabled."""
+    return _index
+
+def machinesChanged():
+    """Note that machines were registered, unregistered or renamed."""
+    index = _index
+    if index is not None:
+        index.machinesChanged()
+
+def machineChanged(machineId):
+    """Note that the settings of a machine changed."""
+    index = _index
+    if index is not None:
+        index.machineChanged(machineId)
+
+def mediaChanged():
+    """Note that media were registered or unregistered."""
+    index = _index
+    if index is not None:
+        index.mediaChanged()
@@ -39,10 +39,19 @@ class Progress(Wrapper):
             self._wrappedInstance.waitForCompletion(timeout)
         if (((not self.completed) and (timeout == self.WaitIndefinite)) or
             (self.completed and (self.resultCode != 0))):
-            # TODO: This is not the right exception to return.
-            raise VirtualBoxException.VirtualBoxException(
-                "Task %s did not complete: %s (%d)" % 
-                (self.description,
-                 self.errorInfo.text,
-                 self.resultCode))
+            self._raiseFailure()
+
+    def checkResult(self):
+        """Raise a VirtualBoxException if the task completed unsuccessfully."""
+        if self.completed and (self.resultCode != 0):
+            self._raiseFailure()
+
+    def _raiseFailure(self):
+        """Raise a VirtualBoxException describing the task's failure."""
+        # TODO: This is not the right exception to return.
+        raise VirtualBoxException.VirtualBoxException(
+            "Task %s did not complete: %s (%d)" %
+            (self.description,
+             self.errorInfo.text,
+             self.resultCode))
 
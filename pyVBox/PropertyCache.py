@@ -0,0 +1,170 @@
+"""Time-bounded cache of wrapper property values.
+
+Caching is opt-in per wrapper, see Wrapper.enableCache(). Cached
+values expire after their time-to-live, when invalidated explicitly,
+or when VirtualBoxMonitor sees an event for the object they belong to.
+Caches relying on events serve no cached values while events are not
+being watched, see isEventInvalidationActive().
+"""
+
+import logging
+import threading
+import time
+import weakref
+
+class PropertyCache(object):
+    """Property values read from one wrapped instance.
+
+    ttl is the number of seconds a value stays valid. If None, values
+    stay valid until invalidated. If events is True, values with no ttl
+    are invalidated by events, so are only served while those are
+    watched."""
+    __slots__ = ("ttl", "events", "_values")
+
+    def __init__(self, ttl=None, events=False):
+        self.ttl = ttl
+        self.events = events
+        self._values = {}
+
+    def lookup(self, name, fetch):
+        """Return the cached value of name, calling fetch() to read it if needed."""
+        if ((self.ttl is None) and self.events and
+            not isEventInvalidationActive()):
+            return fetch()
+        entry = self._values.get(name)
+        if entry is not None:
+            expires, value = entry
+            if (expires is None) or (expires > time.time()):
+                return value
+        value = fetch()
+        expires = None if self.ttl is None else time.time() + self.ttl
+        self._values[name] = (expires, value)
+        return value
+
+    def invalidate(self, name=None):
+        """Forget the cached value of name, or all values if name is None."""
+        if name is None:
+            self._values.clear()
+        else:
+            self._values.pop(name, None)
+
+######################################################################
+#
+# Invalidation by object id
+#
+
+# Maps VirtualBox object UUIDs to the set of wrappers with a cache
+_registry = {}
+_registryLock = threading.Lock()
+
+def register(objectId, wrapper):
+    """Have wrapper's cache invalidated when objectId is invalidated."""
+    with _registryLock:
+        wrappers = _registry.get(objectId)
+        if wrappers is None:
+            wrappers = _registry[objectId] = weakref.WeakSet()
+        wrappers.add(wrapper)
+
+def unregister(objectId, wrapper):
+    """Undo register()."""
+    with _registryLock:
+        wrappers = _registry.get(objectId)
+        if wrappers is not None:
+            wrappers.discard(wrapper)
+            if not wrappers:
+                del _registry[objectId]
+
+def invalidate(objectId):
+    """Invalidate the caches of all wrappers around the given object."""
+    with _registryLock:
+        wrappers = list(_registry.get(objectId, ()))
+    for wrapper in wrappers:
+        wrapper.invalidateCache()
+
+def invalidateAll():
+    """Invalidate the caches of all registered wrappers."""
+    with _registryLock:
+        wrappers = [w for ws in _registry.values() for w in ws]
+    for wrapper in wrappers:
+        wrapper.invalidateCache()
+
+######################################################################
+#
+# Event-driven invalidation
+#
+
+_log = logging.getLogger(__name__)
+
+_monitorThread = None
+_monitorStop = threading.Event()
+_monitorLock = threading.Lock()
+# Set while the thread is watching events
+_monitorActive = threading.Event()
+
+# Seconds to wait before watching events again after a failure,
+# doubling with each failure in a row up to the maximum
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+def startEventInvalidation():
+    """Start invalidating caches from VirtualBox events, if not already.
+
+    Events are read by a daemon thread using a VirtualBoxMonitor. If
+    watching fails, the thread logs the error and tries again."""
+    global _monitorThread
+    with _monitorLock:
+        if (_monitorThread is not None) and _monitorThread.is_alive():
+            return
+        _monitorStop.clear()
+        _monitorThread = threading.Thread(target=_monitorEvents,
+                                          name="pyVBox-PropertyCache")
+        _monitorThread.daemon = True
+        _monitorThread.start()
+
+def stopEventInvalidation():
+    """Stop the thread started by startEventInvalidation()."""
+    global _monitorThread
+    with _monitorLock:
+        thread, _monitorThread = _monitorThread, None
+    if thread is not None:
+        _monitorStop.set()
+        thread.join()
+
+def isEventInvalidationActive():
+    """Are VirtualBox events being watched to invalidate caches?"""
+    return _monitorActive.is_set()
+
+def _monitorEvents():
+    """Body of the event invalidation thread."""
+    delay = RETRY_DELAY
+    while not _monitorStop.is_set():
+        try:
+            _watchEvents()
+        except Exception:
+            _log.exception("Error watching VirtualBox events, retrying in "
+                           "%g seconds", delay)
+            _monitorStop.wait(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+        else:
+            delay = RETRY_DELAY
+
+def _watchEvents():
+    """Invalidate caches from events until stopped or an error occurs."""
+    from VirtualBox import VirtualBoxMonitor
+    from VirtualBoxManager import getManager
+    manager = getManager()
+    manager.initPerThread()
+    try:
+        monitor = VirtualBoxMonitor()
+        monitor.register()
+        try:
+            _monitorActive.set()
+            while not _monitorStop.is_set():
+                monitor.processEvents(timeout=500)
+        finally:
+            _monitorActive.clear()
+            monitor.unregister()
+    finally:
+        manager.deinitPerThread()
+        # Events were missed from here on, so cached values can't be trusted
+        invalidateAll()
@@ -1,11 +1,12 @@
 """Wrapper around ISession object"""
 
 from Progress import Progress
-from VirtualBox import VirtualBox
 import VirtualBoxException
-from VirtualBoxManager import Constants, VirtualBoxManager
+from VirtualBoxManager import Constants, getManager
+from Waiter import Condition, Waiter
 from Wrapper import Wrapper
 
+import threading
 import weakref
 
 STATE_NAME = {
@@ -24,8 +25,7 @@ class Session(Wrapper):
         "type",
         ]
 
-    _manager = VirtualBoxManager()
-    _vbox = VirtualBox()
+    __slots__ = ("_machine",)
 
     def __init__(self, isession):
         self._wrappedInstance = isession
@@ -36,10 +36,22 @@ class Session(Wrapper):
         """Return a new Session instance"""
         return cls(cls._createSession())
 
+    @classmethod
+    def acquire(cls):
+        """Return an unlocked Session, reusing a pooled one if possible.
+
+        Hand the Session back with release() when done with it."""
+        return _pool.acquire()
+
+    def release(self):
+        """Unlock this Session and return it to the pool for reuse."""
+        _pool.release(self)
+
     @classmethod
     def _createSession(cls):
         """Create and return an ISesison object."""
-        return cls._manager.mgr.getSessionObject(cls._vbox)
+        manager = getManager()
+        return manager.mgr.getSessionObject(manager.getIVirtualBox())
 
     def __del__(self):
         self.unlockMachine(wait=False)
@@ -57,14 +69,19 @@ class Session(Wrapper):
         """Return the mutable machine associated with the session."""
         return self._machine
 
-    def unlockMachine(self, wait=True):
-        """Close any open session, unlocking the machine."""
+    def unlockMachine(self, wait=True, timeout=None):
+        """Close any open session, unlocking the machine.
+
+        If wait is True, wait until the session is unlocked. Timeout is in
+        milliseconds, specify None for an indefinite wait."""
         if self.isLocked():
             with VirtualBoxException.ExceptionHandler():
+                machineId = self.getIMachine().id
                 self._wrappedInstance.unlockMachine()
-                if wait:
-                    while self.isLocked():
-                        self._vbox.waitForEvent()
+            if wait:
+                condition = Condition(lambda: not self.isLocked(),
+                                      machineId)
+                Waiter().waitAll([condition], timeout)
 
     def getISession(self):
         """Return ISession instance wrapped by Session"""
@@ -86,3 +103,37 @@ class Session(Wrapper):
         """Is this session unlocked?"""
         return (self.state == Constants.SessionState_Unlocked)
 
+
+class SessionPool(object):
+    """Pool of unlocked Sessions.
+
+    Creating an ISession is a round trip to VirtualBox, but an unlocked
+    ISession can be used to lock any machine, so they are recycled.
+    At most maxSize Sessions are kept."""
+
+    def __init__(self, maxSize=8):
+        self.maxSize = maxSize
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Return an unlocked Session from the pool, or a new one."""
+        with self._lock:
+            if self._sessions:
+                return self._sessions.pop()
+        return Session.create()
+
+    def release(self, session):
+        """Unlock session and keep it for reuse."""
+        session.unlockMachine(wait=True)
+        session._setMachine(None)
+        with self._lock:
+            if len(self._sessions) < self.maxSize:
+                self._sessions.append(session)
+
+    def clear(self):
+        """Drop all pooled Sessions."""
+        with self._lock:
+            self._sessions = []
+
+_pool = SessionPool()
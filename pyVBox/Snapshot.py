@@ -22,17 +22,18 @@ class Snapshot(Wrapper):
     @property
     def machine(self):
         """Return VirtualMachine object associated wit this snapshot"""
-        import VirtualMachine
-        return VirtualMachine(self.machine)
+        from VirtualMachine import VirtualMachine
+        return VirtualMachine(self._wrappedInstance.machine)
 
     @property
     def parent(self):
         """Return parent snapshot (a snapshot this one is based on), or null if the snapshot has no parent (i.e. is the first snapshot). """
-        if self.parent is None:
+        parent = self._wrappedInstance.parent
+        if parent is None:
             return None
-        return Snapshot(self.parent)
+        return Snapshot(parent)
 
     @property
     def children(self):
         """Return child snapshots (all snapshots having this one as a parent)."""
-        return [Snapshot(child) for child in self.children]
+        return [Snapshot(child) for child in self._wrappedInstance.children]
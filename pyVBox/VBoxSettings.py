@@ -0,0 +1,385 @@
+"""Reading machine settings (.vbox) files directly, without VirtualBox.
+
+    for settings in VBoxSettings.parseAll(VBoxSettings.findSettingsFiles("/vms")):
+        print settings.machine.name, settings.machine.memorySize
+        for device in settings.attachments:
+            print device.controller, device.port, device.location
+
+The machine and its storage controllers are described with the same
+Record types VirtualMachine.snapshot() and StorageController.snapshot()
+return, holding those properties the settings file records. Files are
+read incrementally, discarding elements once they have been used, so
+machines need not be registered nor VirtualBox be running.
+"""
+
+from Snapshot import Snapshot
+from StorageController import StorageController
+import VirtualBoxException
+from VirtualBoxManager import Constants
+from VirtualMachine import VirtualMachine
+from Wrapper import Record
+
+import calendar
+import fnmatch
+import os
+import os.path
+import time
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+class AttachedDevice(Record):
+    """A device attached to a storage controller in a settings file.
+
+    type is a DeviceType constant. mediumId is the id of the attached
+    medium, None if there is none. location is the medium's path, None
+    if the medium is not in the media registry of the file."""
+    __slots__ = ("controller", "port", "device", "type", "passthrough",
+                 "mediumId", "location")
+
+class MediumSettings(Record):
+    """A medium in the media registry of a settings file.
+
+    parentId is the id of the medium a differencing hard disk is based
+    on, None for other media."""
+    __slots__ = ("id", "location", "format", "type", "parentId")
+
+class MachineSettings(object):
+    """The contents of a machine settings file.
+
+    machine is a VirtualMachine record, controllers a list of
+    StorageController records, attachments a list of AttachedDevice
+    records and media a dictionary of MediumSettings records by id.
+    snapshots is a list of Snapshot records, children before their
+    parents, and snapshotParents a dictionary of snapshot id to the id
+    of its parent, for those snapshots that have one."""
+
+    def __init__(self, path, machine, controllers, attachments, media,
+                 snapshots=None, snapshotParents=None,
+                 currentSnapshotId=None):
+        self.path = path
+        self.machine = machine
+        self.controllers = controllers
+        self.attachments = attachments
+        self.media = media
+        self.snapshots = snapshots or []
+        self.snapshotParents = snapshotParents or {}
+        self.currentSnapshotId = currentSnapshotId
+
+    def getHardDrives(self):
+        """Return AttachedDevice records of attached hard drives."""
+        return [a for a in self.attachments
+                if a.type == Constants.DeviceType_HardDisk]
+
+    def __str__(self):
+        return self.path
+
+# Controller type in settings files to StorageControllerType and
+# StorageBus constant names
+_CONTROLLER_TYPES = {
+    "PIIX3" : ("PIIX3", "IDE"),
+    "PIIX4" : ("PIIX4", "IDE"),
+    "ICH6" : ("ICH6", "IDE"),
+    "AHCI" : ("IntelAhci", "SATA"),
+    "LsiLogic" : ("LsiLogic", "SCSI"),
+    "BusLogic" : ("BusLogic", "SCSI"),
+    "LsiLogicSas" : ("LsiLogicSas", "SAS"),
+    "I82078" : ("I82078", "Floppy"),
+    }
+
+def _uuid(value):
+    """Return UUID from a settings file without its braces."""
+    if value is None:
+        return None
+    return value.strip("{}")
+
+def _bool(value):
+    return value == "true"
+
+def _timestamp(value):
+    """Return settings file time as milliseconds since the epoch."""
+    try:
+        return calendar.timegm(time.strptime(value,
+                                             "%Y-%m-%dT%H:%M:%SZ")) * 1000
+    except ValueError:
+        return None
+
+def _machineFields(element, path):
+    """Return VirtualMachine record fields from a Machine element."""
+    fields = {
+        "id" : _uuid(element.get("uuid")),
+        "name" : element.get("name"),
+        "OSTypeId" : element.get("OSType"),
+        "settingsFilePath" : path,
+        "currentStateModified" : _bool(element.get("currentStateModified",
+                                                   "true")),
+        "description" : "",
+        "CPUCount" : 1,
+        }
+    snapshotFolder = element.get("snapshotFolder")
+    if snapshotFolder is not None:
+        fields["snapshotFolder"] = os.path.join(os.path.dirname(path),
+                                                snapshotFolder)
+    stateFile = element.get("stateFile")
+    if stateFile is not None:
+        fields["stateFilePath"] = os.path.join(os.path.dirname(path),
+                                               stateFile)
+    lastStateChange = element.get("lastStateChange")
+    if lastStateChange is not None:
+        fields["lastStateChange"] = _timestamp(lastStateChange)
+    return fields
+
+def _controllerRecord(element):
+    """Return StorageController record for a StorageController element."""
+    fields = {
+        "name" : element.get("name"),
+        "portCount" : int(element.get("PortCount", 0)),
+        "instance" : int(element.get("Instance", 0)),
+        }
+    names = _CONTROLLER_TYPES.get(element.get("type"))
+    if names is not None:
+        fields["controllerType"] = getattr(Constants,
+                                           "StorageControllerType_" + names[0])
+        fields["bus"] = getattr(Constants, "StorageBus_" + names[1])
+    return StorageController._recordType(**fields)
+
+class _MediaReader(object):
+    """Collects MediumSettings from the elements of a media registry."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.media = {}
+        # Ids of the open hard disks, for differencing disks
+        self._hardDisks = []
+
+    def start(self, tag, element):
+        if tag == "HardDisk":
+            self._hardDisks.append(_uuid(element.get("uuid")))
+
+    def end(self, tag, element):
+        if tag not in ("HardDisk", "Image"):
+            return
+        if tag == "HardDisk":
+            self._hardDisks.pop()
+        mediumId = _uuid(element.get("uuid"))
+        location = element.get("location")
+        if location is not None:
+            location = os.path.join(self.directory, location)
+        self.media[mediumId] = MediumSettings(
+            id=mediumId,
+            location=location,
+            format=element.get("format"),
+            type=element.get("type", "Normal"),
+            parentId=self._hardDisks[-1] if self._hardDisks else None)
+
+def parse(path):
+    """Parse the machine settings file at path, returning MachineSettings.
+
+    Raises VirtualBoxFileNotFoundException if path cannot be read and
+    VirtualBoxInvalidXMLError if it is not a machine settings file."""
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    machine = None
+    currentSnapshotId = None
+    controllers = []
+    devices = []
+    mediaReader = _MediaReader(directory)
+    # Fields of the open snapshots, outermost first
+    snapshots = []
+    snapshotRecords = []
+    snapshotParents = {}
+    # Tags of the open elements, without namespaces, outermost first
+    stack = []
+    controllerName = None
+    device = None
+    try:
+        for event, element in ElementTree.iterparse(path, ("start", "end")):
+            tag = element.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                stack.append(tag)
+                if tag == "Machine":
+                    machine = {}
+                elif "MediaRegistry" in stack:
+                    mediaReader.start(tag, element)
+                elif tag == "Snapshot":
+                    snapshots.append({
+                        "id" : _uuid(element.get("uuid")),
+                        "name" : element.get("name"),
+                        "description" : "",
+                        "timeStamp" : _timestamp(element.get("timeStamp", "")),
+                        "online" : element.get("stateFile") is not None,
+                        })
+                elif "Snapshot" in stack:
+                    # Snapshots hold their own earlier copies of the
+                    # machine's hardware, which are not wanted.
+                    pass
+                elif tag == "StorageController":
+                    controllerName = element.get("name")
+                elif tag == "AttachedDevice":
+                    device = {
+                        "controller" : controllerName,
+                        "port" : int(element.get("port", 0)),
+                        "device" : int(element.get("device", 0)),
+                        "type" : getattr(Constants, "DeviceType_" +
+                                         element.get("type", "HardDisk")),
+                        "passthrough" : _bool(element.get("passthrough",
+                                                          "false")),
+                        "mediumId" : None,
+                        }
+                continue
+            stack.pop()
+            if tag == "Machine":
+                # Values from its contents override the defaults
+                fields = _machineFields(element, path)
+                fields.update(machine)
+                machine = fields
+                currentSnapshotId = _uuid(element.get("currentSnapshot"))
+            elif tag == "Snapshot":
+                fields = snapshots.pop()
+                snapshotRecords.append(Snapshot._recordType(**fields))
+                if snapshots:
+                    snapshotParents[fields["id"]] = snapshots[-1]["id"]
+            elif "MediaRegistry" in stack:
+                mediaReader.end(tag, element)
+            elif tag == "Description" and stack[-1] == "Snapshot":
+                snapshots[-1]["description"] = element.text or ""
+            elif "Snapshot" in stack:
+                pass
+            elif tag == "Description" and stack[-1] == "Machine":
+                machine["description"] = element.text or ""
+            elif tag == "Hardware":
+                machine["HardwareVersion"] = element.get("version", "2")
+                if element.get("uuid") is not None:
+                    machine["hardwareUUID"] = _uuid(element.get("uuid"))
+            elif tag == "CPU":
+                machine["CPUCount"] = int(element.get("count", 1))
+            elif tag == "Memory":
+                machine["memorySize"] = int(element.get("RAMSize", 0))
+            elif tag == "Display":
+                machine["VRAMSize"] = int(element.get("VRAMSize", 8))
+                machine["monitorCount"] = int(element.get("monitorCount", 1))
+                machine["accelerate3DEnabled"] = _bool(
+                    element.get("accelerate3D", "false"))
+                machine["accelerate2DVideoEnabled"] = _bool(
+                    element.get("accelerate2DVideo", "false"))
+            elif tag == "Image" and stack[-1] == "AttachedDevice":
+                device["mediumId"] = _uuid(element.get("uuid"))
+            elif tag == "AttachedDevice":
+                devices.append(device)
+                device = None
+            elif tag == "StorageController":
+                controllers.append(_controllerRecord(element))
+            element.clear()
+    except IOError as e:
+        raise VirtualBoxException.VirtualBoxFileNotFoundException(
+            "%s: %s" % (path, e.strerror))
+    except SyntaxError as e:
+        raise VirtualBoxException.VirtualBoxInvalidXMLError(
+            "%s: %s" % (path, e))
+    if machine is None or machine.get("id") is None:
+        raise VirtualBoxException.VirtualBoxInvalidXMLError(
+            "%s: not a machine settings file" % path)
+    machine["snapshotCount"] = len(snapshotRecords)
+    media = mediaReader.media
+    attachments = []
+    for device in devices:
+        medium = media.get(device["mediumId"])
+        device["location"] = medium.location if medium else None
+        attachments.append(AttachedDevice(**device))
+    return MachineSettings(path, VirtualMachine._recordType(**machine),
+                           controllers, attachments, media, snapshotRecords,
+                           snapshotParents, currentSnapshotId)
+
+class GlobalSettings(object):
+    """The contents of a global settings (VirtualBox.xml) file.
+
+    machinePaths is a list of the settings files of the registered
+    machines and media a dictionary of MediumSettings records by id of
+    media registered globally, rather than by a machine."""
+
+    def __init__(self, path, machinePaths, media):
+        self.path = path
+        self.machinePaths = machinePaths
+        self.media = media
+
+    def __str__(self):
+        return self.path
+
+def globalSettingsPath():
+    """Return path of the global settings file of the current user.
+
+    Returns None if there is none."""
+    if os.environ.get("VBOX_USER_HOME"):
+        directories = [os.environ["VBOX_USER_HOME"]]
+    else:
+        directories = [os.path.expanduser("~/.config/VirtualBox"),
+                       os.path.expanduser("~/.VirtualBox"),
+                       os.path.expanduser("~/Library/VirtualBox")]
+    for directory in directories:
+        path = os.path.join(directory, "VirtualBox.xml")
+        if os.path.exists(path):
+            return path
+    return None
+
+def parseGlobal(path=None):
+    """Parse the global settings file, returning GlobalSettings.
+
+    path defaults to globalSettingsPath()."""
+    if path is None:
+        path = globalSettingsPath()
+        if path is None:
+            raise VirtualBoxException.VirtualBoxFileNotFoundException(
+                "No VirtualBox.xml found")
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    machinePaths = []
+    mediaReader = _MediaReader(directory)
+    stack = []
+    try:
+        for event, element in ElementTree.iterparse(path, ("start", "end")):
+            tag = element.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                stack.append(tag)
+                if "MediaRegistry" in stack:
+                    mediaReader.start(tag, element)
+                continue
+            stack.pop()
+            if tag == "MachineEntry":
+                machinePaths.append(os.path.join(directory,
+                                                 element.get("src")))
+            elif "MediaRegistry" in stack:
+                mediaReader.end(tag, element)
+            element.clear()
+    except IOError as e:
+        raise VirtualBoxException.VirtualBoxFileNotFoundException(
+            "%s: %s" % (path, e.strerror))
+    except SyntaxError as e:
+        raise VirtualBoxException.VirtualBoxInvalidXMLError(
+            "%s: %s" % (path, e))
+    return GlobalSettings(path, machinePaths, mediaReader.media)
+
+def parseAll(paths, errors=None):
+    """Return MachineSettings for each settings file in paths.
+
+    If errors is a list, files that cannot be parsed are skipped,
+    appending (path, exception) to errors, otherwise the exception is
+    raised."""
+    settings = []
+    for path in paths:
+        try:
+            settings.append(parse(path))
+        except VirtualBoxException.VirtualBoxException as e:
+            if errors is None:
+                raise
+            errors.append((path, e))
+    return settings
+
+def findSettingsFiles(directory):
+    """Return sorted list of paths of settings files under directory."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in fnmatch.filter(filenames, "*.vbox"):
+            paths.append(os.path.join(dirpath, filename))
+    paths.sort()
+    return paths
@@ -0,0 +1,287 @@
+"""Read VirtualBox VDI disk images directly, without VirtualBox.
+
+    image = VDI("disk.vdi")
+    print image.logicalSize, image.allocatedSize
+    data = image.read(0, 512)
+
+The image file is memory-mapped, so only the parts actually read are
+paged in. Python 2 cannot make a memoryview of an mmap, so zero-copy
+access (view(), block(), iterBlocks()) returns read-only buffer objects
+referring into the mapping instead. These are only valid until the
+image is closed.
+"""
+
+import VirtualBoxException
+
+import array
+import mmap
+import os
+import struct
+import sys
+import uuid
+
+# Pre-header: informational text, signature, version
+_PREHEADER = struct.Struct("<64sII")
+
+# Version 1 header, immediately following the pre-header
+_HEADER_LAYOUT = (
+    ("headerSize", "I"), ("type", "I"), ("flags", "I"), ("comment", "256s"),
+    ("blocksOffset", "I"), ("dataOffset", "I"),
+    ("legacyCylinders", "I"), ("legacyHeads", "I"), ("legacySectors", "I"),
+    ("legacySectorSize", "I"), ("dummy", "I"),
+    ("logicalSize", "Q"), ("blockSize", "I"), ("blockExtraSize", "I"),
+    ("blockCount", "I"), ("allocatedBlockCount", "I"),
+    ("uuidCreate", "16s"), ("uuidModify", "16s"), ("uuidLinkage", "16s"),
+    ("uuidParentModify", "16s"),
+    ("cylinders", "I"), ("heads", "I"), ("sectors", "I"), ("sectorSize", "I"))
+_HEADER_FIELDS = [name for name, code in _HEADER_LAYOUT]
+_HEADER = struct.Struct("<" + "".join(code for name, code in _HEADER_LAYOUT))
+
+def _fieldOffset(name):
+    """Return file offset of the named header field."""
+    index = _HEADER_FIELDS.index(name)
+    codes = "".join(code for name, code in _HEADER_LAYOUT[:index])
+    return _PREHEADER.size + struct.calcsize("<" + codes)
+
+def _writeBlocks(f, layout, indexes, read):
+    """Write the block map and data of a VDI image to f.
+
+    f must already hold the header, up to layout.dataOffset. layout is
+    a VDI with that header. indexes lists the blocks with data, in
+    order; read(index) returns the data of a block. All other blocks
+    are recorded as zero."""
+    blockMap = array.array("I", [VDI.BLOCK_ZERO] * layout.blockCount)
+    for entry, index in enumerate(indexes):
+        blockMap[index] = entry
+    if sys.byteorder != "little":
+        blockMap.byteswap()
+    f.seek(layout.blocksOffset)
+    f.write(blockMap.tostring())
+    f.seek(_fieldOffset("allocatedBlockCount"))
+    f.write(struct.pack("<I", len(indexes)))
+    f.seek(_fieldOffset("type"))
+    f.write(struct.pack("<I", VDI.TYPE_NORMAL))
+    f.seek(layout.dataOffset)
+    extra = "\0" * layout.blockExtraSize
+    for index in indexes:
+        f.write(extra)
+        f.write(read(index))
+    f.truncate(layout.dataOffset +
+               len(indexes) * (layout.blockSize + layout.blockExtraSize))
+
+class VDI(object):
+    """A VDI disk image opened for reading."""
+
+    SIGNATURE = 0xBEDA107F
+
+    # Image types
+    TYPE_NORMAL = 1
+    TYPE_FIXED = 2
+    TYPE_UNDO = 3
+    TYPE_DIFF = 4
+
+    # Block map entries for blocks with no data in the image. Free
+    # blocks read as zeros, or from the parent of a differencing image.
+    BLOCK_FREE = 0xFFFFFFFF
+    BLOCK_ZERO = 0xFFFFFFFE
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+        self._blockMap = None
+        try:
+            self._file = open(path, "rb")
+            size = os.fstat(self._file.fileno()).st_size
+            if size < _PREHEADER.size + _HEADER.size:
+                raise VirtualBoxException.VirtualBoxFileError(
+                    "%s: too short to be a VDI image" % path)
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (IOError, OSError) as e:
+            self.close()
+            if not os.path.exists(path):
+                raise VirtualBoxException.VirtualBoxFileNotFoundException(
+                    "%s: %s" % (path, e))
+            raise VirtualBoxException.VirtualBoxFileError("%s: %s" % (path, e))
+        except:
+            self.close()
+            raise
+        try:
+            self._parseHeader(size)
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Release the mapping. Safe to call more than once."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _parseHeader(self, size):
+        info, signature, version = _PREHEADER.unpack_from(self._map, 0)
+        if signature != self.SIGNATURE:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "%s: not a VDI image" % self.path)
+        self.version = (version >> 16, version & 0xFFFF)
+        if self.version[0] != 1:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "%s: unsupported VDI version %d.%d" %
+                (self.path, self.version[0], self.version[1]))
+        header = dict(zip(_HEADER_FIELDS,
+                          _HEADER.unpack_from(self._map, _PREHEADER.size)))
+        self.type = header["type"]
+        self.comment = header["comment"].split("\0", 1)[0]
+        self.logicalSize = header["logicalSize"]
+        self.blockSize = header["blockSize"]
+        self.blockExtraSize = header["blockExtraSize"]
+        self.blockCount = header["blockCount"]
+        self.blocksOffset = header["blocksOffset"]
+        self.dataOffset = header["dataOffset"]
+        self.sectorSize = header["sectorSize"]
+        self.fileSize = size
+        self.id = str(uuid.UUID(bytes_le=header["uuidCreate"]))
+        self.parentId = None
+        if header["uuidLinkage"] != "\0" * 16:
+            self.parentId = str(uuid.UUID(bytes_le=header["uuidLinkage"]))
+        if self.blockSize == 0:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "%s: zero block size" % self.path)
+        if self.blocksOffset + 4 * self.blockCount > size:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "%s: block map extends past end of file" % self.path)
+
+    #
+    # Block map
+    #
+
+    def blockMap(self):
+        """Return the block map as an array of unsigned 32-bit entries.
+
+        Entry i is the index of block i within the data area of the
+        image, or BLOCK_FREE or BLOCK_ZERO."""
+        if self._blockMap is None:
+            blockMap = array.array("I")
+            start = self.blocksOffset
+            blockMap.fromstring(self._map[start:start + 4 * self.blockCount])
+            if sys.byteorder != "little":
+                blockMap.byteswap()
+            self._blockMap = blockMap
+        return self._blockMap
+
+    def isAllocated(self, index):
+        """Does block index have data in this image?"""
+        return self.blockMap()[index] < self.BLOCK_ZERO
+
+    def allocatedBlocks(self):
+        """Return list of indexes of blocks with data in this image."""
+        return [index for index, entry in enumerate(self.blockMap())
+                if entry < self.BLOCK_ZERO]
+
+    def allocationBitmap(self):
+        """Return a bytearray with a bit set for each allocated block.
+
+        Block i is bit (i % 8), counting from the least significant,
+        of byte (i / 8)."""
+        bitmap = bytearray((self.blockCount + 7) / 8)
+        for index, entry in enumerate(self.blockMap()):
+            if entry < self.BLOCK_ZERO:
+                bitmap[index >> 3] |= 1 << (index & 7)
+        return bitmap
+
+    @property
+    def allocatedSize(self):
+        """Bytes of disk data actually stored in the image."""
+        return len(self.allocatedBlocks()) * self.blockSize
+
+    def zeroBlocks(self):
+        """Return list of indexes of allocated blocks holding only zeros."""
+        # Buffer comparison is a memcmp() over the mapping, no copying
+        zeros = buffer("\0" * self.blockSize)
+        return [index for index, data in self.iterBlocks() if data == zeros]
+
+    #
+    # Reading
+    #
+
+    def block(self, index):
+        """Return buffer of the data of block index, or None if unallocated."""
+        entry = self.blockMap()[index]
+        if entry >= self.BLOCK_ZERO:
+            return None
+        return buffer(self._map, self._blockOffset(entry), self.blockSize)
+
+    def iterBlocks(self):
+        """Yield (index, buffer) for each allocated block, in disk order."""
+        for index, entry in enumerate(self.blockMap()):
+            if entry < self.BLOCK_ZERO:
+                yield index, buffer(self._map, self._blockOffset(entry),
+                                    self.blockSize)
+
+    def view(self, offset, size):
+        """Return buffer of size bytes of disk data at offset, without copying.
+
+        The range must lie within one block. Returns None if that
+        block is unallocated."""
+        index, within = divmod(offset, self.blockSize)
+        if within + size > self.blockSize:
+            raise ValueError("Range crosses a block boundary")
+        self._checkRange(offset, size)
+        entry = self.blockMap()[index]
+        if entry >= self.BLOCK_ZERO:
+            return None
+        return buffer(self._map, self._blockOffset(entry) + within, size)
+
+    def read(self, offset, size):
+        """Return size bytes of disk data at offset as a string.
+
+        Unallocated blocks read as zeros. Reads are cut short at the
+        end of the disk."""
+        self._checkRange(offset, 0)
+        size = max(0, min(size, self.logicalSize - offset))
+        blockMap = self.blockMap()
+        pieces = []
+        while size > 0:
+            index, within = divmod(offset, self.blockSize)
+            length = min(size, self.blockSize - within)
+            entry = blockMap[index]
+            if entry >= self.BLOCK_ZERO:
+                pieces.append("\0" * length)
+            else:
+                start = self._blockOffset(entry) + within
+                pieces.append(self._map[start:start + length])
+            offset += length
+            size -= length
+        return "".join(pieces)
+
+    def _blockOffset(self, entry):
+        """Return file offset of the data of the block with the given map entry.
+
+        Raises VirtualBoxFileError if the block lies past the end of the
+        file, as in a truncated image."""
+        offset = (self.dataOffset +
+                  entry * (self.blockSize + self.blockExtraSize) +
+                  self.blockExtraSize)
+        if offset + self.blockSize > self.fileSize:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "%s: data block %d extends past end of file" %
+                (self.path, entry))
+        return offset
+
+    def _checkRange(self, offset, size):
+        if (offset < 0) or (size < 0) or (offset + size > self.logicalSize):
+            raise ValueError("Range %d+%d outside disk of %d bytes" %
+                             (offset, size, self.logicalSize))
+
+    def __str__(self):
+        return self.path
@@ -0,0 +1,192 @@
+"""Merged view of a chain of differencing VDI images.
+
+A snapshot leaves a machine's disk as a chain: a base image, with a
+differencing image on top for each snapshot, each holding only the
+blocks written since. VDIChain opens the whole chain and resolves each
+block, once, to the topmost image holding it, so reads go straight to
+the right image:
+
+    with VDIChain("/vms/vm1/Snapshots/{...}.vdi") as chain:
+        data = chain.read(0, 512)
+
+Parents are found by UUID among the VDI images in the search
+directories, by default the image's own directory and the one above
+it, where VirtualBox keeps base images of snapshotted disks.
+"""
+
+from VDI import VDI, _HEADER, _PREHEADER, _fieldOffset
+import VirtualBoxException
+
+import array
+import glob
+import os
+import os.path
+import uuid
+
+# Directory to (modification time, {UUID: path}) of VDI images in it
+_uuidCache = {}
+
+def _imageUUID(path):
+    """Return the UUID of the VDI image at path, or None if it is not one."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_PREHEADER.size + _HEADER.size)
+    except IOError:
+        return None
+    if len(header) < _PREHEADER.size + _HEADER.size:
+        return None
+    info, signature, version = _PREHEADER.unpack_from(header, 0)
+    if signature != VDI.SIGNATURE:
+        return None
+    offset = _fieldOffset("uuidCreate")
+    return str(uuid.UUID(bytes_le=header[offset:offset + 16]))
+
+def findImage(imageId, searchPaths):
+    """Return path of the VDI image with the given UUID, or None."""
+    for directory in searchPaths:
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            continue
+        cached = _uuidCache.get(directory)
+        if (cached is None) or (cached[0] != mtime):
+            images = {}
+            for path in glob.glob(os.path.join(directory, "*.vdi")):
+                pathId = _imageUUID(path)
+                if pathId is not None:
+                    images[pathId] = path
+            cached = (mtime, images)
+            _uuidCache[directory] = cached
+        if imageId in cached[1]:
+            return cached[1][imageId]
+    return None
+
+class VDIChain(object):
+    """A differencing VDI image and its ancestors, read as one disk.
+
+    images lists the open VDIs, topmost first. Raises
+    VirtualBoxFileNotFoundException if a parent cannot be found."""
+
+    # Owner of blocks no image holds data for
+    NO_OWNER = -1
+
+    def __init__(self, path, searchPaths=None):
+        self.path = path
+        self.images = []
+        try:
+            self._open(path, searchPaths)
+            self._buildIndex()
+        except:
+            self.close()
+            raise
+
+    def _open(self, path, searchPaths):
+        image = VDI(path)
+        self.images.append(image)
+        seen = set([image.id])
+        while image.parentId is not None:
+            paths = searchPaths
+            if paths is None:
+                directory = os.path.dirname(os.path.abspath(image.path))
+                paths = [directory, os.path.dirname(directory)]
+            parentPath = findImage(image.parentId, paths)
+            if parentPath is None:
+                raise VirtualBoxException.VirtualBoxFileNotFoundException(
+                    "Parent %s of %s not found" % (image.parentId,
+                                                   image.path))
+            image = VDI(parentPath)
+            if image.id in seen:
+                image.close()
+                raise VirtualBoxException.VirtualBoxFileError(
+                    "Loop in differencing chain at %s" % parentPath)
+            seen.add(image.id)
+            self.images.append(image)
+        top = self.images[0]
+        for image in self.images[1:]:
+            if ((image.blockSize != top.blockSize) or
+                (image.logicalSize != top.logicalSize)):
+                raise VirtualBoxException.VirtualBoxFileError(
+                    "%s does not match geometry of %s" % (image.path,
+                                                          top.path))
+
+    def _buildIndex(self):
+        """Resolve each block to the image holding it."""
+        top = self.images[0]
+        self.logicalSize = top.logicalSize
+        self.blockSize = top.blockSize
+        self.blockCount = top.blockCount
+        self.id = top.id
+        # Image index and block map entry of each block
+        self._owners = array.array("h", [self.NO_OWNER] * self.blockCount)
+        self._entries = array.array("I", [VDI.BLOCK_FREE] * self.blockCount)
+        # From the base up, so upper images override lower ones
+        for level in reversed(range(len(self.images))):
+            blockMap = self.images[level].blockMap()
+            for index, entry in enumerate(blockMap):
+                if entry == VDI.BLOCK_FREE:
+                    continue
+                if entry == VDI.BLOCK_ZERO:
+                    self._owners[index] = self.NO_OWNER
+                else:
+                    self._owners[index] = level
+                self._entries[index] = entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for image in self.images:
+            image.close()
+
+    def owner(self, index):
+        """Return the VDI holding block index, or None if it reads as zeros."""
+        level = self._owners[index]
+        if level == self.NO_OWNER:
+            return None
+        return self.images[level]
+
+    def allocatedBlocks(self):
+        """Return list of indexes of blocks with data in any image."""
+        return [index for index, level in enumerate(self._owners)
+                if level != self.NO_OWNER]
+
+    def block(self, index):
+        """Return buffer of the data of block index, or None if it reads as zeros."""
+        level = self._owners[index]
+        if level == self.NO_OWNER:
+            return None
+        image = self.images[level]
+        return buffer(image._map, image._blockOffset(self._entries[index]),
+                      self.blockSize)
+
+    def iterBlocks(self):
+        """Yield (index, buffer) for each block with data, in disk order."""
+        for index in self.allocatedBlocks():
+            yield index, self.block(index)
+
+    def read(self, offset, size):
+        """Return size bytes of disk data at offset as a string.
+
+        Reads are cut short at the end of the disk."""
+        if (offset < 0) or (offset > self.logicalSize):
+            raise ValueError("Offset %d outside disk of %d bytes" %
+                             (offset, self.logicalSize))
+        size = max(0, min(size, self.logicalSize - offset))
+        pieces = []
+        while size > 0:
+            index, within = divmod(offset, self.blockSize)
+            length = min(size, self.blockSize - within)
+            data = self.block(index)
+            if data is None:
+                pieces.append("\0" * length)
+            else:
+                pieces.append(data[within:within + length])
+            offset += length
+            size -= length
+        return "".join(pieces)
+
+    def __str__(self):
+        return " -> ".join(image.path for image in self.images)
@@ -0,0 +1,216 @@
+"""Copy VDI images directly, without going through VirtualBox.
+
+Only blocks allocated in the source image are read. A raw copy is
+written as a sparse file, leaving holes for unallocated and all-zero
+blocks; a VDI copy is compacted, storing only blocks holding data.
+
+    copier = VDICopier("disk.vdi", bandwidth=50 * 1024 * 1024)
+    copier.toRaw("disk.img")
+
+Python 2 has no os.sendfile() or copy_file_range(), so data is written
+straight from the source's memory mapping, with runs of blocks that
+are contiguous in both the source and the target written in one call.
+"""
+
+from VDI import VDI, _fieldOffset
+from VDIChain import VDIChain
+import VirtualBoxException
+
+import array
+import struct
+import sys
+import time
+import uuid
+
+class VDICopier(object):
+    """Copies the data of a VDI image to a raw or a compacted VDI image.
+
+    bandwidth is the most bytes per second to write, None for no limit.
+    chunkSize is the most bytes written in one call. If skipZeros is
+    True, allocated blocks holding only zeros are not copied.
+    searchPaths is passed to VDIChain to find the parents of a
+    differencing image."""
+
+    def __init__(self, path, bandwidth=None, chunkSize=16 * 1024 * 1024,
+                 skipZeros=True, searchPaths=None):
+        self.path = path
+        self.searchPaths = searchPaths
+        self.bandwidth = bandwidth
+        self.chunkSize = chunkSize
+        self.skipZeros = skipZeros
+        # Progress of the current or last copy
+        self.bytesTotal = 0
+        self.bytesCopied = 0
+        self._startTime = None
+
+    @property
+    def percent(self):
+        """Percent complete of the current or last copy."""
+        if self.bytesTotal == 0:
+            return 100 if self._startTime is not None else 0
+        return min(100, self.bytesCopied * 100 / self.bytesTotal)
+
+    def toRaw(self, target, callback=None):
+        """Copy the disk to target as a sparse raw image.
+
+        callback, if given, is called with this copier after each
+        write. Returns number of bytes of data written. A differencing
+        image is copied merged with its parents."""
+        with VDI(self.path) as image:
+            if image.parentId is not None:
+                image.close()
+                return self._chainToRaw(target, callback)
+            runs = self._runs(image)
+            with open(target, "wb") as f:
+                f.truncate(image.logicalSize)
+                for diskOffset, fileOffset, size in runs:
+                    f.seek(diskOffset)
+                    self._write(f, buffer(image._map, fileOffset, size),
+                                callback)
+        return self.bytesCopied
+
+    def _chainToRaw(self, target, callback):
+        """Copy a differencing image and its parents to target as one raw image."""
+        with VDIChain(self.path, self.searchPaths) as chain:
+            zeros = buffer("\0" * chain.blockSize)
+            blocks = [(index, data) for index, data in chain.iterBlocks()
+                      if not (self.skipZeros and (data == zeros))]
+            self._begin(len(blocks) * chain.blockSize)
+            with open(target, "wb") as f:
+                f.truncate(chain.logicalSize)
+                for index, data in blocks:
+                    f.seek(index * chain.blockSize)
+                    self._write(f, data, callback)
+        return self.bytesCopied
+
+    def toVDI(self, target, newUUID=False, callback=None):
+        """Copy the disk to target as a compacted VDI image.
+
+        The copy keeps the UUID of the source unless newUUID is True.
+        callback, if given, is called with this copier after each
+        write. Returns number of bytes of data written. A differencing
+        image is copied merged with its parents, as a base image."""
+        with VDI(self.path) as image:
+            if image.parentId is not None:
+                image.close()
+                return self._chainToVDI(target, newUUID, callback)
+            runs = self._runs(image)
+            blockSize = image.blockSize
+            stride = blockSize + image.blockExtraSize
+            # Data is renumbered in disk order, with empty blocks
+            # recorded as zero or left to the parent as before.
+            blockMap = array.array("I", [entry if entry >= VDI.BLOCK_ZERO
+                                         else VDI.BLOCK_ZERO
+                                         for entry in image.blockMap()])
+            allocated = 0
+            for diskOffset, fileOffset, size in runs:
+                for i in range(size / blockSize):
+                    blockMap[diskOffset / blockSize + i] = allocated
+                    allocated += 1
+            with open(target, "wb") as f:
+                self._writeHeader(f, image, blockMap, allocated, newUUID)
+                for diskOffset, fileOffset, size in runs:
+                    # Copy block extra data along with each block
+                    start = fileOffset - image.blockExtraSize
+                    length = size / blockSize * stride
+                    self._write(f, buffer(image._map, start, length),
+                                callback)
+                f.truncate(image.dataOffset + allocated * stride)
+        return self.bytesCopied
+
+    def _chainToVDI(self, target, newUUID, callback):
+        """Copy a differencing image and its parents to target as one base VDI image."""
+        with VDIChain(self.path, self.searchPaths) as chain:
+            top = chain.images[0]
+            zeros = buffer("\0" * chain.blockSize)
+            blocks = [(index, data) for index, data in chain.iterBlocks()
+                      if not (self.skipZeros and (data == zeros))]
+            self._begin(len(blocks) * chain.blockSize)
+            blockMap = array.array("I", [VDI.BLOCK_ZERO] * chain.blockCount)
+            for entry, (index, data) in enumerate(blocks):
+                blockMap[index] = entry
+            extra = "\0" * top.blockExtraSize
+            with open(target, "wb") as f:
+                self._writeHeader(f, top, blockMap, len(blocks), newUUID)
+                for index, data in blocks:
+                    f.write(extra)
+                    self._write(f, data, callback)
+                f.truncate(top.dataOffset + len(blocks) *
+                           (top.blockSize + top.blockExtraSize))
+        return self.bytesCopied
+
+    def _writeHeader(self, f, image, blockMap, allocated, newUUID):
+        """Write the header and blockMap of a base image copied from image.
+
+        Leaves f positioned at the start of the block data."""
+        if sys.byteorder != "little":
+            blockMap = array.array("I", blockMap)
+            blockMap.byteswap()
+        f.write(buffer(image._map, 0, image.dataOffset))
+        f.seek(image.blocksOffset)
+        f.write(blockMap.tostring())
+        f.seek(_fieldOffset("allocatedBlockCount"))
+        f.write(struct.pack("<I", allocated))
+        f.seek(_fieldOffset("type"))
+        f.write(struct.pack("<I", VDI.TYPE_NORMAL))
+        # No parent: clear uuidLinkage and uuidParentModify
+        f.seek(_fieldOffset("uuidLinkage"))
+        f.write("\0" * 32)
+        if newUUID:
+            f.seek(_fieldOffset("uuidCreate"))
+            f.write(uuid.uuid4().bytes_le)
+            f.write(uuid.uuid4().bytes_le)
+        f.seek(image.dataOffset)
+
+    def _runs(self, image):
+        """Return list of (disk offset, file offset, size) of data to copy.
+
+        Each run is a sequence of blocks contiguous in both the disk
+        and the image file, at most chunkSize bytes long where blocks
+        allow. Also resets progress for a new copy."""
+        blockSize = image.blockSize
+        stride = blockSize + image.blockExtraSize
+        zeros = buffer("\0" * blockSize)
+        runs = []
+        for index, entry in enumerate(image.blockMap()):
+            if entry >= VDI.BLOCK_ZERO:
+                continue
+            fileOffset = image._blockOffset(entry)
+            if (self.skipZeros and
+                buffer(image._map, fileOffset, blockSize) == zeros):
+                continue
+            diskOffset = index * blockSize
+            if runs:
+                lastDisk, lastFile, lastSize = runs[-1]
+                if ((lastDisk + lastSize == diskOffset) and
+                    (lastFile + lastSize / blockSize * stride ==
+                     fileOffset) and
+                    (lastSize + blockSize <= self.chunkSize)):
+                    runs[-1] = (lastDisk, lastFile, lastSize + blockSize)
+                    continue
+            runs.append((diskOffset, fileOffset, blockSize))
+        self._begin(sum(size for diskOffset, fileOffset, size in runs))
+        return runs
+
+    def _begin(self, total):
+        """Reset progress for a new copy of total bytes."""
+        self.bytesTotal = total
+        self.bytesCopied = 0
+        self._startTime = time.time()
+
+    def _write(self, f, data, callback):
+        """Write data to f, keeping within bandwidth."""
+        try:
+            f.write(data)
+        except IOError as e:
+            raise VirtualBoxException.VirtualBoxFileError(
+                "Error writing %s: %s" % (f.name, e))
+        self.bytesCopied += len(data)
+        if self.bandwidth:
+            # Sleep until we are back within the limit
+            due = self._startTime + float(self.bytesCopied) / self.bandwidth
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        if callback is not None:
+            callback(self)
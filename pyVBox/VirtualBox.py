@@ -1,10 +1,10 @@
-"""Wrapper around IVirtualBox
+"""Wrapper around IVirtualBox"""
 
-This is not used at this time."""
-
-from GuestOSType import GuestOSType
-from VirtualBoxException import VirtualBoxException
-from VirtualBoxManager import VirtualBoxManager
+from GuestOSType import GuestOSType, getCatalog
+import ObjectIndex
+import PropertyCache
+import VirtualBoxException
+from VirtualBoxManager import Constants, getManager
 from Wrapper import Wrapper
 
 import os.path
@@ -17,9 +17,11 @@ class VirtualBox(Wrapper):
         "revision",
         "settingsFilePath",
         "version",
+        ]
 
-        # Also allow direct access to these methods. These shouldn't
-        # be used directly, buy only by other pyVBox classes.
+    # Also allow direct access to these methods. These shouldn't
+    # be used directly, buy only by other pyVBox classes.
+    _passthruMethods = [
         "createMachine",
         "findMachine",
         "getMachine",
@@ -30,15 +32,28 @@ class VirtualBox(Wrapper):
         "registerMachine",
         ]
 
+    __slots__ = ("_manager",)
+
     def __init__(self):
-        self._manager = VirtualBoxManager()
+        self._manager = getManager()
         self._wrappedInstance = self._manager.getIVirtualBox()
 
+    def getIVirtualBox(self):
+        """Return wrapped IVirtualBox instance."""
+        return self._wrappedInstance
+
     def getGuestOSType(self, osTypeId):
         """Returns an object describing the specified guest OS type."""
         iosType = self._wrappedInstance.getGuestOSType(osTypeId)
         return GuestOSType(iosType)
 
+    def getGuestOSTypes(self):
+        """Return GuestOSType records of all available guest OS types.
+
+        The records come from the process-wide GuestOSTypeCatalog, so
+        VirtualBox is only asked for them once."""
+        return list(getCatalog(self))
+
     @property
     def guestOSTypes(self):
         """Return an array of all available guest OS Types."""
@@ -59,16 +74,125 @@ class VirtualBox(Wrapper):
 
 
 class VirtualBoxMonitor:
-    def __init__(self, vbox):
+    """Receives events from VirtualBox and calls the on*() methods.
+
+    Call register() to start receiving events, processEvents() to
+    dispatch them and unregister() when done. Child classes override
+    the on*() methods they are interested in; the base methods
+    invalidate any PropertyCache for the object concerned, and the
+    ObjectIndex on registration and settings changes, so overriding
+    methods should call them."""
+
+    # Event type -> (event interface, method, event attributes passed as arguments)
+    _eventHandlers = {
+        "OnMachineStateChanged" : ("IMachineStateChangedEvent",
+                                   "onMachineStateChange",
+                                   ("machineId", "state")),
+        "OnMachineDataChanged" : ("IMachineDataChangedEvent",
+                                  "onMachineDataChange",
+                                  ("machineId",)),
+        "OnExtraDataChanged" : ("IExtraDataChangedEvent",
+                                "onExtraDataChange",
+                                ("machineId", "key", "value")),
+        "OnMediumRegistered" : ("IMediumRegisteredEvent",
+                                "onMediaRegistered",
+                                ("mediumId", "mediumType", "registered")),
+        "OnMachineRegistered" : ("IMachineRegisteredEvent",
+                                 "onMachineRegistered",
+                                 ("machineId", "registered")),
+        "OnSessionStateChanged" : ("ISessionStateChangedEvent",
+                                   "onSessionStateChange",
+                                   ("machineId", "state")),
+        "OnSnapshotTaken" : ("ISnapshotTakenEvent",
+                             "onSnapshotTaken",
+                             ("machineId", "snapshotId")),
+        "OnSnapshotDeleted" : ("ISnapshotDeletedEvent",
+                               "onSnapshotDiscarded",
+                               ("machineId", "snapshotId")),
+        "OnSnapshotChanged" : ("ISnapshotChangedEvent",
+                               "onSnapshotChange",
+                               ("machineId", "snapshotId")),
+        "OnGuestPropertyChanged" : ("IGuestPropertyChangedEvent",
+                                    "onGuestPropertyChange",
+                                    ("machineId", "name", "value", "flags")),
+        }
+
+    def __init__(self, vbox=None):
+        if vbox is None:
+            vbox = VirtualBox()
         self._vbox = vbox
-        self._manager = VirtualBoxManager()
+        self._manager = getManager()
         self._isMscom = self._manager.isMSCOM()
+        self._eventSource = None
+        self._listener = None
+        # Event type constant -> entry from _eventHandlers
+        self._handlers = dict(
+            (getattr(Constants, "VBoxEventType_" + name), handler)
+            for name, handler in self._eventHandlers.items())
+
+    def register(self):
+        """Start receiving events from VirtualBox."""
+        if self._listener is not None:
+            return
+        with VirtualBoxException.ExceptionHandler():
+            eventSource = self._vbox.getIVirtualBox().eventSource
+            listener = eventSource.createListener()
+            eventSource.registerListener(listener,
+                                         self._handlers.keys(),
+                                         False)
+        self._eventSource = eventSource
+        self._listener = listener
+
+    def unregister(self):
+        """Stop receiving events from VirtualBox."""
+        if self._listener is None:
+            return
+        eventSource, listener = self._eventSource, self._listener
+        self._eventSource = self._listener = None
+        with VirtualBoxException.ExceptionHandler():
+            eventSource.unregisterListener(listener)
+
+    def isRegistered(self):
+        """Is this monitor receiving events?"""
+        return self._listener is not None
+
+    def processEvents(self, timeout=0):
+        """Dispatch pending events to the on*() methods.
+
+        Waits up to timeout milliseconds for the first event, then
+        dispatches any others already pending without waiting.
+        Returns the number of events dispatched."""
+        count = 0
+        while True:
+            with VirtualBoxException.ExceptionHandler():
+                event = self._eventSource.getEvent(self._listener, timeout)
+            if event is None:
+                return count
+            try:
+                self._dispatch(event)
+            finally:
+                with VirtualBoxException.ExceptionHandler():
+                    self._eventSource.eventProcessed(self._listener, event)
+            count += 1
+            timeout = 0
+
+    def _dispatch(self, event):
+        """Call the on*() method for the given IEvent."""
+        handler = self._handlers.get(event.type)
+        if handler is None:
+            return
+        interface, method, attrs = handler
+        with VirtualBoxException.ExceptionHandler():
+            event = self._manager.queryInterface(event, interface)
+            args = [getattr(event, attr) for attr in attrs]
+        getattr(self, method)(*args)
 
     def onMachineStateChange(self, id, state):
-        pass
+        PropertyCache.invalidate(id)
 
     def onMachineDataChange(self, id):
-        pass
+        PropertyCache.invalidate(id)
+        ObjectIndex.machineChanged(id)
 
     def onExtraDataCanChange(self, id, key, value):
         # Witty COM bridge thinks if someone wishes to return tuple, hresult
@@ -82,22 +206,24 @@ class VirtualBoxMonitor:
         pass
 
     def onMediaRegistered(self, id, type, registered):
-        pass
+        PropertyCache.invalidate(id)
+        ObjectIndex.mediaChanged()
 
     def onMachineRegistered(self, id, registred):
-        pass
+        PropertyCache.invalidate(id)
+        ObjectIndex.machinesChanged()
 
     def onSessionStateChange(self, id, state):
-        pass
+        PropertyCache.invalidate(id)
 
     def onSnapshotTaken(self, mach, id):
-        pass
+        PropertyCache.invalidate(mach)
 
     def onSnapshotDiscarded(self, mach, id):
-        pass
+        PropertyCache.invalidate(mach)
 
     def onSnapshotChange(self, mach, id):
-        pass
+        PropertyCache.invalidate(mach)
 
     def onGuestPropertyChange(self, id, name, newValue, flags):
         pass
@@ -140,6 +140,10 @@ class VirtualBoxCallFailed(VirtualBoxException):
     """Call to remot object failed."""
     errno = NS_ERROR_CALL_FAILED
 
+class VirtualBoxTimeoutException(VirtualBoxException):
+    """Timed out waiting for an operation or state."""
+    pass
+
 # Mappings from VirtualBox error numbers to pyVBox classes
 EXCEPTION_MAPPINGS = {
     VBOX_E_OBJECT_NOT_FOUND      : VirtualBoxObjectNotFoundException,
@@ -1,8 +1,15 @@
-"""Wrapper around vboxapi.VirtualBoxManager"""
+"""Wrapper around vboxapi.VirtualBoxManager
+
+The first call to getManager() or connect() creates a single
+VirtualBoxManager that is shared by all pyVBox objects in this process,
+so importing pyVBox does not bootstrap XPCOM. shutdown() releases it."""
 
 import vboxapi
+import PropertyCache
 import VirtualBoxException
 
+import threading
+
 class VirtualBoxManager(vboxapi.VirtualBoxManager):
 
     def __init__(self, style=None, params=None):
@@ -12,7 +19,14 @@ class VirtualBoxManager(vboxapi.VirtualBoxManager):
             self.__call_deinit = True
 
     def __del__(self):
+        self.deinit()
+
+    def deinit(self):
+        """Release the underlying VirtualBox connection.
+
+        Safe to call more than once."""
         if self.__call_deinit:
+            self.__call_deinit = False
             # Not sure what this does. Copying use from vboxshell.py.
             vboxapi.VirtualBoxManager.deinit(self)
 
@@ -34,16 +48,74 @@ class VirtualBoxManager(vboxapi.VirtualBoxManager):
         """This this a MSCOM manager?"""
         return (self.type == 'MSCOM')
 
+######################################################################
+#
+# Process-wide manager
+#
+
+_manager = None
+_managerLock = threading.Lock()
+
+def connect(style=None, params=None):
+    """Create the process-wide VirtualBoxManager and return it.
+
+    If the manager already exists it is returned as is and style and
+    params are ignored."""
+    global _manager
+    with _managerLock:
+        if _manager is None:
+            _manager = VirtualBoxManager(style, params)
+        return _manager
+
+def getManager():
+    """Return the process-wide VirtualBoxManager, connecting if needed."""
+    manager = _manager
+    if manager is None:
+        manager = connect()
+    return manager
+
+def isConnected():
+    """Has the process-wide VirtualBoxManager been created?"""
+    return _manager is not None
+
+def shutdown():
+    """Release the process-wide VirtualBoxManager, if any.
+
+    A later call to getManager() or connect() will create a new one.
+    Pooled Sessions and indexed objects belong to the old manager and
+    are dropped."""
+    global _manager
+    # Imported here as these modules import this one
+    import ObjectIndex
+    import Session
+    PropertyCache.stopEventInvalidation()
+    Session._pool.clear()
+    ObjectIndex.machinesChanged()
+    ObjectIndex.mediaChanged()
+    with _managerLock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        manager.deinit()
+
+######################################################################
+
 class Constants:
-    _manager = VirtualBoxManager()
-    
+    # Constants are generated from the IDL and do not need a connection
+    # to VirtualBox, so until one is made we answer from a standalone
+    # copy. This keeps class-level uses of Constants cheap at import.
+    _constants = vboxapi.VirtualBoxReflectionInfo(False)
+
     # Pass any request for unrecognized method or attribute on to
     # XPCOM object. We do this since I don't know how to inherit the
     # XPCOM class directly.
     class __metaclass__(type):
         def __getattr__(cls, name):
+            if _manager is not None:
+                constants = _manager.constants
+            else:
+                constants = cls._constants
             try:
-                return getattr(cls._manager.constants, name)
+                return getattr(constants, name)
             except AttributeError as e:
                 raise AttributeError("%s.%s not found" % (cls.__name__,
                                                           name))
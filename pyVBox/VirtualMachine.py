@@ -1,20 +1,25 @@
 """Wrapper around IMachine object"""
 
+from GuestOSType import getCatalog
 from HardDisk import HardDisk
 from Medium import Medium
 from MediumAttachment import MediumAttachment
+import ObjectIndex
 from Progress import Progress
 from Session import Session
 from Snapshot import Snapshot
 from StorageController import StorageController
 from VirtualBox import VirtualBox
 import VirtualBoxException
-from VirtualBoxManager import Constants, VirtualBoxManager
+from VirtualBoxManager import Constants, getManager
+from Waiter import MachineStateCondition, SessionStateCondition, Waiter
 from Wrapper import Wrapper
 
 from contextlib import contextmanager
 import os
 import os.path
+import sys
+import threading
 
 class VirtualMachine(Wrapper):
     # Properties directly inherited from IMachine
@@ -30,7 +35,6 @@ class VirtualMachine(Wrapper):
         "hardwareUUID",
         "id",
         "lastStateChange",
-        "lockMachine",
         "logFolder",
         "memorySize",
         "monitorCount",
@@ -50,12 +54,14 @@ class VirtualMachine(Wrapper):
         "teleporterEnabled",
         "teleporterPassword",
         "teleporterPort",
-        "unregister",
         "VRAMSize",
         ]
 
-    _manager = VirtualBoxManager()
-    _vbox = VirtualBox()
+    # Methods directly inherited from IMachine
+    _passthruMethods = [
+        "lockMachine",
+        "unregister",
+        ]
 
     def __init__(self, machine, session=None):
         """Return a VirtualMachine wrapper around given IMachine instance"""
@@ -67,6 +73,12 @@ class VirtualMachine(Wrapper):
     def __str__(self):
         return self.name
 
+    def describe(self):
+        """Return a VirtualMachineRecord of all the machine's properties.
+
+        See Wrapper.snapshot() to read only some of them."""
+        return self.snapshot()
+
     #
     # Top-level controls
     #
@@ -90,20 +102,33 @@ class VirtualMachine(Wrapper):
     def powerOff(self, wait=False):
         """Power off a running VM.
 
-        If wait is True, then wait for power down and session closureto complete."""
+        Returns Progress instance. If wait is True, then wait for power down and session closureto complete."""
         with self.lock() as session:
             with VirtualBoxException.ExceptionHandler():
-                session.console.powerDown()
+                iprogress = session.console.powerDown()
+                progress = Progress(iprogress)
         # XXX Not sure we need a lock for the following
         if wait:
             self.waitUntilDown()
             self.waitUntilUnlocked()
+        return progress
 
     def powerOn(self, type="gui", env=""):
         """Spawns a new process that executes a virtual machine.
 
         This is spawning a "remote session" in VirtualBox terms."""
         # TODO: Add a wait argument
+        session, progress = self._launch(type, env)
+        try:
+            progress.waitForCompletion()
+        finally:
+            session.unlockMachine()
+
+    def _launch(self, type, env):
+        """Start spawning a process executing the machine.
+
+        Returns the Session used and the Progress of the launch. The
+        Session must be unlocked once the Progress completes."""
         if not self.isRegistered():
             raise VirtualBoxException.VirtualBoxInvalidVMStateException(
                 "VM is not registered")
@@ -112,9 +137,7 @@ class VirtualMachine(Wrapper):
             session = Session.create()
             iprogress = iMachine.launchVMProcess(session.getISession(),
                                                  type, env)
-            progress = Progress(iprogress)
-            progress.waitForCompletion()
-            session.unlockMachine()
+        return session, Progress(iprogress)
 
     def eject(self):
         """Do what ever it takes to unregister the VM"""
@@ -125,15 +148,19 @@ class VirtualMachine(Wrapper):
             self.powerOff(wait=True)
         self.unregister(cleanup_mode=Constants.CleanupMode_DetachAllReturnNone)
 
-    def delete(self):
+    def delete(self, wait=True):
         """Delete the VM.
 
-        VM must be locked or unregistered"""
+        VM must be locked or unregistered
+
+        Returns Progress instance. If wait is True, does not return until process completes."""
         with VirtualBoxException.ExceptionHandler():
             iMachine = self.getIMachine()
             iprogress = iMachine.delete(None)
             progress = Progress(iprogress)
+        if wait:
             progress.waitForCompletion()
+        return progress
 
     #
     # Creation methods
@@ -149,14 +176,24 @@ class VirtualMachine(Wrapper):
         Throws VirtualBoxFileNotFoundException if file not found."""
         with VirtualBoxException.ExceptionHandler():
             path = cls._canonicalizeVMPath(path)
-            machine = cls._vbox.openMachine(path)
+            machine = cls._getVBox().openMachine(path)
         return VirtualMachine(machine)
 
     @classmethod
     def find(cls, nameOrId):
-        """Attempts to find a virtual machine given its name or UUID."""
+        """Attempts to find a virtual machine given its name or UUID.
+
+        Uses the ObjectIndex if it is enabled."""
+        index = ObjectIndex.getIndex()
+        if index is not None:
+            machine = index.findMachine(nameOrId)
+            if machine is None:
+                raise VirtualBoxException.VirtualBoxObjectNotFoundException(
+                    "Could not find a registered machine named '%s'" %
+                    nameOrId)
+            return VirtualMachine(machine)
         with VirtualBoxException.ExceptionHandler():
-            machine = cls._vbox.findMachine(nameOrId)
+            machine = cls._getVBox().findMachine(nameOrId)
         return VirtualMachine(machine)
 
     @classmethod
@@ -177,7 +214,7 @@ class VirtualMachine(Wrapper):
 
         If register is True, register machine after creation."""
         with VirtualBoxException.ExceptionHandler():
-            machine = cls._vbox.createMachine(settingsFile,
+            machine = cls._getVBox().createMachine(settingsFile,
                                               name,
                                               osTypeId,
                                               id,
@@ -213,29 +250,38 @@ class VirtualMachine(Wrapper):
                                    # session, so defer any
                                    # registration.
                                    register=False)
-        if description:
-            vm.description = description
-        else:
-            vm.description = self.description
-        vm.CPUCount = self.CPUCount
-        vm.memorySize = self.memorySize
-        vm.VRAMSize = self.VRAMSize
-        vm.accelerate3DEnabled = self.accelerate3DEnabled
-        vm.accelerate2DVideoEnabled = self.accelerate2DVideoEnabled
-        vm.monitorCount = self.monitorCount
+        source = self.snapshot(["description",
+                                "CPUCount",
+                                "memorySize",
+                                "VRAMSize",
+                                "accelerate3DEnabled",
+                                "accelerate2DVideoEnabled",
+                                "monitorCount"])
         controllers = self.getStorageControllers()
-        vm.register()
-        for controller in controllers:
-            vm.addStorageController(controller.bus,
-                                    name = controller.name)
-        if not register:
-            clone.unregister()
+        # The new machine is not registered, so settings can be changed
+        # directly and saved once.
+        with vm.edit() as editor:
+            if description:
+                editor.description = description
+            else:
+                editor.description = source.description
+            editor.CPUCount = source.CPUCount
+            editor.memorySize = source.memorySize
+            editor.VRAMSize = source.VRAMSize
+            editor.accelerate3DEnabled = source.accelerate3DEnabled
+            editor.accelerate2DVideoEnabled = source.accelerate2DVideoEnabled
+            editor.monitorCount = source.monitorCount
+            for controller in controllers:
+                editor.addStorageController(controller.bus,
+                                            name = controller.name)
+        if register:
+            vm.register()
         return vm
 
     @classmethod
     def getAll(cls):
         """Return an array of all known virtual machines"""
-        return [VirtualMachine(vm) for vm in cls._vbox.machines]
+        return cls._getVBox().machines
             
     #
     # Registration methods
@@ -244,7 +290,8 @@ class VirtualMachine(Wrapper):
     def register(self):
         """Registers the machine within this VirtualBox installation."""
         with VirtualBoxException.ExceptionHandler():
-            self._vbox.registerMachine(self.getIMachine())
+            self._getVBox().registerMachine(self.getIMachine())
+        ObjectIndex.machinesChanged()
 
     def unregister(self,
                    cleanup_mode=Constants.CleanupMode_DetachAllReturnNone):
@@ -252,6 +299,7 @@ class VirtualMachine(Wrapper):
         with VirtualBoxException.ExceptionHandler():
             machine = self.getIMachine()
             machine.unregister(cleanup_mode)
+        ObjectIndex.machinesChanged()
 
     def isRegistered(self):
         """Is this virtual machine registered?"""
@@ -303,6 +351,21 @@ class VirtualMachine(Wrapper):
             progress.waitForCompletion()
         return progress
 
+    @contextmanager
+    def temporarySnapshot(self, name, description=None):
+        """Context manager taking a snapshot on entry and deleting it on exit.
+
+        Returns the Snapshot. While it exists, the mediums that were
+        attached when it was taken are no longer written to, so they
+        can be copied safely while the machine runs. Deleting the
+        snapshot merges changes made in the meantime back into them."""
+        self.takeSnapshot(name, description)
+        snapshot = self.getCurrentSnapshot()
+        try:
+            yield snapshot
+        finally:
+            self.deleteSnapshot(snapshot)
+
     #
     # Attribute getters
     #
@@ -312,11 +375,12 @@ class VirtualMachine(Wrapper):
         return self._wrappedInstance
 
     def getOSType(self):
-        """Returns an object describing the specified guest OS type."""
+        """Returns a GuestOSType record describing the machine's guest OS type.
+
+        The record comes from the process-wide GuestOSTypeCatalog."""
         with VirtualBoxException.ExceptionHandler():
-            imachine = self.getIMachine()
-            osType = self._vbox.getGuestOSType(imachine.OSTypeId)
-        return osType
+            osTypeId = self.getIMachine().OSTypeId
+        return getCatalog().get(osTypeId)
 
     #
     # Locking and unlocking
@@ -326,15 +390,39 @@ class VirtualMachine(Wrapper):
     def lock(self, type=Constants.LockType_Shared):
         """Contextmanager yielding a session to a locked machine.
 
+        Locks are re-entrant within a thread: while the machine is
+        locked, nested calls yield the same session rather than locking
+        again, so group several operations in one lock() to avoid a
+        lock/unlock cycle for each. A nested write lock cannot be taken
+        inside a shared one.
+
         Machine must be registered."""
-        session = Session.create()
-        with VirtualBoxException.ExceptionHandler():
-            self.getIMachine().lockMachine(session.getISession(), type)
+        held = _heldLocks()
+        machineId = self.id
+        if machineId in held:
+            lock = held[machineId]
+            if ((type == Constants.LockType_Write) and
+                (lock.type != Constants.LockType_Write)):
+                raise VirtualBoxException.VirtualBoxInvalidSessionStateException(
+                    "Cannot take write lock on \"%s\" while holding a shared lock" % self)
+            lock.depth += 1
+            try:
+                yield lock.session
+            finally:
+                lock.depth -= 1
+            return
+        session = Session.acquire()
         try:
+            with VirtualBoxException.ExceptionHandler():
+                self.getIMachine().lockMachine(session.getISession(), type)
             session._setMachine(VirtualMachine(session.getIMachine()))
-            yield session
+            held[machineId] = _HeldLock(session, type)
+            try:
+                yield session
+            finally:
+                del held[machineId]
         finally:
-            session.unlockMachine(wait=True)
+            session.release()
 
     def isLocked(self):
         """Does the machine have an open session?"""
@@ -349,10 +437,13 @@ class VirtualMachine(Wrapper):
         return ((state == Constants.SessionState_Null) or
                 (state == Constants.SessionState_Unlocked))
 
-    def waitUntilUnlocked(self):
-        """Wait until VM is unlocked"""
-        while not self.isUnlocked():
-            self.waitForEvent()
+    def waitUntilUnlocked(self, timeout=None):
+        """Wait until VM is unlocked
+
+        Timeout is in milliseconds, specify None for an indefinite wait."""
+        self._waitForSessionState([Constants.SessionState_Null,
+                                   Constants.SessionState_Unlocked],
+                                  timeout)
 
     #
     # Attach methods
@@ -399,7 +490,7 @@ class VirtualMachine(Wrapper):
                     session.getIMachine().detachDevice(attachment.controller,
                                                        attachment.port,
                                                        attachment.device)
-                    session.saveSettings()
+            session.saveSettings()
 
     def getAttachedMediums(self):
         """Return array of attached Medium instances."""
@@ -499,10 +590,11 @@ class VirtualMachine(Wrapper):
             session.saveSettings()
         return StorageController(controller)
         
-    def _getNewStorageControllerName(self, type):
+    def _getNewStorageControllerName(self, type, taken=()):
         """Choose a name for a new StorageController of the given type.
 
-        Takes a string describing the controller type and adds an number to it to uniqify it if needed."""
+        Takes a string describing the controller type and adds an number to it to uniqify it if needed.
+        Names in taken are avoided as well as those of existing controllers."""
         baseNames = {
             Constants.StorageBus_IDE    : "IDE Controller",
             Constants.StorageBus_SATA   : "SATA Controller",
@@ -514,7 +606,7 @@ class VirtualMachine(Wrapper):
             raise Exception("Invalid type '%d'" % type)
         count = 1
         name = baseNames[type]
-        while self.doesStorageControllerExist(name):
+        while (name in taken) or self.doesStorageControllerExist(name):
             count += 1
             name = "%s %d" % (baseNames[type], count)
         return name
@@ -523,6 +615,19 @@ class VirtualMachine(Wrapper):
     # Settings functions
     #
 
+    @contextmanager
+    def edit(self):
+        """Contextmanager yielding a VirtualMachineEditor for this machine.
+
+        Settings changed through the editor are buffered and, when the
+        context exits normally, applied under one lock with a single
+        saveSettings(). Settings already at the requested value are
+        not written. If applying fails, all changes are discarded. If
+        the context exits with an exception nothing is applied."""
+        editor = VirtualMachineEditor(self)
+        yield editor
+        editor.commit()
+
     def saveSettings(self):
         """Saves any changes to machine settings made since the session has been opened or a new machine has been created, or since the last call to saveSettings or discardSettings."""
         with VirtualBoxException.ExceptionHandler():
@@ -535,15 +640,19 @@ class VirtualMachine(Wrapper):
     def waitForEvent(self):
         self._getManager().waitForEvents()
 
-    def waitUntilRunning(self):
-        """Wait until machine is running."""
-        while not self.isRunning():
-            self.waitForEvent()
+    def waitUntilRunning(self, timeout=None):
+        """Wait until machine is running.
+
+        Timeout is in milliseconds, specify None for an indefinite wait."""
+        self._waitForState([Constants.MachineState_Running], timeout)
 
-    def waitUntilDown(self):
-        """Wait until machine is down (cleanly or not)."""
-        while not self.isDown():
-            self.waitForEvent()
+    def waitUntilDown(self, timeout=None):
+        """Wait until machine is down (cleanly or not).
+
+        Timeout is in milliseconds, specify None for an indefinite wait."""
+        self._waitForState([Constants.MachineState_Aborted,
+                            Constants.MachineState_PoweredOff],
+                           timeout)
 
     def isDown(self):
         """Is machine down (PoweredOff, Aborted)?"""
@@ -565,12 +674,21 @@ class VirtualMachine(Wrapper):
         state = self.state
         if (state == Constants.MachineState_Paused):
             return True
-        return Fals
+        return False
+
+    def waitUntilPaused(self, timeout=None):
+        """Wait until machine is paused.
+
+        Timeout is in milliseconds, specify None for an indefinite wait."""
+        self._waitForState([Constants.MachineState_Paused], timeout)
 
-    def waitUntilPaused(self):
-        """Wait until machine is paused."""
-        while not self.isPaused():
-            self.waitForEvent()
+    def _waitForState(self, states, timeout):
+        """Wait until machine is in one of the given states."""
+        Waiter().waitAll([MachineStateCondition(self, states)], timeout)
+
+    def _waitForSessionState(self, states, timeout):
+        """Wait until machine's session is in one of the given states."""
+        Waiter().waitAll([SessionStateCondition(self, states)], timeout)
 
     #
     # Internal utility functions
@@ -594,12 +712,111 @@ class VirtualMachine(Wrapper):
 
     def _getManager(self):
         """Return the IVirtualBoxManager object associated with this VirtualMachine."""
-        return self._manager
+        return getManager()
+
+    @classmethod
+    def _getVBox(cls):
+        """Return the VirtualBox object shared by all VirtualMachines."""
+        return VirtualBox()
 
     def _getStorageControllers(self):
         """Return the array of storage controllers associated with this virtual machine."""
         return self._getArray('storageControllers')
 
+class VirtualMachineEditor(object):
+    """Buffered changes to the settings of a VirtualMachine.
+
+    Assigning to a property of the machine records the change, reading
+    it returns the pending value if there is one. See VirtualMachine.edit()."""
+
+    def __init__(self, vm):
+        object.__setattr__(self, "_vm", vm)
+        # Property name -> value, with the names in assignment order
+        object.__setattr__(self, "_changes", {})
+        object.__setattr__(self, "_order", [])
+        # (bus type, name) of storage controllers to add
+        object.__setattr__(self, "_controllers", [])
+
+    def __getattr__(self, attr):
+        if attr in self._changes:
+            return self._changes[attr]
+        return getattr(self._vm, attr)
+
+    def __setattr__(self, attr, value):
+        if attr not in VirtualMachine._recordType.__slots__:
+            raise AttributeError("Unrecognized attribute '%s'" % attr)
+        if attr not in self._changes:
+            self._order.append(attr)
+        self._changes[attr] = value
+
+    def addStorageController(self, type, name=None):
+        """Add a storage controller when the changes are applied.
+
+        See VirtualMachine.addStorageController()."""
+        if name is None:
+            # Avoid the names of controllers still to be added too
+            taken = [name for type, name in self._controllers]
+            name = self._vm._getNewStorageControllerName(type, taken)
+        self._controllers.append((type, name))
+
+    def commit(self):
+        """Apply the buffered changes and save the settings.
+
+        A registered machine is locked for the duration."""
+        if not (self._changes or self._controllers):
+            return
+        if self._vm.isRegistered():
+            with self._vm.lock() as session:
+                self._apply(session.getIMachine())
+        else:
+            self._apply(self._vm.getIMachine())
+        self._changes.clear()
+        del self._order[:]
+        del self._controllers[:]
+
+    def _apply(self, imachine):
+        """Apply the buffered changes to the given mutable IMachine."""
+        try:
+            with VirtualBoxException.ExceptionHandler():
+                for attr in self._order:
+                    value = self._changes[attr]
+                    if getattr(imachine, attr) != value:
+                        setattr(imachine, attr, value)
+                for type, name in self._controllers:
+                    imachine.addStorageController(name, type)
+                imachine.saveSettings()
+        except:
+            excInfo = sys.exc_info()
+            try:
+                imachine.discardSettings()
+            except Exception:
+                # Report the original failure, not this one
+                pass
+            raise excInfo[0], excInfo[1], excInfo[2]
+
+#
+# Machine locks held by the current thread, see VirtualMachine.lock()
+#
+
+_threadLocks = threading.local()
+
+def _heldLocks():
+    """Return dictionary of machine id to _HeldLock for this thread."""
+    try:
+        return _threadLocks.held
+    except AttributeError:
+        _threadLocks.held = {}
+        return _threadLocks.held
+
+class _HeldLock(object):
+    """A machine lock held by this thread."""
+    __slots__ = ("session", "type", "depth")
+
+    def __init__(self, session, type):
+        self.session = session
+        self.type = type
+        self.depth = 1
+
 # Simple implementation of IConsoleCallback
 class VirtualMachineMonitor:
     def __init__(self, vm):
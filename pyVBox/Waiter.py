@@ -0,0 +1,196 @@
+"""Waiting for machines and sessions to reach a state.
+
+Waits are driven by VirtualBox events rather than by re-reading state
+in a loop. For example, to wait up to five minutes for a set of
+machines to come up (timeouts are in milliseconds):
+
+    conditions = [MachineStateCondition(vm, [Constants.MachineState_Running])
+                  for vm in vms]
+    waitAll(conditions, timeout=300000)
+
+A Waiter may be cancelled from another thread with cancel().
+"""
+
+from VirtualBox import VirtualBoxMonitor
+import VirtualBoxException
+
+import threading
+import time
+
+class Condition(object):
+    """Something to wait for.
+
+    check is a function returning True once the condition holds. If
+    machineId is given, check is re-evaluated when an event arrives
+    for that machine, otherwise on every event."""
+
+    def __init__(self, check, machineId=None):
+        self._check = check
+        self.machineId = machineId
+        self.satisfied = False
+
+    def check(self):
+        """Evaluate the condition against VirtualBox."""
+        self.satisfied = bool(self._check())
+        return self.satisfied
+
+    def onMachineState(self, state):
+        """Called with the new state of machineId."""
+        self.check()
+
+    def onSessionState(self, state):
+        """Called with the new session state of machineId."""
+        self.check()
+
+class MachineStateCondition(Condition):
+    """Condition that a VirtualMachine's state is one of the given states."""
+
+    def __init__(self, vm, states):
+        Condition.__init__(self, None, vm.id)
+        self.vm = vm
+        self.states = frozenset(states)
+
+    def check(self):
+        self.vm.invalidateCache("state")
+        self.satisfied = self.vm.state in self.states
+        return self.satisfied
+
+    def onMachineState(self, state):
+        # Event carries the state, no need to ask VirtualBox
+        self.satisfied = state in self.states
+
+    def onSessionState(self, state):
+        pass
+
+class SessionStateCondition(Condition):
+    """Condition that a VirtualMachine's session state is one of the given states."""
+
+    def __init__(self, vm, states):
+        Condition.__init__(self, None, vm.id)
+        self.vm = vm
+        self.states = frozenset(states)
+
+    def check(self):
+        self.vm.invalidateCache("sessionState")
+        self.satisfied = self.vm.sessionState in self.states
+        return self.satisfied
+
+    def onMachineState(self, state):
+        pass
+
+    def onSessionState(self, state):
+        self.satisfied = state in self.states
+
+class Waiter(VirtualBoxMonitor):
+    """Waits for Conditions to be satisfied.
+
+    pollInterval is the longest time, in milliseconds, spent waiting
+    for an event before checking for cancellation or timeout.
+
+    recheckInterval is how often, in milliseconds, every unsatisfied
+    condition is re-evaluated against VirtualBox in case an event was
+    missed."""
+
+    def __init__(self, pollInterval=250, recheckInterval=5000):
+        VirtualBoxMonitor.__init__(self)
+        self.pollInterval = pollInterval
+        self.recheckInterval = recheckInterval
+        self._cancelled = threading.Event()
+        self._byMachine = {}
+        self._anyMachine = []
+
+    def cancel(self):
+        """Make any current or later wait raise VirtualBoxOperationAborted."""
+        self._cancelled.set()
+
+    def isCancelled(self):
+        """Has cancel() been called?"""
+        return self._cancelled.is_set()
+
+    def waitAny(self, conditions, timeout=None):
+        """Wait until at least one of the conditions is satisfied.
+
+        timeout is in milliseconds, None to wait indefinitely. Raises
+        VirtualBoxTimeoutException on timeout. Returns list of
+        satisfied conditions."""
+        return self._wait(conditions, 1, timeout)
+
+    def waitAll(self, conditions, timeout=None):
+        """Wait until all of the conditions are satisfied.
+
+        timeout is in milliseconds, None to wait indefinitely. Raises
+        VirtualBoxTimeoutException on timeout. Returns list of
+        conditions."""
+        return self._wait(conditions, len(conditions), timeout)
+
+    def _wait(self, conditions, count, timeout):
+        """Wait until count of the conditions are satisfied."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout / 1000.0
+        self._byMachine = {}
+        self._anyMachine = []
+        for condition in conditions:
+            if condition.machineId is None:
+                self._anyMachine.append(condition)
+            else:
+                self._byMachine.setdefault(condition.machineId,
+                                           []).append(condition)
+        # Register before the first check so no change can slip in
+        # between the two unnoticed.
+        self.register()
+        try:
+            for condition in conditions:
+                condition.check()
+            lastCheck = time.time()
+            while True:
+                satisfied = [c for c in conditions if c.satisfied]
+                if len(satisfied) >= count:
+                    return satisfied
+                if self.isCancelled():
+                    raise VirtualBoxException.VirtualBoxOperationAborted(
+                        "Wait cancelled")
+                now = time.time()
+                if (deadline is not None) and (now >= deadline):
+                    raise VirtualBoxException.VirtualBoxTimeoutException(
+                        "Timed out waiting for %d of %d conditions" %
+                        (count - len(satisfied), len(conditions)))
+                if (now - lastCheck) * 1000 >= self.recheckInterval:
+                    for condition in conditions:
+                        if not condition.satisfied:
+                            condition.check()
+                    lastCheck = now
+                    continue
+                wait = self.pollInterval
+                if deadline is not None:
+                    wait = max(0, min(wait, int((deadline - now) * 1000)))
+                self.processEvents(wait)
+        finally:
+            self.unregister()
+
+    def _dispatch(self, event):
+        VirtualBoxMonitor._dispatch(self, event)
+        for condition in self._anyMachine:
+            condition.check()
+
+    def onMachineStateChange(self, id, state):
+        VirtualBoxMonitor.onMachineStateChange(self, id, state)
+        for condition in self._byMachine.get(id, []):
+            condition.onMachineState(state)
+
+    def onSessionStateChange(self, id, state):
+        VirtualBoxMonitor.onSessionStateChange(self, id, state)
+        for condition in self._byMachine.get(id, []):
+            condition.onSessionState(state)
+
+def waitAny(conditions, timeout=None):
+    """Wait until at least one of the conditions is satisfied.
+
+    See Waiter.waitAny()."""
+    return Waiter().waitAny(conditions, timeout)
+
+def waitAll(conditions, timeout=None):
+    """Wait until all of the conditions are satisfied.
+
+    See Waiter.waitAll()."""
+    return Waiter().waitAll(conditions, timeout)
@@ -1,5 +1,99 @@
+import PropertyCache
 import VirtualBoxException
 
+# ExceptionHandler keeps no state, so one instance serves every access.
+_exceptionHandler = VirtualBoxException.ExceptionHandler()
+
+class PassthruProperty(object):
+    """Descriptor exposing a property of the wrapped instance directly.
+
+    The property can be retrieved or set, but not deleted."""
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        cache = instance._propertyCache
+        if cache is not None:
+            return cache.lookup(self.name, lambda: self.fetch(instance))
+        return self.fetch(instance)
+
+    def __set__(self, instance, value):
+        with _exceptionHandler:
+            setattr(instance._wrappedInstance, self.name, value)
+        cache = instance._propertyCache
+        if cache is not None:
+            cache.invalidate(self.name)
+
+    def fetch(self, instance):
+        """Read the property from the wrapped instance, bypassing any cache."""
+        with _exceptionHandler:
+            return getattr(instance._wrappedInstance, self.name)
+
+    def __delete__(self, instance):
+        raise AttributeError("Cannot delete attribute '%s'" % self.name)
+
+class WrappedProperty(PassthruProperty):
+    """Descriptor returning a property of the wrapped instance converted by func.
+
+    None or other false values are returned as None without calling
+    func. The property is read-only."""
+    __slots__ = ("func",)
+
+    def __init__(self, name, func):
+        PassthruProperty.__init__(self, name)
+        self.func = func
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = PassthruProperty.__get__(self, instance, owner)
+        return self.func(value) if value else None
+
+    def __set__(self, instance, value):
+        raise AttributeError("Cannot set attribute '%s'" % self.name)
+
+class Record(object):
+    """Immutable record of property values read from a wrapped instance.
+
+    Each Wrapper class has its own Record class, with a slot for each
+    of its passthru properties. Properties that were not read are left
+    unset and raise AttributeError when accessed."""
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name, value in fields.iteritems():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Cannot set attribute '%s' of record" % name)
+
+    def __delattr__(self, name):
+        raise AttributeError("Cannot delete attribute '%s' of record" % name)
+
+    def fields(self):
+        """Return the names of the properties held by this record."""
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def asDict(self):
+        """Return the properties held by this record as a dictionary."""
+        return dict((name, getattr(self, name)) for name in self.fields())
+
+    def __eq__(self, other):
+        return ((type(self) is type(other)) and
+                (self.asDict() == other.asDict()))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+                           ", ".join("%s=%r" % (name, getattr(self, name))
+                                     for name in self.fields()))
+
 class Wrapper(object):
     """Base class for wrappers around VirtualBox XPCOM-based objects.
 
@@ -18,35 +112,112 @@ class Wrapper(object):
     element is invoked with the property as an argument and the result is
     returned.
 
+    _passthruMethods is the directly exposed methods (as strings) of
+    the wrapped class. They are accessed like _passthruProperties but
+    are not included in records.
+
+    When a child class is created, these lists are compiled into
+    descriptors on the class (see PassthruProperty and
+    WrappedProperty), so accessing them costs no more than a normal
+    attribute. Names the child class defines itself are left alone.
+
+    snapshot() reads many passthru properties at once into a Record.
+
+    enableCache() turns on a PropertyCache for one wrapper, so repeated
+    reads of a property do not go back to VirtualBox.
+
+    Wrappers use __slots__. A child class that keeps state of its own
+    must list it in its own __slots__.
+
     Utilizing this class since I don't kow how to inherit the XPCOM
     classes directly.
     """
-    _wrappedInstance = None
+    __slots__ = ("_wrappedInstance", "_propertyCache", "__weakref__")
+
     _passthruProperties = []
+    _passthruMethods = []
     _wrappedProperties = []
 
-    def __getattr__(self, attr):
-        if self._wrappedInstance:
-            if attr in self._passthruProperties:
-                with VirtualBoxException.ExceptionHandler():
-                    return getattr(self._wrappedInstance, attr)
-            for prop, func in self._wrappedProperties:
-                if prop == attr:
-                    with VirtualBoxException.ExceptionHandler():
-                        value = getattr(self._wrappedInstance, attr)
-                    return func(value) if value else None
-        raise AttributeError("Unrecognized attribute '%s'" % attr)
-
-    def __setattr__(self, attr, value):
-        if self._wrappedInstance and (attr in self._passthruProperties):
-            with VirtualBoxException.ExceptionHandler():
-                setattr(self._wrappedInstance, attr, value)
-        self.__dict__[attr] = value
-
-    def __delattr__(self, attr):
-       if self._wrappedInstance and (attr in self._passthruProperties):
-           with VirtualBoxException.ExceptionHandler():
-               raise AttributeError("Cannot delete attribute '%s'" % attr)
-       del self.__dict__[attr]
-
-            
+    class __metaclass__(type):
+        def __new__(meta, name, bases, namespace):
+            namespace.setdefault("__slots__", ())
+            if "_passthruProperties" in namespace:
+                # Properties the class defines itself are not the raw
+                # values and so are not recorded.
+                recordProperties = tuple(
+                    attr for attr in namespace["_passthruProperties"]
+                    if attr not in namespace)
+                namespace["_recordType"] = type(name + "Record",
+                                                (Record,),
+                                                {"__slots__" : recordProperties,
+                                                 "__module__" : namespace.get("__module__")})
+            for attr in (namespace.get("_passthruProperties", []) +
+                         namespace.get("_passthruMethods", [])):
+                if attr not in namespace:
+                    namespace[attr] = PassthruProperty(attr)
+            for attr, func in namespace.get("_wrappedProperties", []):
+                if attr not in namespace:
+                    namespace[attr] = WrappedProperty(attr, func)
+            return type.__new__(meta, name, bases, namespace)
+
+    def __new__(cls, *args, **kwargs):
+        self = object.__new__(cls)
+        self._propertyCache = None
+        return self
+
+    def snapshot(self, props=None):
+        """Return a Record of the given passthru properties.
+
+        props is a list of property names, if None all passthru
+        properties are read. The properties are read in one pass and
+        the returned Record does not access the wrapped instance."""
+        recordType = self._recordType
+        if props is None:
+            props = recordType.__slots__
+        else:
+            unknown = set(props).difference(recordType.__slots__)
+            if unknown:
+                raise AttributeError("Unrecognized attribute(s) %s" %
+                                     ", ".join(sorted(unknown)))
+        wrapped = self._wrappedInstance
+        fields = {}
+        with _exceptionHandler:
+            for prop in props:
+                fields[prop] = getattr(wrapped, prop)
+        return recordType(**fields)
+
+    #
+    # Property caching
+    #
+
+    def enableCache(self, ttl=None, events=True):
+        """Cache property values read through this wrapper.
+
+        ttl is how long, in seconds, a value may be served from the
+        cache. If None, values are kept until invalidated.
+
+        If events is True and the wrapped object has an id, the cache is
+        also invalidated whenever VirtualBox reports an event for the
+        object (see VirtualBoxMonitor). Values with no ttl are then only
+        served while events are being watched."""
+        if self._propertyCache is not None:
+            self._propertyCache.ttl = ttl
+            return
+        events = events and ("id" in self._recordType.__slots__)
+        self._propertyCache = PropertyCache.PropertyCache(ttl, events)
+        if events:
+            PropertyCache.register(self.id, self)
+            PropertyCache.startEventInvalidation()
+
+    def disableCache(self):
+        """Stop caching property values read through this wrapper."""
+        if self._propertyCache is None:
+            return
+        self._propertyCache = None
+        if "id" in self._recordType.__slots__:
+            PropertyCache.unregister(self.id, self)
+
+    def invalidateCache(self, name=None):
+        """Forget the cached value of the named property, or of all properties."""
+        if self._propertyCache is not None:
+            self._propertyCache.invalidate(name)
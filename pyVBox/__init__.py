@@ -1,3 +1,9 @@
+import Async
+import ObjectIndex
+import VBoxSettings
+from GuestOSType import GuestOSType
+from GuestOSType import GuestOSTypeCatalog
+from GuestOSType import getCatalog
 from HardDisk import HardDisk
 from Medium import Device
 from Medium import DVD
@@ -8,12 +14,23 @@ from Medium import SharedFolder
 from Medium import USBDevice
 from Session import Session
 from StorageController import StorageController
+from VDI import VDI
 from VirtualBox import VirtualBox
 from VirtualBoxManager import Constants
 from VirtualBoxException import ExceptionHandler
 from VirtualBoxException import VirtualBoxException
 from VirtualBoxException import VirtualBoxFileError
 from VirtualBoxException import VirtualBoxFileNotFoundException
+from VirtualBoxException import VirtualBoxInvalidSessionStateException
 from VirtualBoxException import VirtualBoxObjectNotFoundException
+from VirtualBoxException import VirtualBoxTimeoutException
 from VirtualBoxManager import VirtualBoxManager
+from VirtualBoxManager import connect
+from VirtualBoxManager import isConnected
+from VirtualBoxManager import shutdown
 from VirtualMachine import VirtualMachine
+from Waiter import MachineStateCondition
+from Waiter import SessionStateCondition
+from Waiter import Waiter
+from Waiter import waitAll
+from Waiter import waitAny
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Unittests for Async"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import Async
+from pyVBox import HardDisk
+from pyVBox import VirtualBoxTimeoutException
+
+import time
+
+class AsyncTests(pyVBoxTest):
+    """Test case for Async"""
+
+    def testCall(self):
+        """Test Async.call()"""
+        future = Async.call(lambda x: x * 2, 21)
+        self.assertEqual(42, future.result(timeout=1000))
+        self.assertTrue(future.done())
+
+    def testException(self):
+        """Test Future.exception()"""
+        future = Async.call(lambda: 1 / 0)
+        self.assertTrue(isinstance(future.exception(timeout=1000),
+                                   ZeroDivisionError))
+        self.assertRaises(ZeroDivisionError, future.result)
+
+    def testTimeout(self):
+        """Test Future.result() timing out"""
+        future = Async.call(time.sleep, 1)
+        self.assertRaises(VirtualBoxTimeoutException, future.result, 100)
+
+    def testSetupFailure(self):
+        """Test calls fail when the executor thread cannot start"""
+        def failingManager():
+            raise RuntimeError("No VirtualBox")
+        Async.shutdown()
+        savedGetManager = Async.getManager
+        Async.getManager = failingManager
+        try:
+            future = Async.call(lambda: 42)
+            self.assertTrue(isinstance(future.exception(timeout=1000),
+                                       RuntimeError))
+        finally:
+            Async.getManager = savedGetManager
+        # The next call starts a working executor
+        self.assertEqual(42, Async.call(lambda: 42).result(timeout=1000))
+
+    def testClone(self):
+        """Test Async.clone()"""
+        harddisk = HardDisk.open(self.testHDpath)
+        future = Async.clone(harddisk, self.cloneHDpath)
+        percents = []
+        future.addProgressCallback(percents.append)
+        progress = future.result()
+        self.assertTrue(progress.completed)
+        self.assertEqual(100, future.percent)
+        clonedisk = HardDisk.find(self.cloneHDpath)
+        self.assertNotEqual(harddisk.id, clonedisk.id)
+
+if __name__ == '__main__':
+    main()
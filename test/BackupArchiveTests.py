@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""Unittests for BackupArchive"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox.BackupArchive import ArchiveWriter, openArchive
+from pyVBox.VirtualBoxException import VirtualBoxNotSupportException
+
+import gzip
+import StringIO
+
+class BackupArchiveTests(pyVBoxTest):
+    """Test case for BackupArchive"""
+
+    def _archive(self, codec):
+        output = StringIO.StringIO()
+        # Small chunks so the stream is compressed in several pieces
+        archive = ArchiveWriter(output, codec=codec, threads=3,
+                                chunkSize=4096)
+        archive.addFile(self.testVMpath, "TestVM/TestVM.xml")
+        archive.addFile(self.testHDpath, "TestVM/TestHD.vdi")
+        archive.close()
+        self.assertTrue(archive.bytesOut < archive.bytesIn)
+        output.seek(0)
+        return output
+
+    def _check(self, output, codec):
+        tar = openArchive(output, codec)
+        for member in tar:
+            source = {"TestVM/TestVM.xml": self.testVMpath,
+                      "TestVM/TestHD.vdi": self.testHDpath}[member.name]
+            with open(source, "rb") as f:
+                self.assertEqual(f.read(), tar.extractfile(member).read())
+
+    def testGzip(self):
+        """Test archive with gzip codec"""
+        output = self._archive("gzip")
+        self._check(output, "gzip")
+        # Readable as one gzip stream too
+        output.seek(0)
+        self.assertTrue(len(gzip.GzipFile(fileobj=output).read()) > 0)
+
+    def testBzip2(self):
+        """Test archive with bzip2 codec"""
+        self._check(self._archive("bzip2"), "bzip2")
+
+    def testBadCodec(self):
+        """Test archive with unknown codec"""
+        self.assertRaises(VirtualBoxNotSupportException,
+                          ArchiveWriter, StringIO.StringIO(), "bogus")
+
+if __name__ == '__main__':
+    main()
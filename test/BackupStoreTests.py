@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Unittests for BackupStore"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import VDI
+from pyVBox import VirtualBoxObjectNotFoundException
+from pyVBox.BackupStore import BackupStore
+from VDITests import allocateBlocks
+
+import json
+import os
+import os.path
+import shutil
+import threading
+
+class BackupStoreTests(pyVBoxTest):
+    """Test case for BackupStore"""
+
+    storePath = "test/tmp/store"
+    restorePath = "test/tmp/RestoreHD.vdi"
+
+    def tearDown(self):
+        pyVBoxTest.tearDown(self)
+        shutil.rmtree(self.storePath, ignore_errors=True)
+        if os.path.exists(self.restorePath):
+            os.remove(self.restorePath)
+
+    def testBackup(self):
+        """Test BackupStore.backup() deduplicates chunks"""
+        store = BackupStore(self.storePath)
+        allocateBlocks(self.testHDpath, {1: "a", 3: "b"})
+        first = store.backup(self.testHDpath, name="first")["id"]
+        second = store.backup(self.testHDpath, name="second")["id"]
+        self.assertNotEqual(first, second)
+        backups = store.backups()
+        self.assertEqual([first, second], [b["id"] for b in backups])
+        self.assertEqual(2, backups[0]["newChunks"])
+        self.assertEqual(0, backups[1]["newChunks"])
+        self.assertEqual([second], [b["id"] for b in store.backups("second")])
+
+    def testRestore(self):
+        """Test BackupStore.restore()"""
+        store = BackupStore(self.storePath)
+        allocateBlocks(self.testHDpath, {1: "a", 3: "b"})
+        backupId = store.backup(self.testHDpath)["id"]
+        self.assertEqual(2, store.restore(backupId, self.restorePath))
+        with VDI(self.testHDpath) as source:
+            with VDI(self.restorePath) as restored:
+                self.assertEqual(source.id, restored.id)
+                self.assertEqual([1, 3], restored.allocatedBlocks())
+                for index in range(4):
+                    offset = index * source.blockSize
+                    self.assertEqual(source.read(offset, source.blockSize),
+                                     restored.read(offset, source.blockSize))
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          store.restore, "bogus", self.restorePath)
+
+    def testGC(self):
+        """Test BackupStore.gc()"""
+        store = BackupStore(self.storePath)
+        allocateBlocks(self.testHDpath, {1: "a"})
+        store.backup(self.testHDpath)
+        shutil.copy(self.testHDsrc, self.testHDpath)
+        allocateBlocks(self.testHDpath, {1: "b"})
+        latest = store.backup(self.testHDpath)["id"]
+        self.assertEqual((0, 0), store.gc())
+        removed, freed = store.gc(keep=1)
+        # Old data chunk goes, the header is shared
+        self.assertEqual(1, removed)
+        self.assertEqual([latest], [b["id"] for b in store.backups()])
+        store.restore(latest, self.restorePath)
+
+    def testConcurrentBackups(self):
+        """Test BackupStore.backup() from several threads at once"""
+        store = BackupStore(self.storePath)
+        allocateBlocks(self.testHDpath, {1: "a", 3: "b"})
+        names = ["disk%d" % i for i in range(8)]
+        threads = [threading.Thread(target=store.backup,
+                                    args=(self.testHDpath, name))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(names),
+                         sorted(b["name"] for b in store.backups()))
+
+    def testGCUnindexed(self):
+        """Test BackupStore.gc() keeps chunks of backups missing from the index"""
+        store = BackupStore(self.storePath)
+        allocateBlocks(self.testHDpath, {1: "a"})
+        backupId = store.backup(self.testHDpath)["id"]
+        with open(os.path.join(self.storePath, "index.json"), "w") as f:
+            json.dump([], f)
+        self.assertEqual((0, 0), store.gc())
+        self.assertEqual(1, store.restore(backupId, self.restorePath))
+
+if __name__ == '__main__':
+    main()
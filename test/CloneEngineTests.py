@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""Unittests for CloneEngine"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import HardDisk
+from pyVBox.CloneEngine import CloneEngine
+
+import os.path
+
+class CloneEngineTests(pyVBoxTest):
+    """Test case for CloneEngine"""
+
+    def testRun(self):
+        """Test CloneEngine.run()"""
+        harddisk = HardDisk.open(self.testHDpath)
+        engine = CloneEngine(maxConcurrent=2)
+        job = engine.add(harddisk, self.cloneHDpath)
+        self.assertEqual(0, engine.percent())
+        calls = []
+        engine.run(calls.append)
+        self.assertTrue(len(calls) > 0)
+        self.assertEqual([], engine.failed())
+        self.assertTrue(job.isDone())
+        self.assertEqual(100, engine.percent())
+        self.assertTrue(os.path.exists(self.cloneHDpath))
+        clonedisk = HardDisk.find(self.cloneHDpath)
+        self.assertNotEqual(harddisk.id, clonedisk.id)
+
+    def testFailure(self):
+        """Test CloneEngine records failed clones"""
+        harddisk = HardDisk.open(self.testHDpath)
+        engine = CloneEngine()
+        # Target already exists
+        job = engine.add(harddisk, self.testHDpath)
+        engine.run()
+        self.assertEqual([job], engine.failed())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Unittests for Compaction"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox.Compaction import CompactionPlanner
+from VDIChainTests import makeDiff
+from VDITests import allocateBlocks
+
+import os
+import os.path
+
+class CompactionTests(pyVBoxTest):
+    """Test case for Compaction"""
+
+    def testPlan(self):
+        """Test CompactionPlanner.plan()"""
+        allocateBlocks(self.testHDpath, {1: "a", 2: "\0", 4: "\0"})
+        planner = CompactionPlanner()
+        report = planner.addDisk(self.testHDpath)
+        self.assertEqual(2 * 1024 * 1024, report.zeroSize)
+        self.assertEqual(1024 * 1024, report.dataSize)
+        self.assertEqual(2 * 1024 * 1024, report.reclaimable)
+        self.assertEqual([report], planner.plan())
+        self.assertEqual(report.reclaimable, planner.totalReclaimable())
+        planner.minReclaimable = 3 * 1024 * 1024
+        self.assertEqual([], planner.plan())
+
+    def testDifferencing(self):
+        """Test CompactionPlanner with a differencing image"""
+        diffPath = "test/tmp/DiffHD.vdi"
+        allocateBlocks(self.testHDpath, {1: "a"})
+        makeDiff(self.testHDpath, diffPath, {1: "\0", 2: "\0"})
+        try:
+            report = CompactionPlanner().addDisk(diffPath)
+            self.assertEqual(2 * 1024 * 1024, report.zeroSize)
+            # Block 1 hides the parent's data and must stay
+            self.assertEqual(1024 * 1024, report.reclaimable)
+        finally:
+            os.remove(diffPath)
+
+    def testSkipped(self):
+        """Test CompactionPlanner with a disk that cannot be scanned"""
+        planner = CompactionPlanner()
+        self.assertEqual(None, planner.addDisk(self.testVMpath))
+        self.assertEqual(1, len(planner.skipped))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Unittests for Daemon"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import Daemon
+
+import os
+import os.path
+import StringIO
+import sys
+import threading
+
+def echo(argv, stdout, stderr):
+    """Handler printing its arguments and working directory."""
+    print " ".join(argv)
+    stderr.write(os.getcwd())
+    if argv == ["fail"]:
+        raise Exception("failed")
+    return len(argv)
+
+class DaemonTests(pyVBoxTest):
+    """Test case for Daemon"""
+
+    def setUp(self):
+        pyVBoxTest.setUp(self)
+        self.socketPath = os.path.abspath(os.path.join(self.testPath,
+                                                       "daemon.sock"))
+
+    def serve(self, requests):
+        """Serve the given number of requests on a thread."""
+        server = Daemon.Server(echo, self.socketPath)
+        server.listen()
+        def run():
+            try:
+                for i in range(requests):
+                    conn, address = server._sock.accept()
+                    try:
+                        server.serve(conn)
+                    finally:
+                        conn.close()
+            finally:
+                server.close()
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def testForward(self):
+        """Test Daemon.forward() to a Server"""
+        savedStdout = sys.stdout
+        thread = self.serve(2)
+        stdout = StringIO.StringIO()
+        stderr = StringIO.StringIO()
+        status = Daemon.forward(["list", "-v"], self.socketPath,
+                                stdout, stderr)
+        self.assertEqual(2, status)
+        self.assertEqual("list -v\n", stdout.getvalue())
+        self.assertEqual(os.getcwd(), stderr.getvalue())
+        stderr = StringIO.StringIO()
+        status = Daemon.forward(["fail"], self.socketPath, stdout, stderr)
+        self.assertEqual(1, status)
+        self.assertTrue(stderr.getvalue().endswith("Error: failed\n"))
+        thread.join()
+        self.assertFalse(os.path.exists(self.socketPath))
+        self.assertTrue(sys.stdout is savedStdout)
+
+    def request(self, payload):
+        """Send a raw request payload, returning the frames received."""
+        sock = Daemon._connect(self.socketPath)
+        try:
+            Daemon.sendFrame(sock, Daemon.FRAME_REQUEST, payload)
+            frames = [Daemon.receiveFrame(sock)]
+            while frames[-1][0] != Daemon.FRAME_EXIT:
+                frames.append(Daemon.receiveFrame(sock))
+        finally:
+            sock.close()
+        return frames
+
+    def testBadRequests(self):
+        """Test Server keeps serving after requests it cannot run"""
+        thread = self.serve(3)
+        frames = self.request("{not json")
+        self.assertEqual((Daemon.FRAME_EXIT, "1"), frames[-1])
+        self.assertTrue(frames[0][1].startswith("Error: Invalid request"))
+        frames = self.request('{"argv": ["list"], "cwd": "/nonexistent"}')
+        self.assertEqual((Daemon.FRAME_EXIT, "1"), frames[-1])
+        self.assertTrue(frames[0][1].startswith("Error: "))
+        stdout = StringIO.StringIO()
+        self.assertEqual(1, Daemon.forward(["list"], self.socketPath,
+                                           stdout, StringIO.StringIO()))
+        self.assertEqual("list\n", stdout.getvalue())
+        thread.join()
+
+    def testNoDaemon(self):
+        """Test Daemon.forward() with no daemon running"""
+        self.assertEqual(None, Daemon.forward(["list"], self.socketPath))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""Unittests for Fleet"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import VirtualMachine
+from pyVBox.Fleet import Fleet
+
+class FleetTests(pyVBoxTest):
+    """Test case for Fleet"""
+
+    def testSelect(self):
+        """Test Fleet.select()"""
+        machine = VirtualMachine.open(self.testVMpath)
+        machine.register()
+        vms = Fleet.select(["TestV*", self.testVMname])
+        self.assertEqual([machine.id], [vm.id for vm in vms])
+        self.assertEqual([], Fleet.select(["NoSuchVM*"]))
+        machine.unregister()
+
+    def testApply(self):
+        """Test Fleet.apply()"""
+        machine = VirtualMachine.open(self.testVMpath)
+        machine.register()
+        fleet = Fleet([machine], maxWorkers=2)
+        results = fleet.apply(lambda vm: vm.name)
+        self.assertEqual(1, len(results))
+        self.assertTrue(results[0].ok)
+        self.assertEqual(self.testVMname, results[0].value)
+        results = fleet.apply(lambda vm: 1/0)
+        self.assertFalse(results[0].ok)
+        self.assertTrue(isinstance(results[0].error, ZeroDivisionError))
+        self.assertRaises(ValueError, fleet.apply, "bogus")
+        machine.unregister()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Unittests for GuestOSType"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import GuestOSType
+from pyVBox import GuestOSTypeCatalog
+from pyVBox import VirtualBoxFileError
+from pyVBox import VirtualBoxObjectNotFoundException
+from pyVBox import getCatalog
+from pyVBox.GuestOSType import catalogPath, resetCatalog
+
+import os.path
+
+def osType(id, familyId, description=None):
+    return GuestOSType._recordType(id=id, familyId=familyId,
+                                   familyDescription=familyId + " family",
+                                   description=description or id,
+                                   recommendedRAM=512)
+
+class FakeOSType(object):
+    """Stands in for a GuestOSType wrapper."""
+
+    def __init__(self, record):
+        self.record = record
+
+    def snapshot(self):
+        return self.record
+
+class FakeVirtualBox(object):
+    """Stands in for VirtualBox, counting guest OS type enumerations."""
+    version = "4.0.8"
+    revision = 71778
+
+    def __init__(self, records):
+        self.records = records
+        self.enumerations = 0
+
+    @property
+    def guestOSTypes(self):
+        self.enumerations += 1
+        return [FakeOSType(r) for r in self.records]
+
+class GuestOSTypeTests(pyVBoxTest):
+    """Test case for GuestOSType"""
+
+    records = [osType("Ubuntu", "Linux"), osType("Ubuntu_64", "Linux"),
+               osType("WindowsXP", "Windows")]
+
+    def tearDown(self):
+        resetCatalog()
+        pyVBoxTest.tearDown(self)
+
+    def testCatalog(self):
+        """Test GuestOSTypeCatalog lookups"""
+        catalog = GuestOSTypeCatalog(self.records)
+        self.assertEqual(3, len(catalog))
+        self.assertEqual(self.records[1], catalog.get("ubuntu_64"))
+        self.assertTrue("Ubuntu" in catalog)
+        self.assertFalse("OS2" in catalog)
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          catalog.get, "OS2")
+        self.assertEqual(self.records[:2], catalog.family("Linux"))
+        self.assertEqual([("Linux", "Linux family"),
+                          ("Windows", "Windows family")],
+                         catalog.families())
+
+    def testSave(self):
+        """Test GuestOSTypeCatalog.save() and fromFile()"""
+        path = os.path.join(self.testPath, "catalog.json")
+        GuestOSTypeCatalog(self.records, "4.0.8", 71778).save(path)
+        catalog = GuestOSTypeCatalog.fromFile(path)
+        self.assertEqual(self.records, list(catalog))
+        self.assertEqual("4.0.8", catalog.version)
+        self.assertEqual(71778, catalog.revision)
+        self.assertRaises(VirtualBoxFileError,
+                          GuestOSTypeCatalog(self.records).save,
+                          os.path.join(self.testPath, "missing", "c.json"))
+
+    def testGetCatalog(self):
+        """Test getCatalog() reads VirtualBox only once"""
+        vbox = FakeVirtualBox(self.records)
+        catalog = getCatalog(vbox, self.testPath)
+        self.assertEqual(self.records, list(catalog))
+        self.assertTrue(getCatalog(vbox, self.testPath) is catalog)
+        self.assertTrue(os.path.exists(catalogPath(vbox.version,
+                                                   vbox.revision,
+                                                   self.testPath)))
+        # A new process would find the saved catalog
+        resetCatalog()
+        self.assertEqual(self.records, list(getCatalog(vbox, self.testPath)))
+        self.assertEqual(1, vbox.enumerations)
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,16 @@ class HardDiskTests(pyVBoxTest):
         self.assertEqual(os.path.basename(self.testHDpath), harddisk.basename())
         harddisk.close()
 
+    def testChain(self):
+        """Test HardDisk parent and chain of a base image"""
+        harddisk = HardDisk.open(self.testHDpath)
+        self.assertEqual(None, harddisk.parent)
+        self.assertEqual([], harddisk.children)
+        self.assertEqual(harddisk.id, harddisk.base.id)
+        self.assertEqual([harddisk.id],
+                         [medium.id for medium in harddisk.getChain()])
+        harddisk.close()
+
     def testOpenNotFound(self):
         """Test HardDisk.open() with not found file"""
         self.assertRaises(
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Unittests for IncrementalBackup"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import VDI
+from pyVBox import VirtualBoxFileError
+from pyVBox.VDI import _fieldOffset
+from pyVBox.IncrementalBackup import IncrementalBackup
+from VDITests import allocateBlocks
+
+import os
+import os.path
+import shutil
+import uuid
+
+class IncrementalBackupTests(pyVBoxTest):
+    """Test case for IncrementalBackup"""
+
+    backupPath = "test/tmp/backup"
+    restorePath = "test/tmp/RestoreHD.vdi"
+
+    def tearDown(self):
+        pyVBoxTest.tearDown(self)
+        shutil.rmtree(self.backupPath, ignore_errors=True)
+        if os.path.exists(self.restorePath):
+            os.remove(self.restorePath)
+
+    def testBackup(self):
+        """Test IncrementalBackup.backup()"""
+        backup = IncrementalBackup(self.backupPath)
+        allocateBlocks(self.testHDpath, {1: "a", 3: "b"})
+        first = backup.backup(self.testHDpath)
+        self.assertTrue(os.path.exists(first))
+        # Nothing changed
+        self.assertEqual(None, backup.backup(self.testHDpath))
+        shutil.copy(self.testHDsrc, self.testHDpath)
+        allocateBlocks(self.testHDpath, {1: "a", 2: "c"})
+        second = backup.backup(self.testHDpath)
+        # Only the changed block is stored
+        self.assertTrue(os.path.getsize(second) < os.path.getsize(first))
+
+    def testBackupOtherDisk(self):
+        """Test IncrementalBackup.backup() refuses another disk of the same name"""
+        backup = IncrementalBackup(self.backupPath)
+        backup.backup(self.testHDpath)
+        with open(self.testHDpath, "r+b") as f:
+            f.seek(_fieldOffset("uuidCreate"))
+            f.write(uuid.uuid4().bytes_le)
+        self.assertRaises(VirtualBoxFileError, backup.backup, self.testHDpath)
+
+    def testRestore(self):
+        """Test IncrementalBackup.restore()"""
+        backup = IncrementalBackup(self.backupPath)
+        allocateBlocks(self.testHDpath, {1: "a", 3: "b"})
+        backup.backup(self.testHDpath)
+        shutil.copy(self.testHDsrc, self.testHDpath)
+        allocateBlocks(self.testHDpath, {1: "a", 2: "c"})
+        backup.backup(self.testHDpath)
+        manifest = backup.manifestPath("TestHD")
+        self.assertEqual(2, IncrementalBackup.restore(manifest,
+                                                      self.restorePath))
+        with VDI(self.testHDpath) as source:
+            with VDI(self.restorePath) as restored:
+                self.assertEqual(source.id, restored.id)
+                self.assertEqual([1, 2], restored.allocatedBlocks())
+                for index in range(5):
+                    offset = index * source.blockSize
+                    self.assertEqual(source.read(offset, source.blockSize),
+                                     restored.read(offset, source.blockSize))
+        IncrementalBackup.restore(manifest, self.restorePath, upTo=0)
+        with VDI(self.restorePath) as restored:
+            self.assertEqual([1, 3], restored.allocatedBlocks())
+
+    def testRestoreRaw(self):
+        """Test IncrementalBackup.restore() to a raw image"""
+        backup = IncrementalBackup(self.backupPath)
+        allocateBlocks(self.testHDpath, {1: "a"})
+        backup.backup(self.testHDpath)
+        IncrementalBackup.restore(backup.manifestPath("TestHD"),
+                                  self.restorePath, raw=True)
+        with VDI(self.testHDpath) as source:
+            self.assertEqual(source.logicalSize,
+                             os.path.getsize(self.restorePath))
+            with open(self.restorePath, "rb") as f:
+                f.seek(source.blockSize)
+                self.assertEqual("aa", f.read(2))
+
+if __name__ == '__main__':
+    main()
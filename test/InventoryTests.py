@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Unittests for Inventory"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox.Inventory import Inventory
+from pyVBox import VBoxSettings
+from pyVBox import VirtualBoxObjectNotFoundException
+from VBoxSettingsTests import snapshotVM
+
+import os
+import os.path
+
+globalSettings = """<?xml version="1.0"?>
+<VirtualBox xmlns="http://www.innotek.de/VirtualBox-settings" version="1.11-linux">
+  <Global>
+    <MachineRegistry>
+      <MachineEntry uuid="{0895eb90-4ba1-4d00-833f-d3d2d9cfedcb}" src="TestVM.xml"/>
+      <MachineEntry uuid="{11111111-2222-3333-4444-555555555555}" src="SnapVM.vbox"/>
+    </MachineRegistry>
+    <MediaRegistry>
+      <HardDisks>
+        <HardDisk uuid="{c92b558e-eba5-43e8-a8b3-984f946db1b2}" location="TestHD.vdi" format="VDI"/>
+      </HardDisks>
+    </MediaRegistry>
+  </Global>
+</VirtualBox>
+"""
+
+class InventoryTests(pyVBoxTest):
+    """Test case for Inventory"""
+
+    def setUp(self):
+        pyVBoxTest.setUp(self)
+        self.snapVMpath = os.path.join(self.testPath, "SnapVM.vbox")
+        with open(self.snapVMpath, "w") as f:
+            f.write(snapshotVM)
+        self.globalPath = os.path.join(self.testPath, "VirtualBox.xml")
+        with open(self.globalPath, "w") as f:
+            f.write(globalSettings)
+        self.inventory = Inventory(os.path.join(self.testPath, "inventory.db"),
+                                   globalSettingsPath=self.globalPath)
+
+    def tearDown(self):
+        self.inventory.close()
+        pyVBoxTest.tearDown(self)
+
+    def testRefresh(self):
+        """Test Inventory.refresh() from the global settings file"""
+        self.assertEqual(3, self.inventory.refresh())
+        self.assertEqual(["SnapVM", self.testVMname],
+                         [m.name for m in self.inventory.machines()])
+        self.assertTrue(self.inventory.isMediumRegistered(self.testHDpath))
+        self.assertFalse(self.inventory.isMediumRegistered(self.bogusHDpath))
+        # Nothing changed, nothing to read
+        self.assertEqual(0, self.inventory.refresh())
+        stat = os.stat(self.snapVMpath)
+        os.utime(self.snapVMpath, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(1, self.inventory.refresh())
+        self.assertEqual(2, len(self.inventory.machines()))
+
+    def testGetMachine(self):
+        """Test Inventory.getMachine() matches VBoxSettings.parse()"""
+        self.inventory.refresh([self.snapVMpath])
+        settings = VBoxSettings.parse(self.snapVMpath)
+        cached = self.inventory.getMachine("SnapVM")
+        self.assertEqual(settings.machine, cached.machine)
+        self.assertEqual(settings.controllers, cached.controllers)
+        self.assertEqual(settings.attachments, cached.attachments)
+        self.assertEqual(settings.media, cached.media)
+        self.assertEqual(settings.snapshots, cached.snapshots)
+        self.assertEqual(settings.currentSnapshotId, cached.currentSnapshotId)
+        cached = self.inventory.getMachine("{%s}" % settings.machine.id)
+        self.assertEqual(settings.machine.name, cached.machine.name)
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          self.inventory.getMachine, "NoSuchVM")
+
+    def testRemoved(self):
+        """Test Inventory.refresh() drops machines no longer listed"""
+        self.inventory.refresh([self.snapVMpath, self.testVMpath])
+        self.assertEqual(2, len(self.inventory.machines()))
+        os.remove(self.snapVMpath)
+        self.assertEqual(0, self.inventory.refresh([self.snapVMpath,
+                                                    self.testVMpath]))
+        self.assertEqual([self.testVMname],
+                         [m.name for m in self.inventory.machines()])
+        self.assertEqual(1, len(self.inventory.errors))
+        self.inventory.refresh([])
+        self.assertEqual([], self.inventory.machines())
+
+if __name__ == '__main__':
+    main()
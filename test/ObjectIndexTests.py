@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Unittests for ObjectIndex"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import HardDisk
+from pyVBox import ObjectIndex
+from pyVBox import VirtualBoxObjectNotFoundException
+from pyVBox import VirtualMachine
+from pyVBox import connect, shutdown
+
+class ObjectIndexTests(pyVBoxTest):
+    """Test case for ObjectIndex"""
+
+    def setUp(self):
+        pyVBoxTest.setUp(self)
+        self.index = ObjectIndex.enableIndex(events=False)
+
+    def tearDown(self):
+        ObjectIndex.disableIndex()
+        pyVBoxTest.tearDown(self)
+
+    def testFindMachine(self):
+        """Test VirtualMachine.find() through the index"""
+        machine = VirtualMachine.open(self.testVMpath)
+        self.assertRaises(VirtualBoxObjectNotFoundException,
+                          VirtualMachine.find, self.testVMname)
+        machine.register()
+        self.assertEqual(machine.id, VirtualMachine.find(self.testVMname).id)
+        self.assertEqual(machine.id, VirtualMachine.find(machine.id).id)
+        self.assertTrue(machine.isRegistered())
+        machine.unregister()
+        self.assertFalse(machine.isRegistered())
+
+    def testFindMedium(self):
+        """Test HardDisk.find() through the index"""
+        self.assertFalse(HardDisk.isRegistered(self.testHDpath))
+        harddisk = HardDisk.open(self.testHDpath)
+        self.assertTrue(HardDisk.isRegistered(self.testHDpath))
+        self.assertEqual(harddisk.id, HardDisk.find(self.testHDUUID).id)
+        harddisk.close()
+        self.assertFalse(HardDisk.isRegistered(self.testHDpath))
+
+    def testNegativeCache(self):
+        """Test ObjectIndex remembers names not found"""
+        self.assertEqual(None, self.index.findMachine("NoSuchVM"))
+        built = self.index._machines
+        self.assertEqual(None, self.index.findMachine("NoSuchVM"))
+        self.assertTrue(self.index._machines is built)
+
+    def testRebuildWithoutEvents(self):
+        """Test ObjectIndex is rebuilt on each use while events are unwatched"""
+        index = ObjectIndex.ObjectIndex(events=True)
+        self.assertEqual(None, index.findMachine("NoSuchVM"))
+        built = index._machines
+        self.assertEqual(None, index.findMachine("NoSuchVM"))
+        self.assertFalse(index._machines is built)
+
+    def testShutdown(self):
+        """Test shutdown() drops objects from the old connection"""
+        self.assertEqual(None, self.index.findMachine("NoSuchVM"))
+        self.assertNotEqual(None, self.index._machines[0])
+        shutdown()
+        connect()
+        self.assertEqual(None, self.index._machines[0])
+        self.assertEqual(None, self.index._media[0])
+
+if __name__ == '__main__':
+    main()
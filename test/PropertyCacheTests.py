@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Unittests for PropertyCache"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import PropertyCache
+
+import logging
+import threading
+
+class PropertyCacheTests(pyVBoxTest):
+    """Test case for PropertyCache"""
+
+    def testLookup(self):
+        """Test PropertyCache.lookup()"""
+        cache = PropertyCache.PropertyCache()
+        values = iter([1, 2])
+        self.assertEqual(1, cache.lookup("size", lambda: next(values)))
+        self.assertEqual(1, cache.lookup("size", lambda: next(values)))
+        cache.invalidate("size")
+        self.assertEqual(2, cache.lookup("size", lambda: next(values)))
+
+    def testLookupWithoutEvents(self):
+        """Test caches relying on events are bypassed while none are watched"""
+        self.assertFalse(PropertyCache.isEventInvalidationActive())
+        cache = PropertyCache.PropertyCache(events=True)
+        values = iter([1, 2, 3])
+        self.assertEqual(1, cache.lookup("size", lambda: next(values)))
+        self.assertEqual(2, cache.lookup("size", lambda: next(values)))
+        PropertyCache._monitorActive.set()
+        try:
+            self.assertEqual(3, cache.lookup("size", lambda: next(values)))
+            self.assertEqual(3, cache.lookup("size", lambda: next(values)))
+        finally:
+            PropertyCache._monitorActive.clear()
+
+    def testRetry(self):
+        """Test the event invalidation thread recovers from errors"""
+        calls = []
+        watching = threading.Event()
+        def watchEvents():
+            calls.append(1)
+            if len(calls) < 3:
+                raise RuntimeError("no events")
+            watching.set()
+            PropertyCache._monitorStop.wait()
+        savedWatch = PropertyCache._watchEvents
+        savedDelay = PropertyCache.RETRY_DELAY
+        PropertyCache._watchEvents = watchEvents
+        PropertyCache.RETRY_DELAY = 0.01
+        # Keep the expected errors out of the test output
+        logging.getLogger(PropertyCache.__name__).disabled = True
+        try:
+            PropertyCache.startEventInvalidation()
+            watching.wait(5)
+            self.assertEqual(3, len(calls))
+        finally:
+            PropertyCache.stopEventInvalidation()
+            PropertyCache._watchEvents = savedWatch
+            PropertyCache.RETRY_DELAY = savedDelay
+            logging.getLogger(PropertyCache.__name__).disabled = False
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,10 @@
 """Unittests for Session class"""
 
 from pyVBoxTest import pyVBoxTest, main
+from pyVBox import Constants
 from pyVBox import Session
 from pyVBox import VirtualMachine
+from pyVBox import connect, shutdown
 
 class SessionTests(pyVBoxTest):
     """Tests for Session class"""
@@ -13,5 +15,25 @@ class SessionTests(pyVBoxTest):
         s = Session.create()
         self.assertNotEqual(s, None)
 
+    def testAcquire(self):
+        """Test Session.acquire() reuses released sessions"""
+        s = Session.acquire()
+        self.assertTrue(s.isUnlocked() or
+                        s.state == Constants.SessionState_Null)
+        s.release()
+        s2 = Session.acquire()
+        self.assertTrue(s is s2)
+        s2.release()
+
+    def testShutdownClearsPool(self):
+        """Test shutdown() drops pooled sessions"""
+        s = Session.acquire()
+        s.release()
+        shutdown()
+        connect()
+        s2 = Session.acquire()
+        self.assertFalse(s is s2)
+        s2.release()
+
 if __name__ == '__main__':
     main()
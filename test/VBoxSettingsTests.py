@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Unittests for VBoxSettings"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import Constants
+from pyVBox import VBoxSettings
+from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxFileNotFoundException
+from pyVBox import VirtualMachine
+
+import os.path
+import shutil
+
+# Machine with a snapshot, whose disk is a differencing disk
+snapshotVM = """<?xml version="1.0"?>
+<VirtualBox xmlns="http://www.innotek.de/VirtualBox-settings" version="1.11-linux">
+  <Machine uuid="{11111111-2222-3333-4444-555555555555}" name="SnapVM" OSType="Debian" currentSnapshot="{66666666-2222-3333-4444-555555555555}">
+    <MediaRegistry>
+      <HardDisks>
+        <HardDisk uuid="{77777777-2222-3333-4444-555555555555}" location="SnapVM.vdi" format="VDI" type="Normal">
+          <HardDisk uuid="{88888888-2222-3333-4444-555555555555}" location="Snapshots/{88888888-2222-3333-4444-555555555555}.vdi" format="VDI"/>
+        </HardDisk>
+      </HardDisks>
+    </MediaRegistry>
+    <Description>A machine with a snapshot</Description>
+    <Hardware version="2">
+      <CPU count="2"/>
+      <Memory RAMSize="1024"/>
+      <StorageControllers>
+        <StorageController name="SATA" type="AHCI" PortCount="2">
+          <AttachedDevice type="HardDisk" port="1" device="0">
+            <Image uuid="{88888888-2222-3333-4444-555555555555}"/>
+          </AttachedDevice>
+        </StorageController>
+      </StorageControllers>
+    </Hardware>
+    <Snapshot uuid="{66666666-2222-3333-4444-555555555555}" name="Before">
+      <Hardware version="2">
+        <CPU count="1"/>
+        <Memory RAMSize="512"/>
+        <StorageControllers>
+          <StorageController name="SATA" type="AHCI" PortCount="1">
+            <AttachedDevice type="HardDisk" port="0" device="0">
+              <Image uuid="{77777777-2222-3333-4444-555555555555}"/>
+            </AttachedDevice>
+          </StorageController>
+        </StorageControllers>
+      </Hardware>
+    </Snapshot>
+  </Machine>
+</VirtualBox>
+"""
+
+class VBoxSettingsTests(pyVBoxTest):
+    """Test case for VBoxSettings"""
+
+    def testParse(self):
+        """Test VBoxSettings.parse()"""
+        settings = VBoxSettings.parse(self.testVMpath)
+        machine = settings.machine
+        self.assertTrue(isinstance(machine, VirtualMachine._recordType))
+        self.assertEqual(self.testVMname, machine.name)
+        self.assertEqual("0895eb90-4ba1-4d00-833f-d3d2d9cfedcb", machine.id)
+        self.assertEqual("Ubuntu", machine.OSTypeId)
+        self.assertEqual(512, machine.memorySize)
+        self.assertEqual(1, machine.CPUCount)
+        self.assertEqual(12, machine.VRAMSize)
+        self.assertEqual(0, machine.snapshotCount)
+        self.assertEqual(os.path.abspath(self.testVMpath),
+                         machine.settingsFilePath)
+        self.assertEqual(["IDE Controller", "SATA Controller"],
+                         [c.name for c in settings.controllers])
+        self.assertEqual(Constants.StorageBus_SATA,
+                         settings.controllers[1].bus)
+        self.assertEqual(1, len(settings.attachments))
+        dvd = settings.attachments[0]
+        self.assertEqual(Constants.DeviceType_DVD, dvd.type)
+        self.assertEqual("IDE Controller", dvd.controller)
+        self.assertEqual(1, dvd.port)
+        self.assertEqual(None, dvd.mediumId)
+
+    def testParseSnapshot(self):
+        """Test VBoxSettings.parse() of a machine with a snapshot"""
+        path = os.path.join(self.testPath, "SnapVM.vbox")
+        with open(path, "w") as f:
+            f.write(snapshotVM)
+        settings = VBoxSettings.parse(path)
+        machine = settings.machine
+        self.assertEqual("A machine with a snapshot", machine.description)
+        self.assertEqual(2, machine.CPUCount)
+        self.assertEqual(1024, machine.memorySize)
+        self.assertEqual(1, machine.snapshotCount)
+        self.assertEqual(["Before"], [s.name for s in settings.snapshots])
+        self.assertEqual(settings.snapshots[0].id, settings.currentSnapshotId)
+        self.assertEqual(1, len(settings.controllers))
+        self.assertEqual(2, settings.controllers[0].portCount)
+        disks = settings.getHardDrives()
+        self.assertEqual(1, len(disks))
+        self.assertEqual(1, disks[0].port)
+        diffId = "88888888-2222-3333-4444-555555555555"
+        self.assertEqual(diffId, disks[0].mediumId)
+        self.assertEqual(settings.media[diffId].location, disks[0].location)
+        self.assertEqual("77777777-2222-3333-4444-555555555555",
+                         settings.media[diffId].parentId)
+
+    def testParseErrors(self):
+        """Test VBoxSettings.parse() of files that are not settings"""
+        self.assertRaises(VirtualBoxFileNotFoundException,
+                          VBoxSettings.parse, self.bogusVMpath)
+        self.assertRaises(VirtualBoxException,
+                          VBoxSettings.parse, self.testHDpath)
+
+    def testParseAll(self):
+        """Test VBoxSettings.findSettingsFiles() and parseAll()"""
+        path = os.path.join(self.testPath, "TestVM.vbox")
+        shutil.copy(self.testVMpath, path)
+        paths = VBoxSettings.findSettingsFiles(self.testPath)
+        self.assertEqual([path], paths)
+        errors = []
+        settings = VBoxSettings.parseAll(paths + [self.testHDpath], errors)
+        self.assertEqual([self.testVMname],
+                         [s.machine.name for s in settings])
+        self.assertEqual([self.testHDpath], [e[0] for e in errors])
+
+if __name__ == '__main__':
+    main()
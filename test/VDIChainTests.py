@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Unittests for VDIChain"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import VirtualBoxFileNotFoundException
+from pyVBox.VDI import VDI, _fieldOffset
+from pyVBox.VDIChain import VDIChain
+from pyVBox.VDICopier import VDICopier
+from VDITests import allocateBlocks
+
+import os
+import os.path
+import shutil
+import struct
+import uuid
+
+def makeDiff(parentPath, path, blocks):
+    """Create a differencing VDI image at path on top of parentPath.
+
+    blocks is as for allocateBlocks()."""
+    with VDI(parentPath) as parent:
+        parentId = uuid.UUID(parent.id)
+    shutil.copy(pyVBoxTest.testHDsrc, path)
+    with open(path, "r+b") as f:
+        f.seek(_fieldOffset("type"))
+        f.write(struct.pack("<I", VDI.TYPE_DIFF))
+        f.seek(_fieldOffset("uuidCreate"))
+        f.write(uuid.uuid4().bytes_le)
+        f.seek(_fieldOffset("uuidLinkage"))
+        f.write(parentId.bytes_le)
+    allocateBlocks(path, blocks)
+
+class VDIChainTests(pyVBoxTest):
+    """Test case for VDIChain"""
+
+    diffPath = "test/tmp/DiffHD.vdi"
+    rawPath = "test/tmp/ChainHD.img"
+    copyPath = "test/tmp/ChainHD.vdi"
+
+    def tearDown(self):
+        pyVBoxTest.tearDown(self)
+        for path in [self.diffPath, self.rawPath, self.copyPath]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def testRead(self):
+        """Test VDIChain.read()"""
+        allocateBlocks(self.testHDpath, {1: "a", 2: "b"})
+        makeDiff(self.testHDpath, self.diffPath, {2: "c", 3: "d"})
+        with VDIChain(self.diffPath) as chain:
+            self.assertEqual(2, len(chain.images))
+            self.assertEqual(self.testHDUUID, chain.images[1].id)
+            self.assertEqual([1, 2, 3], chain.allocatedBlocks())
+            self.assertEqual(chain.images[1], chain.owner(1))
+            self.assertEqual(chain.images[0], chain.owner(2))
+            self.assertEqual(None, chain.owner(0))
+            blockSize = chain.blockSize
+            self.assertEqual("\0\0aa", chain.read(blockSize - 2, 4))
+            self.assertEqual("aacc", chain.read(2 * blockSize - 2, 4))
+            self.assertEqual("dd", str(chain.block(3)[:2]))
+
+    def testParentNotFound(self):
+        """Test VDIChain with missing parent"""
+        makeDiff(self.testHDpath, self.diffPath, {})
+        os.remove(self.testHDpath)
+        self.assertRaises(VirtualBoxFileNotFoundException,
+                          VDIChain, self.diffPath)
+
+    def testCopyToRaw(self):
+        """Test VDICopier.toRaw() with a differencing image"""
+        allocateBlocks(self.testHDpath, {1: "a", 2: "b"})
+        makeDiff(self.testHDpath, self.diffPath, {2: "c"})
+        copier = VDICopier(self.diffPath)
+        copier.toRaw(self.rawPath)
+        with VDIChain(self.diffPath) as chain:
+            blockSize = chain.blockSize
+        with open(self.rawPath, "rb") as f:
+            f.seek(blockSize)
+            self.assertEqual("a" * blockSize + "c" * blockSize,
+                             f.read(2 * blockSize))
+
+    def testCopyToVDI(self):
+        """Test VDICopier.toVDI() with a differencing image"""
+        allocateBlocks(self.testHDpath, {1: "a", 2: "b"})
+        makeDiff(self.testHDpath, self.diffPath, {2: "c", 4: "\0"})
+        VDICopier(self.diffPath).toVDI(self.copyPath)
+        with VDIChain(self.diffPath) as chain:
+            with VDI(self.copyPath) as copy:
+                self.assertEqual(None, copy.parentId)
+                self.assertEqual(VDI.TYPE_NORMAL, copy.type)
+                self.assertEqual(chain.id, copy.id)
+                self.assertEqual([1, 2], copy.allocatedBlocks())
+                self.assertEqual(chain.read(0, 5 * chain.blockSize),
+                                 copy.read(0, 5 * chain.blockSize))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Unittests for VDICopier"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import VDI
+from pyVBox.VDICopier import VDICopier
+from VDITests import allocateBlocks
+
+import os
+import os.path
+
+class VDICopierTests(pyVBoxTest):
+    """Test case for VDICopier"""
+
+    rawPath = "test/tmp/CopyHD.img"
+    copyPath = "test/tmp/CopyHD.vdi"
+
+    def tearDown(self):
+        pyVBoxTest.tearDown(self)
+        for path in [self.rawPath, self.copyPath]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def testToRaw(self):
+        """Test VDICopier.toRaw()"""
+        allocateBlocks(self.testHDpath, {1: "a", 2: "\0", 3: "b"})
+        copier = VDICopier(self.testHDpath)
+        with VDI(self.testHDpath) as image:
+            blockSize = image.blockSize
+            logicalSize = image.logicalSize
+        calls = []
+        self.assertEqual(2 * blockSize, copier.toRaw(self.rawPath,
+                                                     calls.append))
+        self.assertTrue(len(calls) > 0)
+        self.assertEqual(100, copier.percent)
+        self.assertEqual(logicalSize, os.path.getsize(self.rawPath))
+        with open(self.rawPath, "rb") as f:
+            self.assertEqual("\0" * 4, f.read(4))
+            f.seek(blockSize - 2)
+            self.assertEqual("\0\0aa", f.read(4))
+            f.seek(3 * blockSize)
+            self.assertEqual("bb", f.read(2))
+
+    def testToVDI(self):
+        """Test VDICopier.toVDI()"""
+        allocateBlocks(self.testHDpath, {1: "a", 2: "\0", 5: "b"})
+        copier = VDICopier(self.testHDpath)
+        copier.toVDI(self.copyPath)
+        with VDI(self.testHDpath) as source:
+            with VDI(self.copyPath) as copy:
+                self.assertEqual(source.id, copy.id)
+                self.assertEqual(source.logicalSize, copy.logicalSize)
+                self.assertEqual([1, 5], copy.allocatedBlocks())
+                blockSize = copy.blockSize
+                for offset in [0, blockSize, 2 * blockSize, 5 * blockSize]:
+                    self.assertEqual(source.read(offset, blockSize),
+                                     copy.read(offset, blockSize))
+        self.assertTrue(os.path.getsize(self.copyPath) <
+                        os.path.getsize(self.testHDpath))
+
+    def testToVDINewUUID(self):
+        """Test VDICopier.toVDI() with newUUID"""
+        VDICopier(self.testHDpath).toVDI(self.copyPath, newUUID=True)
+        with VDI(self.copyPath) as copy:
+            self.assertNotEqual(self.testHDUUID, copy.id)
+
+if __name__ == '__main__':
+    main()
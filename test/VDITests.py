@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Unittests for VDI"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import VDI
+from pyVBox import VirtualBoxFileError
+from pyVBox import VirtualBoxFileNotFoundException
+
+import os
+import struct
+
+def allocateBlocks(path, blocks):
+    """Give the VDI image at path data for the given blocks.
+
+    blocks is a dictionary mapping block index to a fill character.
+    Data is appended to the image in order of block index."""
+    image = VDI(path)
+    blocksOffset, dataOffset = image.blocksOffset, image.dataOffset
+    blockSize = image.blockSize
+    image.close()
+    with open(path, "r+b") as f:
+        for entry, index in enumerate(sorted(blocks)):
+            f.seek(blocksOffset + 4 * index)
+            f.write(struct.pack("<I", entry))
+            f.seek(dataOffset + entry * blockSize)
+            f.write(blocks[index] * blockSize)
+        # Allocated block count in header
+        f.seek(0x184)
+        f.write(struct.pack("<I", len(blocks)))
+
+class VDITests(pyVBoxTest):
+    """Test case for VDI"""
+
+    def testOpen(self):
+        """Test VDI()"""
+        image = VDI(self.testHDpath)
+        self.assertEqual(self.testHDUUID, image.id)
+        self.assertEqual(None, image.parentId)
+        self.assertEqual(VDI.TYPE_NORMAL, image.type)
+        self.assertEqual(8 * 1024 * 1024 * 1024, image.logicalSize)
+        self.assertEqual(1024 * 1024, image.blockSize)
+        self.assertEqual(8192, image.blockCount)
+        self.assertEqual(0, image.allocatedSize)
+        self.assertEqual([], image.allocatedBlocks())
+        image.close()
+
+    def testOpenNotVDI(self):
+        """Test VDI() with a file that is not a VDI image"""
+        self.assertRaises(VirtualBoxFileError, VDI, self.testVMpath)
+
+    def testOpenNotFound(self):
+        """Test VDI() with not found file"""
+        self.assertRaises(VirtualBoxFileNotFoundException, VDI,
+                          self.bogusHDpath)
+
+    def testOpenTruncated(self):
+        """Test VDI() with data blocks cut off the end of the file"""
+        allocateBlocks(self.testHDpath, {0: "a", 3: "b"})
+        with open(self.testHDpath, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.truncate(f.tell() - 500000)
+        with VDI(self.testHDpath) as image:
+            self.assertEqual("a" * 4, image.read(0, 4))
+            blockSize = image.blockSize
+            self.assertRaises(VirtualBoxFileError, image.block, 3)
+            self.assertRaises(VirtualBoxFileError, image.read,
+                              3 * blockSize, 4)
+            self.assertRaises(VirtualBoxFileError, list, image.iterBlocks())
+
+    def testRead(self):
+        """Test VDI.read()"""
+        allocateBlocks(self.testHDpath, {1: "a", 3: "b"})
+        with VDI(self.testHDpath) as image:
+            blockSize = image.blockSize
+            self.assertEqual(2 * blockSize, image.allocatedSize)
+            self.assertEqual([1, 3], image.allocatedBlocks())
+            self.assertEqual(bytearray([0x0a]) + bytearray(1023),
+                             image.allocationBitmap())
+            self.assertEqual("\0" * 4, image.read(0, 4))
+            self.assertEqual("\0\0aa", image.read(blockSize - 2, 4))
+            self.assertEqual("a" * 4, str(image.view(blockSize + 8, 4)))
+            self.assertEqual(None, image.view(0, 4))
+            self.assertRaises(ValueError, image.view, blockSize - 2, 4)
+            self.assertEqual([(1, "a"), (3, "b")],
+                             [(index, data[0])
+                              for index, data in image.iterBlocks()])
+            end = image.logicalSize
+            self.assertEqual("\0\0", image.read(end - 2, 4))
+            self.assertRaises(ValueError, image.read, end + 1, 1)
+
+    def testZeroBlocks(self):
+        """Test VDI.zeroBlocks()"""
+        allocateBlocks(self.testHDpath, {1: "a", 2: "\0", 4: "\0"})
+        with VDI(self.testHDpath) as image:
+            self.assertEqual([2, 4], image.zeroBlocks())
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,10 @@
 
 from pyVBoxTest import pyVBoxTest, main
 from pyVBox import VirtualBoxManager
+from pyVBox import connect, isConnected
+
+import subprocess
+import sys
 
 class VirtualBoxManagerTests(pyVBoxTest):
     """Test case for VirtualBoxManager"""
@@ -17,6 +21,27 @@ class VirtualBoxManagerTests(pyVBoxTest):
         vboxManager = VirtualBoxManager()
         vbox = vboxManager.getVirtualBox()
 
+    def testConnect(self):
+        """Test connect() returns the shared VirtualBoxManager"""
+        manager = connect()
+        self.assertTrue(isConnected())
+        self.assertTrue(manager is connect())
+
+    def testImportIsLazy(self):
+        """Test importing pyVBox is cheap and does not connect"""
+        script = ("import time\n"
+                  "start = time.time()\n"
+                  "import pyVBox\n"
+                  "imported = time.time()\n"
+                  "connected = pyVBox.isConnected()\n"
+                  "pyVBox.connect()\n"
+                  "print connected, imported - start, time.time() - imported\n")
+        output = subprocess.check_output([sys.executable, "-c", script])
+        connected, importTime, connectTime = output.split()
+        self.assertEqual("False", connected)
+        # Import should cost less than bootstrapping XPCOM
+        self.assertTrue(float(importTime) < float(connectTime))
+
 if __name__ == '__main__':
     main()
 
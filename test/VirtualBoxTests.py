@@ -17,6 +17,14 @@ class VirtualBoxTests(pyVBoxTest):
         vbox = VirtualBox()
         self.assertNotEqual(None, vbox.guestOSTypes)
 
+    def testGetGuestOSTypes(self):
+        """Test VirtualBox.getGuestOSTypes()"""
+        vbox = VirtualBox()
+        osTypes = vbox.getGuestOSTypes()
+        self.assertEqual(len(vbox.guestOSTypes), len(osTypes))
+        self.assertNotEqual(None, osTypes[0].id)
+        self.assertNotEqual(None, osTypes[0].description)
+
 if __name__ == '__main__':
     main()
 
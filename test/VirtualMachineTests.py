@@ -6,6 +6,7 @@ from pyVBox import Constants
 from pyVBox import HardDisk
 from pyVBox import VirtualBoxException
 from pyVBox import VirtualBoxFileNotFoundException
+from pyVBox import VirtualBoxInvalidSessionStateException
 from pyVBox import VirtualBoxObjectNotFoundException
 from pyVBox import VirtualMachine
 
@@ -27,6 +28,16 @@ class VirtualMachineTests(pyVBoxTest):
             VirtualBoxFileNotFoundException,
             VirtualMachine.open, self.bogusVMpath)
 
+    def testDescribe(self):
+        """Test VirtualMachine.describe()"""
+        machine = VirtualMachine.open(self.testVMpath)
+        info = machine.describe()
+        self.assertEqual(machine.id, info.id)
+        self.assertEqual(machine.name, info.name)
+        self.assertEqual(machine.memorySize, info.memorySize)
+        record = machine.snapshot(["name", "CPUCount"])
+        self.assertEqual(["CPUCount", "name"], sorted(record.fields()))
+
     def testLock(self):
         """Test VirtualMachine.lock()"""
         machine = VirtualMachine.open(self.testVMpath)
@@ -40,6 +51,20 @@ class VirtualMachineTests(pyVBoxTest):
         self.assertTrue(machine.isUnlocked())
         machine.unregister()
 
+    def testNestedLock(self):
+        """Test nested VirtualMachine.lock() calls share a session"""
+        machine = VirtualMachine.open(self.testVMpath)
+        machine.register()
+        with machine.lock() as session:
+            with machine.lock() as session2:
+                self.assertTrue(session is session2)
+            # Inner scope must not unlock
+            self.assertTrue(machine.isLocked())
+            self.assertRaises(VirtualBoxInvalidSessionStateException,
+                              machine.lock(Constants.LockType_Write).__enter__)
+        self.assertTrue(machine.isUnlocked())
+        machine.unregister()
+
     def testRegister(self):
         """Test VirtualMachine.register() and related functions"""
         machine = VirtualMachine.open(self.testVMpath)
@@ -114,6 +139,18 @@ class VirtualMachineTests(pyVBoxTest):
         machine.deleteSnapshot(snapshot)
         self.assertEqual(None, machine.getCurrentSnapshot())
         machine.unregister()
+
+    def testTemporarySnapshot(self):
+        """Test VirtualMachine.temporarySnapshot()"""
+        return # Issue: https://github.com/von/pyVBox/issues/5
+        snapshotName = "Test Snapshot"
+        machine = VirtualMachine.open(self.testVMpath)
+        machine.register()
+        with machine.temporarySnapshot(snapshotName) as snapshot:
+            self.assertEqual(snapshotName, snapshot.name)
+            self.assertEqual(snapshot.id, machine.getCurrentSnapshot().id)
+        self.assertEqual(None, machine.getCurrentSnapshot())
+        machine.unregister()
         
     def testGet(self):
         """Test VirtualMachine.get() method"""
@@ -223,6 +260,46 @@ class VirtualMachineTests(pyVBoxTest):
         machine2 = VirtualMachine.open(self.testVMpath)
         self.assertEqual(newMemorySize, machine2.memorySize)
 
+    def testEdit(self):
+        """Test VirtualMachine.edit()"""
+        machine = VirtualMachine.open(self.testVMpath)
+        machine.register()
+        newMemorySize = machine.memorySize * 2
+        with machine.edit() as editor:
+            editor.memorySize = newMemorySize
+            # Pending value is visible before commit
+            self.assertEqual(newMemorySize, editor.memorySize)
+            editor.CPUCount = machine.CPUCount
+        self.assertEqual(newMemorySize, machine.memorySize)
+        machine.unregister()
+        machine2 = VirtualMachine.open(self.testVMpath)
+        self.assertEqual(newMemorySize, machine2.memorySize)
+
+    def testEditAddStorageControllers(self):
+        """Test adding two controllers of one type in one edit"""
+        machine = VirtualMachine.open(self.testVMpath)
+        machine.register()
+        with machine.edit() as editor:
+            editor.addStorageController(Constants.StorageBus_SCSI)
+            editor.addStorageController(Constants.StorageBus_SCSI)
+        names = [c.name for c in machine.getStorageControllers()
+                 if c.bus == Constants.StorageBus_SCSI]
+        self.assertEqual(2, len(set(names)))
+        for name in names:
+            machine.removeStorageController(name)
+
+    def testEditAbandoned(self):
+        """Test VirtualMachine.edit() applies nothing on exception"""
+        machine = VirtualMachine.open(self.testVMpath)
+        memorySize = machine.memorySize
+        try:
+            with machine.edit() as editor:
+                editor.memorySize = memorySize * 2
+                raise RuntimeError("abandon edit")
+        except RuntimeError:
+            pass
+        self.assertEqual(memorySize, machine.memorySize)
+
     def testClone(self):
         """Test VirtualMachine.clone() method"""
         machine = VirtualMachine.open(self.testVMpath)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Unittests for Waiter"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import Constants
+from pyVBox import MachineStateCondition
+from pyVBox import VirtualBoxTimeoutException
+from pyVBox import VirtualMachine
+from pyVBox import Waiter
+from pyVBox import waitAll, waitAny
+from pyVBox.VirtualBoxException import VirtualBoxOperationAborted
+
+import threading
+
+class WaiterTests(pyVBoxTest):
+    """Test case for Waiter"""
+
+    def testWaitAllSatisfied(self):
+        """Test waitAll() with already satisfied conditions"""
+        machine = VirtualMachine.open(self.testVMpath)
+        condition = MachineStateCondition(machine,
+                                          [Constants.MachineState_PoweredOff])
+        self.assertEqual([condition], waitAll([condition], timeout=1000))
+
+    def testWaitAny(self):
+        """Test waitAny()"""
+        machine = VirtualMachine.open(self.testVMpath)
+        down = MachineStateCondition(machine,
+                                     [Constants.MachineState_PoweredOff])
+        running = MachineStateCondition(machine,
+                                        [Constants.MachineState_Running])
+        self.assertEqual([down], waitAny([running, down], timeout=1000))
+
+    def testTimeout(self):
+        """Test wait timing out"""
+        machine = VirtualMachine.open(self.testVMpath)
+        self.assertRaises(VirtualBoxTimeoutException,
+                          machine.waitUntilRunning, timeout=100)
+
+    def testCancel(self):
+        """Test Waiter.cancel()"""
+        machine = VirtualMachine.open(self.testVMpath)
+        condition = MachineStateCondition(machine,
+                                          [Constants.MachineState_Running])
+        waiter = Waiter()
+        threading.Timer(0.1, waiter.cancel).start()
+        self.assertRaises(VirtualBoxOperationAborted,
+                          waiter.waitAll, [condition])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Unittests for Wrapper"""
+
+from pyVBoxTest import pyVBoxTest, main
+from pyVBox import PropertyCache
+from pyVBox.Wrapper import Wrapper
+
+import time
+
+class Wrapped(object):
+    """Stand-in for a wrapped XPCOM object"""
+    def __init__(self):
+        self.name = "wrapped"
+        self.size = 10
+        self.child = "child"
+        self.empty = None
+
+class TestWrapper(Wrapper):
+    _passthruProperties = [
+        "name",
+        "size",
+        ]
+
+    _wrappedProperties = [
+        ("child", str.upper),
+        ("empty", str.upper),
+        ]
+
+    def __init__(self, wrapped):
+        self._wrappedInstance = wrapped
+
+class WrapperTests(pyVBoxTest):
+    """Test case for Wrapper"""
+
+    def testPassthru(self):
+        """Test getting and setting passthru properties"""
+        wrapped = Wrapped()
+        w = TestWrapper(wrapped)
+        self.assertEqual("wrapped", w.name)
+        w.size = 20
+        self.assertEqual(20, wrapped.size)
+        self.assertEqual(20, w.size)
+        self.assertRaises(AttributeError, delattr, w, "size")
+
+    def testWrapped(self):
+        """Test wrapped properties"""
+        w = TestWrapper(Wrapped())
+        self.assertEqual("CHILD", w.child)
+        self.assertEqual(None, w.empty)
+        self.assertRaises(AttributeError, setattr, w, "child", "other")
+
+    def testUnknownAttribute(self):
+        """Test unknown attributes are neither read nor stored"""
+        w = TestWrapper(Wrapped())
+        self.assertRaises(AttributeError, getattr, w, "bogus")
+        self.assertRaises(AttributeError, setattr, w, "bogus", 1)
+
+    def testSnapshot(self):
+        """Test Wrapper.snapshot()"""
+        wrapped = Wrapped()
+        w = TestWrapper(wrapped)
+        record = w.snapshot()
+        self.assertEqual("wrapped", record.name)
+        self.assertEqual(10, record.size)
+        # Record does not follow changes to the wrapped instance
+        wrapped.size = 20
+        self.assertEqual(10, record.size)
+        self.assertRaises(AttributeError, setattr, record, "size", 30)
+        record = w.snapshot(["name"])
+        self.assertEqual(["name"], record.fields())
+        self.assertRaises(AttributeError, getattr, record, "size")
+        self.assertRaises(AttributeError, w.snapshot, ["bogus"])
+
+    def testCache(self):
+        """Test Wrapper.enableCache()"""
+        wrapped = Wrapped()
+        w = TestWrapper(wrapped)
+        w.enableCache()
+        self.assertEqual(10, w.size)
+        wrapped.size = 20
+        self.assertEqual(10, w.size)
+        w.invalidateCache("size")
+        self.assertEqual(20, w.size)
+        # Setting through the wrapper invalidates
+        w.size = 30
+        self.assertEqual(30, w.size)
+        w.disableCache()
+        wrapped.size = 40
+        self.assertEqual(40, w.size)
+
+    def testCacheInvalidateById(self):
+        """Test PropertyCache.invalidate()"""
+        wrapped = Wrapped()
+        w = TestWrapper(wrapped)
+        w.enableCache()
+        PropertyCache.register("some-id", w)
+        self.assertEqual(10, w.size)
+        wrapped.size = 20
+        PropertyCache.invalidate("some-id")
+        self.assertEqual(20, w.size)
+        PropertyCache.unregister("some-id", w)
+
+    def testCacheTTL(self):
+        """Test Wrapper.enableCache() with a time-to-live"""
+        wrapped = Wrapped()
+        w = TestWrapper(wrapped)
+        w.enableCache(ttl=0.1)
+        self.assertEqual("wrapped", w.name)
+        wrapped.name = "changed"
+        self.assertEqual("wrapped", w.name)
+        time.sleep(0.2)
+        self.assertEqual("changed", w.name)
+
+if __name__ == '__main__':
+    main()
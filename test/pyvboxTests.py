@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Unittests for the pyvbox utility"""
+
+from pyVBoxTest import pyVBoxTest, main
+
+from collections import OrderedDict
+import json
+import optparse
+import os.path
+import StringIO
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "utils"))
+import pyvbox
+
+class RecordCommand(pyvbox.Command):
+    """Record the start and end of each run, for testing batches"""
+    usage = "record [<options>] <key>"
+
+    options = [
+        optparse.make_option("--sleep", type="float", default=0.0),
+        ]
+
+    # (event, args) in the order they happened
+    events = []
+    lock = threading.Lock()
+
+    @classmethod
+    def invoke(cls, args):
+        options, args = cls.parse_options(args)
+        with cls.lock:
+            cls.events.append(("start", args))
+        time.sleep(options.sleep)
+        print " ".join(args)
+        with cls.lock:
+            cls.events.append(("end", args))
+        return 0
+
+class pyvboxTests(pyVBoxTest):
+    """Test case for the pyvbox utility"""
+
+    def setUp(self):
+        pyVBoxTest.setUp(self)
+        pyvbox.Command.register_command("record", RecordCommand)
+        RecordCommand.events = []
+
+    def tearDown(self):
+        del pyvbox.Command.registered_commands["record"]
+        pyVBoxTest.tearDown(self)
+
+    def batchOptions(self, *args):
+        options, args = pyvbox.BatchCommand.parse_options(list(args))
+        return options
+
+    def testReadCommands(self):
+        """Test BatchCommand.read_commands()"""
+        lines = StringIO.StringIO(
+            "# comment\n"
+            "\n"
+            "list\n"
+            "  vm 'My VM' other  \n"
+            '["vm", "My VM", "caf\\u00e9"]\n')
+        self.assertEqual([(3, ["list"]),
+                          (4, ["vm", "My VM", "other"]),
+                          (5, ["vm", "My VM", "caf\xc3\xa9"])],
+                         pyvbox.BatchCommand.read_commands(lines))
+        for bad in ["vm 'unterminated\n", "[\"vm\", 1]\n", "[\"vm\"\n"]:
+            self.assertRaises(Exception, pyvbox.BatchCommand.read_commands,
+                              StringIO.StringIO("list\n" + bad))
+
+    def testEntryKey(self):
+        """Test BatchCommand.entry_key() skips options and their values"""
+        key = pyvbox.BatchCommand.entry_key
+        self.assertEqual("vm1", key(["backup", "-j", "4", "vm1", "/d"]))
+        self.assertEqual("vm1", key(["backup", "vm1"]))
+        self.assertEqual("vm1", key(["backup", "--jobs=4", "vm1"]))
+        self.assertEqual(None, key(["list"]))
+        self.assertEqual(None, key(["backup", "--bogus", "vm1"]))
+        self.assertEqual(None, key(["backup", "--help"]))
+        self.assertEqual(None, key(["nosuchcommand", "vm1"]))
+        self.assertEqual(None, key([]))
+
+    def testRunParallel(self):
+        """Test BatchCommand.run_parallel() orders commands sharing a key"""
+        entries = [(1, ["record", "--sleep", "0.2", "a", "1"]),
+                   (2, ["record", "b"]),
+                   (3, ["record", "--sleep", "0.1", "a", "2"]),
+                   (4, ["record", "c"])]
+        savedStdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            results = pyvbox.BatchCommand.run_parallel(
+                entries, 4, self.batchOptions("--json"))
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = savedStdout
+        self.assertEqual([1, 2, 3, 4], [r["line"] for r in results])
+        self.assertEqual(["a 1\n", "b\n", "a 2\n", "c\n"],
+                         [r["stdout"] for r in results])
+        self.assertEqual([0] * 4, [r["status"] for r in results])
+        # Reported in file order
+        self.assertEqual([1, 2, 3, 4],
+                         [json.loads(line)["line"]
+                          for line in output.splitlines()])
+        events = RecordCommand.events
+        # Different keys ran at once, the same key one after the other
+        self.assertTrue(events.index(("start", ["b"])) <
+                        events.index(("end", ["a", "1"])))
+        self.assertTrue(events.index(("end", ["a", "1"])) <
+                        events.index(("start", ["a", "2"])))
+
+    def testMessageStream(self):
+        """Test message() writes to a stream set for the thread only"""
+        savedStdout, savedStderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+        def report():
+            pyvbox._messages.stream = sys.stderr
+            try:
+                pyvbox.message("from thread")
+            finally:
+                pyvbox._messages.stream = None
+        try:
+            thread = threading.Thread(target=report)
+            thread.start()
+            thread.join()
+            pyvbox.message("from main")
+            stdout, stderr = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = savedStdout, savedStderr
+        self.assertEqual("from main\n", stdout)
+        self.assertEqual("from thread\n", stderr)
+        self.assertEqual(1, pyvbox.verbosityLevel)
+
+    def write(self, format, records, fields=["name", "memorySize"]):
+        """Write records with a RecordWriter, returning the output"""
+        stream = StringIO.StringIO()
+        writer = pyvbox.RecordWriter(format, fields, stream)
+        for record in records:
+            writer.write(record)
+        writer.close()
+        return stream.getvalue()
+
+    def records(self):
+        Record = pyvbox.VirtualMachine._recordType
+        return [Record(name="vm1", memorySize=512),
+                Record(name=u"caf\xe9")]
+
+    def testRecordWriterJSON(self):
+        """Test RecordWriter framing of a JSON array"""
+        self.assertEqual("[]\n", self.write("json", []))
+        output = self.write("json", self.records())
+        self.assertEqual([{"name" : "vm1", "memorySize" : 512},
+                          {"name" : u"caf\xe9", "memorySize" : None}],
+                         json.loads(output))
+        self.assertTrue(output.startswith("[\n{\"name\": \"vm1\""))
+        self.assertEqual(["name", "memorySize"],
+                         json.loads(output,
+                                    object_pairs_hook=OrderedDict)[0].keys())
+        self.assertRaises(Exception, pyvbox.RecordWriter, "xml", ["name"])
+
+    def testRecordWriterJSONLines(self):
+        """Test RecordWriter writing a JSON object per line"""
+        self.assertEqual("", self.write("jsonl", []))
+        lines = self.write("jsonl", self.records()).splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual({"name" : "vm1", "memorySize" : 512},
+                         json.loads(lines[0]))
+
+    def testRecordWriterCSV(self):
+        """Test RecordWriter writing CSV, with a header even when empty"""
+        self.assertEqual("name,memorySize\n", self.write("csv", []))
+        self.assertEqual("name,memorySize\nvm1,512\ncaf\xc3\xa9,\n",
+                         self.write("csv", self.records()))
+
+    def testRecordWriterText(self):
+        """Test RecordWriter writing tab-separated values"""
+        self.assertEqual("", self.write("text", []))
+        self.assertEqual("vm1\t512\ncaf\xc3\xa9\t\n",
+                         self.write("text", self.records()))
+
+    def testRecordWriterOptions(self):
+        """Test Command.record_writer() and the --format/--fields options"""
+        Record = pyvbox.VirtualMachine._recordType
+        def writer(format, fields):
+            options = optparse.Values({"format" : format, "fields" : fields})
+            return pyvbox.Command.record_writer(options, Record, ["name"])
+        self.assertEqual(None, writer("text", None))
+        self.assertEqual(["name"], writer("json", None).fields)
+        self.assertEqual("csv", writer("csv", None).format)
+        self.assertEqual(["name", "memorySize"],
+                         writer("text", " name, memorySize,").fields)
+        self.assertRaises(Exception, writer, "json", "name,bogus")
+
+    def testWriteMachines(self):
+        """Test Command.write_machines() with records"""
+        stream = StringIO.StringIO()
+        writer = pyvbox.RecordWriter("csv", ["name"], stream)
+        self.assertEqual(0, pyvbox.Command.write_machines(writer,
+                                                          self.records()))
+        self.assertEqual("name\nvm1\ncaf\xc3\xa9\n", stream.getvalue())
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,39 @@
 """pyVBox utility to control VirtualBox VMs.
 """
 
+from pyVBox.BackupArchive import ArchiveWriter
+from pyVBox.BackupStore import BackupStore
 from pyVBox import HardDisk
+from pyVBox import ObjectIndex
+from pyVBox.CloneEngine import CloneEngine
+from pyVBox.Compaction import CompactionPlanner
+from pyVBox import Daemon
+from pyVBox.Fleet import Fleet
+from pyVBox import GuestOSType
+from pyVBox.IncrementalBackup import IncrementalBackup
+from pyVBox.Inventory import Inventory
+from pyVBox.VDICopier import VDICopier
+from pyVBox import VBoxSettings
 from pyVBox import VirtualBox
 from pyVBox import VirtualBoxException
+from pyVBox import VirtualBoxObjectNotFoundException
 from pyVBox import VirtualMachine
+from pyVBox import connect
+from pyVBox import shutdown
 
+from collections import OrderedDict
+from contextlib import contextmanager
+from StringIO import StringIO
 import atexit
+import csv
+import json
 import optparse
 import os.path
+import shlex
+import signal
 import sys
+import threading
+import time
 import traceback
 
 #----------------------------------------------------------------------
@@ -21,6 +45,18 @@ import traceback
 # Default = 1, 0 = quiet, 2 = verbose
 verbosityLevel = 1
 
+# Inventory to answer queries from instead of VirtualBox, if --cached
+inventory = None
+
+# Are commands being run by a daemon?
+daemonMode = False
+
+# Where message() and verboseMsg() write in this thread, if not stdout
+_messages = threading.local()
+
+def _messageStream():
+    return getattr(_messages, "stream", None) or sys.stdout
+
 def errorMsg(msg):
     sys.stderr.write(msg + "\n")
 
@@ -34,14 +70,102 @@ def handle_exception(e, msg=None):
 
 def message(msg):
     if verbosityLevel > 0:
-        sys.stdout.write(msg + "\n")
-        sys.stdout.flush()
+        stream = _messageStream()
+        stream.write(msg + "\n")
+        stream.flush()
 
 def verboseMsg(msg):
     if verbosityLevel > 1:
-        sys.stdout.write(msg + "\n")
-        sys.stdout.flush()
-
+        stream = _messageStream()
+        stream.write(msg + "\n")
+        stream.flush()
+
+class ThreadOutput(object):
+    """Stands in for sys.stdout or sys.stderr while threads capture output.
+
+    What a thread writes goes to the buffer it set as attribute name of
+    local, or if it set none, to stream."""
+
+    def __init__(self, stream, local, name):
+        self.stream = stream
+        self.local = local
+        self.name = name
+
+    def _target(self):
+        buffer = getattr(self.local, self.name, None)
+        if buffer is None:
+            return self.stream
+        return buffer
+
+    def write(self, data):
+        self._target().write(data)
+
+    def writelines(self, lines):
+        self._target().writelines(lines)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self):
+        return (self._target() is self.stream) and self.stream.isatty()
+
+
+class RecordWriter(object):
+    """Writes records one at a time, as they are read.
+
+    format is "json" (a JSON array of objects), "jsonl" (a JSON object
+    per line), "csv" (with a header line) or "text" (tab-separated
+    values). Only the named fields of each record are written, in
+    order. Each record is flushed out as soon as it is written."""
+
+    formats = ["text", "json", "jsonl", "csv"]
+
+    def __init__(self, format, fields, stream=None):
+        if format not in self.formats:
+            raise Exception("Unknown format \"%s\"" % format)
+        self.format = format
+        self.fields = fields
+        if stream is None:
+            stream = sys.stdout
+        self.stream = stream
+        self.count = 0
+        if format == "csv":
+            self._csv = csv.writer(stream, lineterminator="\n")
+
+    def write(self, record):
+        """Write the fields of record, a Record. Unset fields are null."""
+        values = [getattr(record, name, None) for name in self.fields]
+        if self.format in ("json", "jsonl"):
+            line = json.dumps(OrderedDict(zip(self.fields, values)))
+            if self.format == "json":
+                line = ("[\n" if self.count == 0 else ",\n") + line
+            else:
+                line += "\n"
+            self.stream.write(line)
+        elif self.format == "csv":
+            if self.count == 0:
+                self._csv.writerow(self.fields)
+            self._csv.writerow([self._text(value) for value in values])
+        else:
+            self.stream.write("\t".join(self._text(value)
+                                        for value in values) + "\n")
+        self.stream.flush()
+        self.count += 1
+
+    def close(self):
+        """Finish the output, ending the JSON array or CSV table."""
+        if self.format == "json":
+            self.stream.write("[]\n" if self.count == 0 else "\n]\n")
+        elif (self.format == "csv") and (self.count == 0):
+            self._csv.writerow(self.fields)
+        self.stream.flush()
+
+    def _text(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        return str(value)
 
 def show_progress(progress, prefix="Progess: "):
     """Given a Progress instance, display progress to user as percent.
@@ -63,33 +187,128 @@ def show_progress(progress, prefix="Progess: "):
     else:
         progress.waitForCompletion()
 
+def show_clone_progress(engine, prefix="Progress: "):
+    """Given a CloneEngine, display its overall progress to user as percent.
+
+    Called by the engine each time it checks progress.
+    If running in quiet mode, displays nothing."""
+    if verbosityLevel > 0:
+        running = len([job for job in engine.jobs
+                       if job.isStarted() and not job.isDone()])
+        print "%s%2d%% (%d running)\r" % (prefix, engine.percent(), running),
+        sys.stdout.flush()
+
+def show_copy_progress(copier, prefix="Progress: "):
+    """Given a VDICopier, display its progress to user as percent.
+
+    Called by the copier after each write.
+    If running in quiet mode, displays nothing."""
+    if verbosityLevel > 0:
+        print "%s%2d%%\r" % (prefix, copier.percent),
+        sys.stdout.flush()
+
+def report_clones(engine, showProgress=True):
+    """Report result and throughput of each clone in a finished CloneEngine.
+
+    Returns True if all clones succeeded."""
+    if showProgress and (verbosityLevel > 0):
+        # End line left by show_clone_progress()
+        print
+    for job in engine.jobs:
+        if job.error is not None:
+            errorMsg("Failed to clone %s: %s" % (job, job.error))
+        elif job.isDone():
+            message("Cloned %s (%.1f MB/s)" % (job,
+                                               job.throughput() / 1048576))
+        else:
+            errorMsg("Did not clone %s" % job)
+    return all(job.isDone() and (job.error is None) for job in engine.jobs)
+
+@contextmanager
+def frozen_disks(vm, live=False):
+    """Context manager keeping a VM's hard drives from changing.
+
+    Returns list of the hard drives. A running VM is paused, or if
+    live is True, keeps running while a temporary snapshot diverts
+    its writes."""
+    if not vm.isRunning():
+        yield vm.getHardDrives()
+    elif live:
+        # Drives as attached before the snapshot become read-only
+        disks = vm.getHardDrives()
+        verboseMsg("Taking snapshot...")
+        with vm.temporarySnapshot("pyVBox backup",
+                                  "Temporary snapshot for backup"):
+            yield disks
+            verboseMsg("Deleting snapshot...")
+    else:
+        verboseMsg("Pausing VM...")
+        # Must wait until paused or will have race condition for lock
+        # on disks.
+        vm.pause(wait=True)
+        try:
+            yield vm.getHardDrives()
+        finally:
+            vm.resume()
+
 def print_vm(vm):
     """Given a VM instance, display all the information about it."""
-    print "VM: %s" % vm.name
-    print "  Id: %s" % vm.id
+    info = vm.snapshot(["name", "id", "CPUCount", "memorySize", "VRAMSize",
+                        "monitorCount"])
+    print "VM: %s" % info.name
+    print "  Id: %s" % info.id
     osType = vm.getOSType()
     print "  OS: %s" % osType.description
-    print "  CPU count: %d" % vm.CPUCount
-    print "  RAM: %d MB" % vm.memorySize
-    print "  VRAM: %d MB" % vm.VRAMSize
-    print "  Monitors: %d" % vm.monitorCount
+    print "  CPU count: %d" % info.CPUCount
+    print "  RAM: %d MB" % info.memorySize
+    print "  VRAM: %d MB" % info.VRAMSize
+    print "  Monitors: %d" % info.monitorCount
     attachments = vm.getMediumAttachments()
     for attachment in attachments:
         medium = attachment.medium
         type = attachment.type
+        location = attachment.snapshot(["controller", "port"])
         print "  Device: %s" % type
         if medium:
-            print "    Medium: %s" % medium.name
-            print "    Id: %s" % medium.id
-            print "    Location: %s" % medium.location
-            print "    Format: %s" % medium.format
-            print "    Size: %s" % medium.size
-        print "    Controller: %s Port: %d" % (attachment.controller,
-                                                 attachment.port)
+            mediumInfo = medium.snapshot(["name", "id", "location",
+                                          "format", "size"])
+            print "    Medium: %s" % mediumInfo.name
+            print "    Id: %s" % mediumInfo.id
+            print "    Location: %s" % mediumInfo.location
+            print "    Format: %s" % mediumInfo.format
+            print "    Size: %s" % mediumInfo.size
+        print "    Controller: %s Port: %d" % (location.controller,
+                                                 location.port)
     snapshot = vm.getCurrentSnapshot()
     if snapshot:
         print "  Current Snapshot: %s" % snapshot.name
 
+def print_settings(settings):
+    """Given a MachineSettings instance, display the VM it describes."""
+    info = settings.machine
+    print "VM: %s" % info.name
+    print "  Id: %s" % info.id
+    print "  Settings: %s" % settings.path
+    print "  OS: %s" % info.OSTypeId
+    print "  CPU count: %d" % info.CPUCount
+    print "  RAM: %d MB" % info.memorySize
+    print "  VRAM: %d MB" % info.VRAMSize
+    print "  Monitors: %d" % info.monitorCount
+    for attachment in settings.attachments:
+        print "  Device: %s" % attachment.type
+        if attachment.mediumId:
+            print "    Id: %s" % attachment.mediumId
+            print "    Location: %s" % attachment.location
+        print "    Controller: %s Port: %d" % (attachment.controller,
+                                                 attachment.port)
+    print "  Snapshots: %d" % info.snapshotCount
+
+class QuietOptionParser(optparse.OptionParser):
+    """OptionParser that raises OptParseError instead of exiting."""
+
+    def error(self, msg):
+        raise optparse.OptParseError(msg)
+
 #----------------------------------------------------------------------
 #
 # Commands
@@ -98,6 +317,21 @@ class Command:
     """Base class for all commands."""
     usage = "<command> <arguments"
 
+    # Can the command be run by a daemon on behalf of the client?
+    forwardable = True
+
+    # optparse.Option instances for options specific to the command
+    options = []
+
+    # Options of commands that can write records, see record_writer()
+    format_options = [
+        optparse.make_option("--format", default="text",
+                             choices=RecordWriter.formats,
+                             help="output format: %s (default text)" % ", ".join(RecordWriter.formats)),
+        optparse.make_option("--fields", default=None,
+                             help="comma-separated properties to show; only these are read from VirtualBox"),
+        ]
+
     @classmethod
     def invoke(cls, args):
         """Invoke the command.
@@ -110,15 +344,73 @@ class Command:
 
     @classmethod
     def harddisk(cls, string):
-        """Load a harddisk described by string.
+        """Load a harddisk described by string, a path or UUID.
+
+        Will open disk if needed. With --cached, a disk file the
+        inventory does not list as registered is opened without first
+        being looked up."""
+        if ((inventory is not None) and os.path.exists(string) and
+            not inventory.isMediumRegistered(string)):
+            try:
+                return HardDisk.open(string)
+            except VirtualBoxException:
+                # Registered since the settings files were read
+                return HardDisk.find(string)
+        try:
+            return HardDisk.find(string)
+        except VirtualBoxObjectNotFoundException:
+            return HardDisk.open(string)
 
-        Will open disk if needed."""
-        # TODO: Should also support string being UUID
-        if HardDisk.isRegistered(string):
-            hd = HardDisk.find(string)
+    @classmethod
+    def parse_options(cls, args):
+        """Parse the command's options from args.
+
+        Returns (options, remaining args)."""
+        parser = optparse.OptionParser(usage="%prog [options] " + cls.usage,
+                                       option_list=cls.options)
+        return parser.parse_args(args)
+
+    @classmethod
+    def record_writer(cls, options, recordType, defaultFields):
+        """Return RecordWriter for the --format and --fields options.
+
+        Returns None if neither was given, leaving the command to
+        display its usual text. recordType is the Record class whose
+        fields may be chosen."""
+        if options.fields is None:
+            if options.format == "text":
+                return None
+            fields = defaultFields
         else:
-            hd = HardDisk.open(string)
-        return hd
+            fields = [name.strip() for name in options.fields.split(",")
+                      if name.strip()]
+            unknown = [name for name in fields
+                       if name not in recordType.__slots__]
+            if unknown:
+                raise Exception("Unknown field(s) %s, choose from: %s" %
+                                (", ".join(unknown),
+                                 ", ".join(sorted(recordType.__slots__))))
+        return RecordWriter(options.format, fields)
+
+    @classmethod
+    def write_machines(cls, writer, machines):
+        """Write each of machines with writer as soon as it is read.
+
+        machines are VirtualMachine instances, of which only the fields
+        being written are read, or records. Returns the number of
+        machines that could not be read."""
+        failures = 0
+        for machine in machines:
+            if isinstance(machine, VirtualMachine):
+                try:
+                    machine = machine.snapshot(writer.fields)
+                except VirtualBoxException as e:
+                    errorMsg("Could not read VM: %s" % e)
+                    failures += 1
+                    continue
+            writer.write(machine)
+        writer.close()
+        return failures
 
     @classmethod
     def register_command(cls, name, command):
@@ -177,45 +469,502 @@ Command.register_command("attach", AttachCommand)
 
 class BackupCommand(Command):
     """Back up a virtual machine to the given directory."""
-    usage = "backup <VM name> <target directory>"
+    usage = "backup [<options>] <VM name> [<target directory>]"
+
+    options = [
+        optparse.make_option("-j", "--jobs", type="int", default=4,
+                             help="number of disks to copy at once"),
+        optparse.make_option("--per-device", type="int", default=None,
+                             dest="perDevice",
+                             help="most disks to copy at once to one device (default no limit)"),
+        optparse.make_option("--direct", action="store_true", default=False,
+                             help="copy VDI images directly rather than cloning through VirtualBox, copying only blocks in use"),
+        optparse.make_option("--raw", action="store_true", default=False,
+                             help="with --direct, write sparse raw images"),
+        optparse.make_option("--bwlimit", type="int", default=None,
+                             help="with --direct, most KB per second to write"),
+        optparse.make_option("--incremental", action="store_true",
+                             default=False,
+                             help="copy only VDI blocks changed since the last incremental backup to the target directory"),
+        optparse.make_option("--store", default=None,
+                             help="back up VDI disks into the deduplicating store in directory STORE instead of a target directory"),
+        optparse.make_option("--live", action="store_true", default=False,
+                             help="keep a running VM running, copying its disks from behind a temporary snapshot rather than pausing it"),
+        optparse.make_option("--archive", default=None,
+                             help="write settings and disks to a compressed tar archive ARCHIVE instead of a target directory, - for standard output"),
+        optparse.make_option("--codec", default="gzip",
+                             help="with --archive, compression codec (gzip, bzip2, none, or zstd and lz4 if installed)"),
+        optparse.make_option("--threads", type="int", default=4,
+                             help="with --archive, number of compression threads"),
+        ]
 
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
         if len(args) < 1:
             raise Exception("Missing virtual machine argument")
         vm = VirtualMachine.find(args.pop(0))
-        if len(args) < 1:
+        if (options.store is not None) or (options.archive is not None):
+            targetDir = None
+        elif len(args) < 1:
             raise Exception("Missing target directory argument")
-        targetDir = args.pop(0)
-        verboseMsg("Backing up %s to %s" % (vm, targetDir))
-        if vm.isRunning():
-            verboseMsg("Pausing VM...")
-            # Must wait until paused or will have race condition for lock
-            # on disks.
-            vm.pause(wait=True)
-            atexit.register(vm.resume)
+        else:
+            targetDir = args.pop(0)
+        if options.archive != "-":
+            return cls.backup(vm, targetDir, options)
+        # Standard output carries the archive, so report on standard error
+        _messages.stream = sys.stderr
+        try:
+            return cls.backup(vm, targetDir, options)
+        finally:
+            _messages.stream = None
+
+    @classmethod
+    def backup(cls, vm, targetDir, options, showProgress=True):
+        """Back up vm to targetDir. Return exit code for program."""
+        verboseMsg("Backing up %s to %s" %
+                   (vm, targetDir or options.store or options.archive))
+        if options.archive is not None:
+            return cls.backup_to_archive(vm, options)
         # Todo: Backup settings file in some way.
         # Todo: Want to back up devices than hard drives?
-        disks = vm.getHardDrives()
+        with frozen_disks(vm, options.live) as disks:
+            if options.store is not None:
+                return cls.backup_to_store(vm, disks, options.store)
+            if options.incremental:
+                return cls.backup_incremental(disks, targetDir)
+            if options.direct:
+                return cls.copy_disks(disks, targetDir, options, showProgress)
+            engine = CloneEngine(maxConcurrent=options.jobs,
+                                 maxPerDevice=options.perDevice)
+            for disk in disks:
+                targetFilename = os.path.join(targetDir, disk.basename())
+                # Todo: Need to resolve file already existing here.
+                verboseMsg("Backing up disk %s to %s (%d bytes)" %
+                           (disk, targetFilename, disk.size))
+                engine.add(disk, targetFilename)
+            engine.run(show_clone_progress if showProgress else None)
+            status = 0 if report_clones(engine, showProgress) else 1
+            for job in engine.jobs:
+                if job.isStarted() and (job.error is None):
+                    # Remove newly created clone from registry
+                    clone = HardDisk.find(job.path)
+                    clone.close()
+        return status
+
+    @classmethod
+    def copy_disks(cls, disks, targetDir, options, showProgress=True):
+        """Copy VDI disks directly to targetDir. Return exit code for program."""
+        status = 0
+        bandwidth = None
+        if options.bwlimit:
+            bandwidth = options.bwlimit * 1024
+        callback = show_copy_progress if showProgress else None
         for disk in disks:
-            targetFilename = os.path.join(targetDir, disk.basename())
-            # Todo: Need to resolve file already existing here.
-            verboseMsg("Backing up disk %s to %s (%d bytes)" % (disk,
-                                                                targetFilename,
-                                                                disk.size))
-            progress = disk.clone(targetFilename, wait=False)
-            show_progress(progress)
-            # Remove newly created clone from registry
-            clone = HardDisk.find(targetFilename)
-            clone.close()
-                   
+            if disk.format != "VDI":
+                errorMsg("Cannot copy %s directly: not a VDI image" % disk)
+                status = 1
+                continue
+            basename = disk.basename()
+            if options.raw:
+                basename = os.path.splitext(basename)[0] + ".img"
+            targetFilename = os.path.join(targetDir, basename)
+            verboseMsg("Copying disk %s to %s" % (disk, targetFilename))
+            copier = VDICopier(disk.location, bandwidth=bandwidth)
+            try:
+                if options.raw:
+                    copier.toRaw(targetFilename, callback)
+                else:
+                    copier.toVDI(targetFilename, callback=callback)
+            except VirtualBoxException as e:
+                errorMsg("Failed to copy %s: %s" % (disk, e))
+                status = 1
+                continue
+            finally:
+                if showProgress and (verbosityLevel > 0):
+                    # End line left by show_copy_progress()
+                    print
+            message("Copied %s (%d MB in use)" % (disk,
+                                                  copier.bytesCopied / 1048576))
+        return status
+
+    @classmethod
+    def backup_incremental(cls, disks, targetDir):
+        """Incrementally back up VDI disks to targetDir. Return exit code for program."""
+        status = 0
+        backup = IncrementalBackup(targetDir)
+        for disk in disks:
+            if disk.format != "VDI":
+                errorMsg("Cannot back up %s incrementally: not a VDI image" %
+                         disk)
+                status = 1
+                continue
+            # Disks in different directories may share a file name
+            name = "%s.%s" % (os.path.splitext(disk.basename())[0], disk.id)
+            verboseMsg("Backing up disk %s as %s" % (disk, name))
+            try:
+                delta = backup.backup(disk.location, name=name)
+            except VirtualBoxException as e:
+                errorMsg("Failed to back up %s: %s" % (disk, e))
+                status = 1
+                continue
+            if delta is None:
+                message("%s unchanged" % disk)
+            else:
+                message("Backed up %s to %s (%d bytes)" %
+                        (disk, delta, os.path.getsize(delta)))
+        return status
+
+    @classmethod
+    def backup_to_archive(cls, vm, options):
+        """Write vm's settings and disks to an archive. Return exit code for program."""
+        if options.archive == "-":
+            output = sys.stdout
+        else:
+            output = open(options.archive, "wb")
+        try:
+            archive = ArchiveWriter(output, codec=options.codec,
+                                    threads=options.threads)
+            # Settings first, before a temporary snapshot appears in them
+            settings = vm.settingsFilePath
+            verboseMsg("Archiving %s" % settings)
+            archive.addFile(settings,
+                            os.path.join(vm.name, os.path.basename(settings)))
+            settingsDir = os.path.dirname(settings)
+            with frozen_disks(vm, options.live) as disks:
+                # A disk of a VM with snapshots is a differencing image,
+                # which cannot be restored without its ancestors
+                archived = set()
+                for disk in disks:
+                    for medium in reversed(disk.getChain()):
+                        location = medium.location
+                        if location in archived:
+                            continue
+                        archived.add(location)
+                        verboseMsg("Archiving disk %s (%d bytes)" %
+                                   (medium, medium.size))
+                        archive.addFile(location,
+                                        cls.archive_name(vm.name, settingsDir,
+                                                         location))
+            archive.close()
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        message("Archived %s to %s (%d MB compressed from %d MB)" %
+                (vm, options.archive, archive.bytesOut / 1048576,
+                 archive.bytesIn / 1048576))
+        return 0
+
+    @classmethod
+    def archive_name(cls, vmName, settingsDir, location):
+        """Return name in an archive of the file at location.
+
+        Files under the VM's settings directory keep their path relative
+        to it (e.g. Snapshots/...), so the settings file still refers to
+        them; others are stored by basename."""
+        relative = os.path.relpath(location, settingsDir)
+        if relative.startswith(os.pardir):
+            relative = os.path.basename(location)
+        return os.path.join(vmName, relative)
+
+    @classmethod
+    def backup_to_store(cls, vm, disks, storePath):
+        """Back up VDI disks into the store at storePath. Return exit code for program."""
+        status = 0
+        store = BackupStore(storePath)
+        for disk in disks:
+            if disk.format != "VDI":
+                errorMsg("Cannot back up %s to store: not a VDI image" % disk)
+                status = 1
+                continue
+            name = "%s.%s" % (vm.name, os.path.splitext(disk.basename())[0])
+            verboseMsg("Backing up disk %s as %s" % (disk, name))
+            try:
+                info = store.backup(disk.location, name=name)
+            except VirtualBoxException as e:
+                errorMsg("Failed to back up %s: %s" % (disk, e))
+                status = 1
+                continue
+            message("Backed up %s as %s (%d MB new data)" %
+                    (disk, info["id"], info["newBytes"] / 1048576))
+        return status
+
 Command.register_command("backup", BackupCommand)
 
+class BatchCommand(Command):
+    """Run many commands in one process"""
+    usage = "batch [<options>] <file or ->\n\n" \
+        "Each line of the file is a command and its arguments, quoted as\n" \
+        "for the shell, or a JSON list of them. Blank lines and lines\n" \
+        "starting with # are skipped. With --jobs, commands whose first\n" \
+        "argument other than options (usually the VM name) differs run at\n" \
+        "once, while those sharing it run one after the other, in order."
+
+    # Reads its commands from the client's standard input
+    forwardable = False
+
+    options = [
+        optparse.make_option("-j", "--jobs", type="int", default=1,
+                             help="number of commands to run at once"),
+        optparse.make_option("--json", action="store_true", default=False,
+                             help="write a JSON object per command with its line, arguments, exit status, time and output"),
+        optparse.make_option("--keep-going", dest="keepGoing",
+                             action="store_true", default=False,
+                             help="run the remaining commands after one fails"),
+        ]
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
+        if len(args) < 1:
+            raise Exception("Missing command file argument")
+        if args[0] == "-":
+            entries = cls.read_commands(sys.stdin)
+        else:
+            with open(args[0]) as f:
+                entries = cls.read_commands(f)
+        jobs = max(options.jobs, 1)
+        if (jobs > 1) and (inventory is not None):
+            # The inventory's database may only be used by this thread
+            verboseMsg("Running commands one at a time with --cached")
+            jobs = 1
+        startTime = time.time()
+        if jobs > 1:
+            results = cls.run_parallel(entries, jobs, options)
+        else:
+            results = cls.run_sequential(entries, options)
+        failed = len([r for r in results if r["status"] != 0])
+        skipped = len(entries) - len(results)
+        if not options.json:
+            message("Ran %d commands in %.2fs, %d failed" %
+                    (len(results), time.time() - startTime, failed))
+        if skipped:
+            errorMsg("Skipped %d commands after a failure" % skipped)
+        if failed or skipped:
+            return 1
+        return 0
+
+    @classmethod
+    def read_commands(cls, f):
+        """Return (line number, argv) of each command in file f."""
+        entries = []
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if (not line) or line.startswith("#"):
+                continue
+            try:
+                if line.startswith("["):
+                    argv = json.loads(line)
+                    if not all(isinstance(arg, basestring) for arg in argv):
+                        raise ValueError("Arguments must be strings")
+                    argv = [arg.encode("utf-8") for arg in argv]
+                else:
+                    argv = shlex.split(line)
+            except ValueError as e:
+                raise Exception("Line %d: %s" % (number, e))
+            entries.append((number, argv))
+        return entries
+
+    @classmethod
+    def run_sequential(cls, entries, options):
+        """Run entries one after the other. Return their results."""
+        results = []
+        for number, argv in entries:
+            result = cls.execute(number, argv, capture=options.json)
+            cls.report(result, options.json)
+            results.append(result)
+            if (result["status"] != 0) and not options.keepGoing:
+                break
+        return results
+
+    @classmethod
+    def run_parallel(cls, entries, jobs, options):
+        """Run entries in jobs threads. Return their results.
+
+        Output is captured and reported in the order of entries."""
+        manager = connect()
+        # Entries with the key each must not share with a running one
+        pending = [(number, argv, cls.entry_key(argv))
+                   for number, argv in entries]
+        # Keys of the commands running
+        running = set()
+        # Results by position in entries, and the next to report
+        results = {}
+        state = {"reported" : 0, "failed" : False}
+        positions = dict((entry[0], i) for i, entry in enumerate(entries))
+        condition = threading.Condition()
+
+        def take():
+            """Return the next entry that may run, or None if done."""
+            with condition:
+                while pending:
+                    if state["failed"] and not options.keepGoing:
+                        return None
+                    for entry in pending:
+                        key = entry[2]
+                        if (key is None) or (key not in running):
+                            pending.remove(entry)
+                            if key is not None:
+                                running.add(key)
+                            return entry
+                    condition.wait()
+                return None
+
+        def worker():
+            manager.initPerThread()
+            try:
+                while True:
+                    entry = take()
+                    if entry is None:
+                        break
+                    number, argv, key = entry
+                    result = cls.execute(number, argv, capture=True)
+                    with condition:
+                        running.discard(key)
+                        results[positions[number]] = result
+                        if result["status"] != 0:
+                            state["failed"] = True
+                        while state["reported"] in results:
+                            cls.report(results[state["reported"]],
+                                       options.json)
+                            state["reported"] += 1
+                        condition.notify_all()
+            finally:
+                manager.deinitPerThread()
+
+        local = threading.local()
+        savedStdout, savedStderr = sys.stdout, sys.stderr
+        sys.stdout = ThreadOutput(savedStdout, local, "stdout")
+        sys.stderr = ThreadOutput(savedStderr, local, "stderr")
+        cls._local = local
+        try:
+            threads = [threading.Thread(target=worker)
+                       for i in range(min(jobs, len(entries)))]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                # Join with a timeout so KeyboardInterrupt gets through
+                while thread.isAlive():
+                    thread.join(1.0)
+        finally:
+            sys.stdout, sys.stderr = savedStdout, savedStderr
+            cls._local = None
+        # Those after a gap left by skipped commands
+        for position in sorted(results):
+            if position >= state["reported"]:
+                cls.report(results[position], options.json)
+        return [results[position] for position in sorted(results)]
+
+    # threading.local of the worker threads while run_parallel() runs
+    _local = None
+
+    @classmethod
+    def entry_key(cls, argv):
+        """Return what commands that must not run at once share, or None.
+
+        This is the first argument of the command that is neither an
+        option nor an option's value, normally the VM name, as found by
+        parsing argv with the command's own options. Command lines that
+        do not parse have no key; they fail when run."""
+        if len(argv) < 1:
+            return None
+        try:
+            command = Command.lookup_command_by_name(argv[0])
+        except KeyError:
+            return None
+        parser = QuietOptionParser(option_list=command.options,
+                                   add_help_option=False)
+        try:
+            options, args = parser.parse_args(list(argv[1:]))
+        except optparse.OptParseError:
+            return None
+        if len(args) < 1:
+            return None
+        return args[0]
+
+    @classmethod
+    def execute(cls, number, argv, capture=False):
+        """Run command line argv from line number. Return its result.
+
+        The result is a dictionary of the line number, the arguments,
+        the exit status and the seconds taken. If capture is True, the
+        output is collected into it as well, instead of written out."""
+        local = cls._local
+        if capture:
+            stdout, stderr = StringIO(), StringIO()
+            if local is not None:
+                local.stdout, local.stderr = stdout, stderr
+            else:
+                savedStdout, savedStderr = sys.stdout, sys.stderr
+                sys.stdout, sys.stderr = stdout, stderr
+        startTime = time.time()
+        try:
+            try:
+                if len(argv) < 1:
+                    raise Exception("Missing command")
+                try:
+                    command = Command.lookup_command_by_name(argv[0])
+                except KeyError:
+                    raise Exception("Unrecognized command \"%s\"" % argv[0])
+                status = command.invoke(list(argv[1:]))
+            except SystemExit as e:
+                # optparse errors
+                status = e.code
+            except Exception as e:
+                handle_exception(e)
+                status = 1
+        finally:
+            if capture:
+                if local is not None:
+                    local.stdout, local.stderr = None, None
+                else:
+                    sys.stdout, sys.stderr = savedStdout, savedStderr
+        if not isinstance(status, int):
+            status = 0 if status is None else 1
+        result = {
+            "line" : number,
+            "argv" : argv,
+            "status" : status,
+            "seconds" : round(time.time() - startTime, 3),
+            }
+        if capture:
+            result["stdout"] = stdout.getvalue()
+            result["stderr"] = stderr.getvalue()
+        return result
+
+    @classmethod
+    def report(cls, result, asJSON=False):
+        """Write out the output, exit status and time of a command."""
+        if asJSON:
+            result = dict(result)
+            for name in ("stdout", "stderr"):
+                if isinstance(result.get(name), str):
+                    result[name] = result[name].decode("utf-8", "replace")
+            sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+            sys.stdout.flush()
+            return
+        sys.stdout.write(result.get("stdout", ""))
+        sys.stderr.write(result.get("stderr", ""))
+        summary = "Line %d: %s: exit %d in %.2fs" % (
+            result["line"], " ".join(result["argv"]), result["status"],
+            result["seconds"])
+        if result["status"] != 0:
+            errorMsg(summary)
+        else:
+            message(summary)
+
+Command.register_command("batch", BatchCommand)
+
 class BootVMCommand(Command):
     """Boot a virtual machine and eject it after power down"""
     usage = "boot <VM settings file> [<HD files>]"
 
+    # Relies on atexit to eject the VM
+    forwardable = False
+
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
@@ -244,11 +993,20 @@ Command.register_command("boot", BootVMCommand)
 
 class CloneCommand(Command):
     """Clone a VM. Cloned VM will be registered."""
-    usage = "clone <source VM name> <target VM name>"
-    
+    usage = "clone [<options>] <source VM name> <target VM name>"
+
+    options = [
+        optparse.make_option("-j", "--jobs", type="int", default=4,
+                             help="number of disks to copy at once"),
+        optparse.make_option("--per-device", type="int", default=None,
+                             dest="perDevice",
+                             help="most disks to copy at once to one device (default no limit)"),
+        ]
+
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
         if len(args) < 1:
             raise Exception("Missing source VM name argument")
         srcVM = VirtualMachine.find(args.pop(0))
@@ -259,6 +1017,8 @@ class CloneCommand(Command):
         cloneVM = srcVM.clone(targetName)
         # Now clone and attach disks
         disks = srcVM.getHardDrives()
+        engine = CloneEngine(maxConcurrent=options.jobs,
+                             maxPerDevice=options.perDevice)
         for disk in disks:
             # Generate new HD filename by prefixing new VM name.
             # Not the greatest, but not sure what the best way is.
@@ -269,9 +1029,12 @@ class CloneCommand(Command):
                     % (disk,
                        os.path.basename(targetFilename),
                        disk.size))
-            progress = disk.clone(targetFilename, wait=False)
-            show_progress(progress)
-            cloneHD = HardDisk.find(targetFilename)
+            engine.add(disk, targetFilename)
+        engine.run(show_clone_progress)
+        if not report_clones(engine):
+            return 1
+        for job in engine.jobs:
+            cloneHD = HardDisk.find(job.path)
             message("Attaching %s to %s" % (cloneHD, cloneVM))
             cloneVM.attachMedium(cloneHD)
         return 0
@@ -317,6 +1080,49 @@ class CreateHDCommand(Command):
 
 Command.register_command("createhd", CreateHDCommand)
 
+class DaemonCommand(Command):
+    """Serve commands from other pyvbox invocations"""
+    usage = "daemon [<options>]"
+
+    forwardable = False
+
+    options = [
+        optparse.make_option("--socket", default=None,
+                             help="listen on SOCKET (default $PYVBOX_SOCKET or %s)" % Daemon.DEFAULT_PATH),
+        ]
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        global daemonMode
+        options, args = cls.parse_options(args)
+        connect()
+        ObjectIndex.enableIndex()
+        daemonMode = True
+        server = Daemon.Server(cls.run, options.socket)
+        server.listen()
+        message("Listening on %s" % server.path)
+        # Exit through serveForever() so the socket is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serveForever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    @classmethod
+    def run(cls, argv, stdout, stderr):
+        """Run a command line forwarded by a client."""
+        global verbosityLevel
+        global inventory
+        verbosityLevel = 1
+        if inventory is not None:
+            inventory.close()
+            inventory = None
+        return main(["pyvbox", "--no-daemon"] + argv)
+
+Command.register_command("daemon", DaemonCommand)
+
 class DelSnapshotCommand(Command):
     """Delete the current snapshot"""
     usage = "delsnapshot <VM name>"
@@ -350,6 +1156,110 @@ class EjectCommand(Command):
 
 Command.register_command("eject", EjectCommand)
 
+class FleetCommand(Command):
+    """Apply an operation to many VMs at once"""
+    usage = "fleet [<options>] <operation> <VM names or globs>\n\n" \
+        "Operations: %s" % ", ".join(sorted(["start", "poweroff", "pause",
+                                             "resume", "snapshot", "eject",
+                                             "backup"]))
+
+    options = [
+        optparse.make_option("-j", "--jobs", type="int", default=8,
+                             help="number of VMs to operate on at once"),
+        optparse.make_option("--timeout", type="float", default=None,
+                             help="seconds to allow for each VM"),
+        optparse.make_option("--type", default="gui",
+                             help="session type for start (gui, vrdp or headless)"),
+        optparse.make_option("--name", default=None,
+                             help="snapshot name for snapshot"),
+        optparse.make_option("--description", default=None,
+                             help="snapshot description for snapshot"),
+        optparse.make_option("--target", default=None,
+                             help="target directory for backup, each VM is backed up to a subdirectory named after it"),
+        ]
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
+        if len(args) < 1:
+            raise Exception("Missing operation argument")
+        operation = args.pop(0)
+        if len(args) < 1:
+            raise Exception("Missing virtual machine name argument")
+        kwargs = {}
+        if operation == "start":
+            operation = "powerOn"
+            kwargs["type"] = options.type
+        elif operation == "poweroff":
+            operation = "powerOff"
+        elif operation == "snapshot":
+            if options.name is None:
+                raise Exception("Missing --name for snapshot")
+            kwargs["name"] = options.name
+            kwargs["description"] = options.description
+        elif operation == "backup":
+            if options.target is None:
+                raise Exception("Missing --target for backup")
+            operation = cls.backup_operation(options.target)
+        elif operation not in ["pause", "resume", "eject"]:
+            raise Exception("Unknown operation \"%s\"" % operation)
+        vms = Fleet.select(args)
+        if len(vms) == 0:
+            errorMsg("No VMs matched.")
+            return 1
+        timeout = None
+        if options.timeout is not None:
+            timeout = int(options.timeout * 1000)
+        fleet = Fleet(vms, maxWorkers=options.jobs, timeout=timeout)
+        verboseMsg("Operating on %d VMs" % len(vms))
+        results = fleet.apply(operation, **kwargs)
+        status = 0
+        for result in results:
+            if result.ok:
+                message(str(result))
+            else:
+                errorMsg(str(result))
+                status = 1
+        return status
+
+    @classmethod
+    def backup_operation(cls, targetDir):
+        """Return Fleet operation backing up a VM under targetDir."""
+        backupOptions, args = BackupCommand.parse_options([])
+        def backup(vm):
+            vmDir = os.path.join(targetDir, vm.name)
+            if not os.path.exists(vmDir):
+                os.makedirs(vmDir)
+            if BackupCommand.backup(vm, vmDir, backupOptions,
+                                    showProgress=False) != 0:
+                raise Exception("Backup failed")
+        return backup
+
+Command.register_command("fleet", FleetCommand)
+
+class GCCommand(Command):
+    """Remove unused data from a backup store"""
+    usage = "gc [<options>] <store directory>"
+
+    options = [
+        optparse.make_option("--keep", type="int", default=None,
+                             help="first remove all but the newest KEEP backups of each disk"),
+        ]
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
+        if len(args) < 1:
+            raise Exception("Missing store directory argument")
+        store = BackupStore(args.pop(0))
+        removed, freed = store.gc(keep=options.keep)
+        message("Removed %d chunks (%d MB)" % (removed, freed / 1048576))
+        return 0
+
+Command.register_command("gc", GCCommand)
+
 class HelpCommand(Command):
     """Provide help"""
     usage = "help [<commands>]"
@@ -377,13 +1287,56 @@ class HelpCommand(Command):
 
 Command.register_command("help", HelpCommand)
 
+class InspectCommand(Command):
+    """Display VMs from their settings files, without VirtualBox"""
+    usage = "inspect <VM settings files or directories>"
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        if len(args) < 1:
+            raise Exception("Missing settings file or directory argument")
+        paths = []
+        for arg in args:
+            if os.path.isdir(arg):
+                paths.extend(VBoxSettings.findSettingsFiles(arg))
+            else:
+                paths.append(arg)
+        errors = []
+        for settings in VBoxSettings.parseAll(paths, errors):
+            print_settings(settings)
+        for path, e in errors:
+            errorMsg("Could not read %s: %s" % (path, e))
+        if errors:
+            return 1
+        return 0
+
+Command.register_command("inspect", InspectCommand)
+
 class ListCommand(Command):
     """Display a list of all available virtual machines"""
-    usage = "list"
+    usage = "list [<options>]"
+
+    options = Command.format_options
 
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
+        writer = cls.record_writer(options, VirtualMachine._recordType,
+                                   ["name", "id"])
+        if writer is not None:
+            if inventory is not None:
+                machines = inventory.machines()
+            else:
+                machines = VirtualMachine.getAll()
+            if cls.write_machines(writer, machines):
+                return 1
+            return 0
+        if inventory is not None:
+            for machine in inventory.machines():
+                print machine.name
+            return 0
         vms = VirtualMachine.getAll()
         for vm in vms:
             try:
@@ -397,12 +1350,23 @@ Command.register_command("list", ListCommand)
 
 class OSTypesCommand(Command):
     """Display all the available guest OS types"""
-    usage = "guestOSTypes"
+    usage = "guestOSTypes [<options>]"
+
+    options = Command.format_options
 
     @classmethod
     def invoke(cls, args):
         """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
+        writer = cls.record_writer(options, GuestOSType._recordType,
+                                   ["id", "description", "familyId",
+                                    "is64Bit"])
         osTypes = VirtualBox().getGuestOSTypes()
+        if writer is not None:
+            for ostype in osTypes:
+                writer.write(ostype)
+            writer.close()
+            return 0
         for ostype in osTypes:
             print "%s (%s)" % (ostype.description, ostype.id)
         return 0
@@ -424,6 +1388,56 @@ class PauseCommand(Command):
 
 Command.register_command("pause", PauseCommand)
 
+class ReclaimCommand(Command):
+    """Report space wasted on zeros in VM disks, optionally compacting them"""
+    usage = "reclaim [<options>] [<VM names or globs>]"
+
+    options = [
+        optparse.make_option("--compact", action="store_true", default=False,
+                             help="compact disks worth compacting (VMs must be powered off)"),
+        optparse.make_option("--min-size", type="int", default=0,
+                             dest="minSize",
+                             help="only compact disks with at least MINSIZE MB reclaimable"),
+        optparse.make_option("--min-ratio", type="float", default=0.0,
+                             dest="minRatio",
+                             help="only compact disks with at least MINRATIO of their file reclaimable"),
+        ]
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
+        if args:
+            vms = Fleet.select(args)
+        else:
+            vms = [vm for vm in VirtualMachine.getAll() if vm.accessible]
+        planner = CompactionPlanner(minReclaimable=options.minSize * 1048576,
+                                    minRatio=options.minRatio)
+        for vm in vms:
+            verboseMsg("Scanning %s" % vm)
+            planner.addMachine(vm)
+        for report in planner.reports:
+            print "%s: %s" % (report.machine, report)
+        for path, reason in planner.skipped:
+            verboseMsg("Skipped %s: %s" % (path, reason))
+        for name, total in sorted(planner.byMachine().items()):
+            print "%s: %d MB reclaimable" % (name, total / 1048576)
+        print "Total: %d MB reclaimable" % (planner.totalReclaimable() /
+                                            1048576)
+        if not options.compact:
+            return 0
+        status = [0]
+        def report_compaction(report, error):
+            if error is None:
+                message("Compacted %s" % report.path)
+            else:
+                errorMsg("Did not compact %s: %s" % (report.path, error))
+                status[0] = 1
+        planner.compact(report_compaction)
+        return status[0]
+
+Command.register_command("reclaim", ReclaimCommand)
+
 class RegisterCommand(Command):
     """Register a VM"""
     usage = "register <VM settings filename> [<VM settings filename>...]"
@@ -444,6 +1458,58 @@ class RegisterCommand(Command):
 
 Command.register_command("register", RegisterCommand)
 
+class RestoreCommand(Command):
+    """Restore a disk image from an incremental backup or a backup store"""
+    usage = "restore [<options>] <manifest file> <target image>\n" \
+        "       restore [<options>] --store <store directory> <backup id> <target image>\n" \
+        "       restore --store <store directory> --list"
+
+    options = [
+        optparse.make_option("--store", default=None,
+                             help="restore from the backup store in directory STORE"),
+        optparse.make_option("--list", action="store_true", default=False,
+                             help="with --store, list backups in the store"),
+        optparse.make_option("--raw", action="store_true", default=False,
+                             help="write a sparse raw image rather than a VDI image"),
+        optparse.make_option("--upto", type="int", default=None,
+                             help="restore as of backup number UPTO, counting from 0, rather than the latest"),
+        ]
+
+    @classmethod
+    def invoke(cls, args):
+        """Invoke the command. Return exit code for program."""
+        options, args = cls.parse_options(args)
+        if options.store is not None:
+            store = BackupStore(options.store)
+            if options.list:
+                for backup in store.backups():
+                    print "%s %s (%d chunks)" % (
+                        backup["id"],
+                        time.strftime("%Y-%m-%d %H:%M:%S",
+                                      time.localtime(backup["time"])),
+                        backup["chunks"])
+                return 0
+        if len(args) < 1:
+            if options.store is not None:
+                raise Exception("Missing backup id argument")
+            raise Exception("Missing manifest file argument")
+        source = args.pop(0)
+        if len(args) < 1:
+            raise Exception("Missing target image argument")
+        target = args.pop(0)
+        if os.path.exists(target):
+            raise Exception("Target %s already exists" % target)
+        if options.store is not None:
+            count = store.restore(source, target, raw=options.raw)
+        else:
+            count = IncrementalBackup.restore(source, target,
+                                              raw=options.raw,
+                                              upTo=options.upto)
+        message("Restored %d blocks to %s" % (count, target))
+        return 0
+
+Command.register_command("restore", RestoreCommand)
+
 class ResumeCommand(Command):
     """Resume a paused VM"""
     usage = "resume <VM name>"
@@ -516,10 +1582,24 @@ Command.register_command("unregister", UnregisterCommand)
 
 class VMCommand(Command):
     """Display information about one or more VMs"""
-    usage = "vm [<vm names>]"
+    usage = "vm [<options>] [<vm names>]"
+
+    options = Command.format_options
+
+    # Fields written by default with --format
+    default_fields = ["name", "id", "OSTypeId", "state", "CPUCount",
+                      "memorySize", "VRAMSize", "monitorCount",
+                      "snapshotCount"]
 
     @classmethod
     def invoke(cls, args):
+        options, args = cls.parse_options(args)
+        writer = cls.record_writer(options, VirtualMachine._recordType,
+                                   cls.default_fields)
+        if writer is not None:
+            return cls.invoke_records(writer, args)
+        if inventory is not None:
+            return cls.invoke_cached(args)
         if len(args) == 0:
             vms = VirtualMachine.getAll()
             verboseMsg("Registered VMs:")
@@ -536,12 +1616,56 @@ class VMCommand(Command):
                 except Exception as e:
                     errorMsg("Could not display information about VM \"%s\": %s" % (vmName, str(e)))
 
+    @classmethod
+    def invoke_cached(cls, args):
+        """Display VMs from the inventory."""
+        if len(args) == 0:
+            verboseMsg("Registered VMs:")
+            for machine in inventory.machines():
+                print "\t%s" % machine.name
+            return 0
+        for vmName in args:
+            try:
+                print_settings(inventory.getMachine(vmName))
+            except Exception as e:
+                errorMsg("Could not display information about VM \"%s\": %s" % (vmName, str(e)))
+        return 0
+
+    @classmethod
+    def invoke_records(cls, writer, args):
+        """Write the named VMs, or all VMs if none are named, with writer."""
+        notFound = []
+        def machines():
+            if len(args) == 0:
+                if inventory is not None:
+                    for machine in inventory.machines():
+                        yield machine
+                else:
+                    for machine in VirtualMachine.getAll():
+                        yield machine
+            for vmName in args:
+                try:
+                    if inventory is not None:
+                        machine = inventory.getMachine(vmName).machine
+                    else:
+                        machine = VirtualMachine.find(vmName)
+                except VirtualBoxException as e:
+                    errorMsg("Could not find VM \"%s\": %s" % (vmName, e))
+                    notFound.append(vmName)
+                    continue
+                yield machine
+        failures = cls.write_machines(writer, machines())
+        if failures or notFound:
+            return 1
+        return 0
+
 Command.register_command("vm", VMCommand)
 
 #----------------------------------------------------------------------
 
 def main(argv=None):
     global verbosityLevel
+    global inventory
 
     if argv is None:
         argv = sys.argv
@@ -549,27 +1673,64 @@ def main(argv=None):
     usage = "usage: %prog [options] <command> [<arguments>]"
     version= "%prog 1.0"
     parser = optparse.OptionParser(usage=usage, version=version)
+    # Leave options following the command to the command
+    parser.disable_interspersed_args()
     parser.add_option("-q", "--quiet", dest="verbosityLevel",
                       action="store_const", const=0,
                       help="surpress all messages")
     parser.add_option("-v", "--verbose", dest="verbosityLevel",
                       action="store_const", const=2,
                       help="be verbose")
-    (options, args) = parser.parse_args()
+    parser.add_option("--cached", action="store_true", default=False,
+                      help="answer list and vm from an inventory of the settings files instead of VirtualBox, and use it to skip looking up unregistered disks")
+    parser.add_option("--cache-file", dest="cacheFile", default=None,
+                      help="keep inventory in CACHEFILE (default %s)" % Inventory.DEFAULT_PATH)
+    parser.add_option("--socket", default=None,
+                      help="forward commands to the daemon listening on SOCKET (default $PYVBOX_SOCKET or %s)" % Daemon.DEFAULT_PATH)
+    parser.add_option("--no-daemon", dest="noDaemon", action="store_true",
+                      default=False,
+                      help="run the command here even if a daemon is running")
+    (options, args) = parser.parse_args(argv[1:])
     if len(args) < 1:
         parser.error("missing command")
     commandStr = args.pop(0)
 
-    if options.verbosityLevel != None:
-        verbosityLevel = options.verbosityLevel
-        verboseMsg("Setting verbosity level to %d" % verbosityLevel)
-
     try:
         command = Command.lookup_command_by_name(commandStr)
     except Exception, e:
         parser.error("Unrecognized command \"%s\"" % commandStr)
         return 1
 
+    if command.forwardable and not options.noDaemon:
+        try:
+            status = Daemon.forward(argv[1:], options.socket)
+        except Exception, e:
+            handle_exception(e)
+            return 1
+        if status is not None:
+            return status
+
+    if options.verbosityLevel != None:
+        verbosityLevel = options.verbosityLevel
+        verboseMsg("Setting verbosity level to %d" % verbosityLevel)
+
+    # Registered first so it runs after any other atexit handlers
+    # (e.g. vm.resume) that still need the connection. A daemon keeps
+    # its connection between commands.
+    if not daemonMode:
+        atexit.register(shutdown)
+
+    if options.cached:
+        try:
+            inventory = Inventory(options.cacheFile)
+            parsed = inventory.refresh()
+        except Exception, e:
+            handle_exception(e, "Could not update inventory")
+            return 1
+        verboseMsg("Read %d settings files into inventory" % parsed)
+        for path, e in inventory.errors:
+            verboseMsg("Could not read %s: %s" % (path, e))
+
     try:
         status = command.invoke(args)
     except Exception, e: